@@ -618,8 +618,15 @@ if ($ServerUrl -ne "http://0.0.0.0/upload" ) {
 
     $json = $data | ConvertTo-Json -Depth 10
     try{
-        
-        Invoke-RestMethod -Uri $ServerUrl -Method Post -Body $json -ContentType "application/json"
+        # Gzip the report; the server decompresses bodies sent with Content-Encoding: gzip
+        $jsonBytes = [System.Text.Encoding]::UTF8.GetBytes($json)
+        $buffer = New-Object System.IO.MemoryStream
+        $gzip = New-Object System.IO.Compression.GZipStream($buffer, [System.IO.Compression.CompressionMode]::Compress)
+        $gzip.Write($jsonBytes, 0, $jsonBytes.Length)
+        $gzip.Close()
+        $body = $buffer.ToArray()
+
+        Invoke-RestMethod -Uri $ServerUrl -Method Post -Body $body -ContentType "application/json" -Headers @{ "Content-Encoding" = "gzip" }
         # Write-Host "`nResponse Status Code: $($response.StatusCode)"
     } catch{
         $date = Get-Date -Format "yyyy-MM-dd_HH-mm-ss"
@@ -0,0 +1,55 @@
+# conftest.py
+# Puts Backend/ on sys.path so the tests import `utils` like the server does, and keeps the
+# jobs DB of a test in its own temporary directory.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import job_manager  # noqa: E402
+
+
+@pytest.fixture
+def jobs_db(tmp_path, monkeypatch):
+    """A fresh state/jobs.db under tmp_path for the duration of the test."""
+    monkeypatch.setattr(job_manager, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(job_manager, "JOBS_DB", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_manager, "CREDENTIAL_KEY_FILE", str(tmp_path / "credentials.key"))
+    monkeypatch.setattr(job_manager, "_conn", None)
+    monkeypatch.setattr(job_manager, "_cipher", None)
+    yield tmp_path
+    if job_manager._conn is not None:
+        job_manager._conn.close()
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Name of a project whose DB and report files live under tmp_path; its writer is stopped afterwards."""
+    from utils import db_pool, payload_store, store_data  # noqa: F401 (store_data registers the schema hooks)
+    monkeypatch.setattr(db_pool, "DB_DIR", str(tmp_path))
+    monkeypatch.setattr(payload_store, "REPORTS_DIR", str(tmp_path / "reports"))
+    monkeypatch.setattr(payload_store, "OBJECTS_DIR", str(tmp_path / "reports" / "objects"))
+    # Named after the test: background syncs may still hold a writer opened by an earlier test
+    yield tmp_path.name
+    db_pool.close_all()
+
+
+@pytest.fixture
+def agent_payload():
+    """Builds a small upload shaped like the one scripts/Agent.ps1 posts."""
+    def build(name="HOST01", ip="10.0.0.1", software=("Editor", "Browser"), **sections):
+        data = {
+            "AssetProjectDetails": {"ProjectName": "tests", "ClientIp": ip, "MachineName": name},
+            "AssetDetails": {"SystemName": name, "OperatingSystem": "Windows 11 Pro", "Ram Size": "16",
+                             "MacAddress": "02-00-00-00-00-01"},
+            "Users": [{"Name": "alice", "SID": "S-1-5-21-1-1001", "IsActive": True}],
+            "Hardware": [{"NetworkAdapters": [{"NICName": "Ethernet", "IPv4Addresses": ip, "DHCP": False}]}],
+            "Software": [{"Name": title, "Version": "1.0"} for title in software],
+            "Security": [{"Antivirus": {"Name": "Defender", "AntivirusEnabled": True}},
+                         {"Firewall": [{"Profile": "Domain", "Enabled": True}]}],
+        }
+        data.update(sections)
+        return data
+    return build
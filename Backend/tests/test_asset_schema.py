@@ -0,0 +1,51 @@
+# test_asset_schema.py
+import sqlite3
+
+from utils import asset_schema
+from utils.db_pool import reader
+from utils.store_data import create_db_and_store_results
+
+
+def store(project, data):
+    details = data["AssetProjectDetails"]
+    return create_db_and_store_results(project, details["ClientIp"], details["MachineName"], "Success", data,
+                                       wait=True).result()
+
+
+def test_list_and_object_values_are_indexed(project, agent_payload):
+    data = agent_payload(Hardware=[{"NetworkAdapters": [{
+        "NICName": "Ethernet", "IPv4Addresses": ["10.0.0.1", "192.168.56.1"],
+        "DHCPServer": {"Address": "10.0.0.254"}, "DHCP": True}]}])
+    scan_id = store(project, data)
+    with reader(project) as conn:
+        assert conn.execute("SELECT ipv4, dhcp_server FROM asset_network_adapters WHERE scan_id = ?",
+                            (scan_id,)).fetchone() == ("10.0.0.1, 192.168.56.1", '{"Address": "10.0.0.254"}')
+        assert conn.execute("SELECT av_name, fw_domain FROM asset_security WHERE scan_id = ?",
+                            (scan_id,)).fetchone() == ("Defender", "1")
+
+
+def test_failed_indexing_keeps_the_raw_row(project, agent_payload, monkeypatch):
+    def fail(*args):
+        raise sqlite3.InterfaceError("Error binding parameter 2: type 'list' is not supported")
+
+    monkeypatch.setattr(asset_schema, "_index_rows", fail)
+    scan_id = store(project, agent_payload())
+    with reader(project) as conn:
+        assert conn.execute("SELECT status FROM scan_results WHERE id = ?", (scan_id,)).fetchone() == ("Success",)
+        assert conn.execute("SELECT COUNT(*) FROM assets").fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM asset_security").fetchone() == (0,)
+
+
+def test_newer_scan_replaces_the_latest_asset(project, agent_payload):
+    first = store(project, agent_payload())
+    second = store(project, agent_payload(ip="10.0.0.2"))
+    with reader(project) as conn:
+        assert conn.execute("SELECT scan_id, client_ip FROM assets WHERE is_latest = 1").fetchall() == \
+            [(second, "10.0.0.2")]
+        assert conn.execute("SELECT is_latest FROM assets WHERE scan_id = ?", (first,)).fetchone() == (0,)
+
+
+def test_column_coercion():
+    assert asset_schema.column(["a", None, 2]) == "a, 2"
+    assert asset_schema.column({"b": 1, "a": [2]}) == '{"a": [2], "b": 1}'
+    assert asset_schema.column(3.5) == 3.5
@@ -0,0 +1,61 @@
+# test_db_pool.py
+import threading
+
+import pytest
+
+from utils import db_pool
+from utils.db_pool import get_writer, reader, register_schema, submit_write
+
+
+def insert(ip):
+    return lambda conn: conn.execute(
+        "INSERT INTO scan_results (client_ip, system_name, status, json_data) VALUES (?, '', 'Failed', '\"x\"')",
+        (ip,)).lastrowid
+
+
+def test_writes_are_visible_once_their_future_resolves(project):
+    futures = [submit_write(project, insert(f"10.0.0.{n}")) for n in range(1, 51)]
+    ids = [future.result(timeout=10) for future in futures]
+    assert ids == sorted(ids) and len(set(ids)) == 50
+    with reader(project) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM scan_results").fetchone() == (50,)
+
+
+def test_failing_item_leaves_its_batch_alone(project):
+    def fail(conn):
+        insert("10.0.0.2")(conn)
+        raise ValueError("rejected")
+
+    # Hold the writer so that the three items land in one batch
+    started, release = threading.Event(), threading.Event()
+    submit_write(project, lambda conn: (started.set(), release.wait(5)))
+    started.wait(5)
+    futures = [submit_write(project, insert("10.0.0.1")), submit_write(project, fail),
+               submit_write(project, insert("10.0.0.3"))]
+    release.set()
+
+    assert futures[0].result(timeout=10) and futures[2].result(timeout=10)
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=10)
+    with reader(project) as conn:
+        assert [row[0] for row in conn.execute("SELECT client_ip FROM scan_results ORDER BY id")] == \
+            ["10.0.0.1", "10.0.0.3"]
+
+
+def test_one_writer_per_project(project):
+    assert get_writer(project) is get_writer(project)
+    assert get_writer(project) is not get_writer(f"{project}-other")
+
+
+def test_schema_reaches_databases_already_open(project, monkeypatch):
+    monkeypatch.setattr(db_pool, "_schema_hooks", list(db_pool._schema_hooks))
+    get_writer(project)
+    register_schema(lambda conn: conn.execute("CREATE TABLE IF NOT EXISTS late_table (x)"))
+    with reader(project) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'late_table'").fetchone()
+
+
+def test_reader_needs_an_existing_database(project):
+    with pytest.raises(FileNotFoundError):
+        with reader("missing"):
+            pass
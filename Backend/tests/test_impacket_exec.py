@@ -0,0 +1,56 @@
+# test_impacket_exec.py
+# Reuse of cached WMI sessions, with a fake session standing in for impacket.
+import pytest
+
+from utils import impacket_exec
+from utils.impacket_exec import ExecError
+
+PASSWORDS = {"admin": "right"}
+
+
+class FakeSession:
+    logins = []
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.last_used = 0
+        self.aborted = False
+
+    def login(self, username, password, domain):
+        FakeSession.logins.append((username, password))
+        if PASSWORDS.get(username) != password:
+            raise Exception("rpc_s_access_denied")
+        self.last_used = impacket_exec.time.monotonic()
+
+    def create_process(self, command):
+        return 0
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_impacket(monkeypatch):
+    monkeypatch.setattr(impacket_exec, "IMPACKET_AVAILABLE", True)
+    monkeypatch.setattr(impacket_exec, "_WmiSession", FakeSession)
+    monkeypatch.setattr(FakeSession, "logins", [])
+    impacket_exec.close_sessions()
+    yield
+    impacket_exec.close_sessions()
+
+
+def test_session_is_reused_with_the_same_credentials():
+    assert impacket_exec.execute("10.0.0.1", "admin", "right", "corp", "cmd")
+    assert impacket_exec.execute("10.0.0.1", "Admin", "right", "CORP", "cmd")
+    assert FakeSession.logins == [("admin", "right")]
+
+
+def test_session_is_not_reused_with_another_password():
+    assert impacket_exec.execute("10.0.0.1", "admin", "right", "corp", "cmd")
+    with pytest.raises(ExecError) as e:
+        impacket_exec.execute("10.0.0.1", "admin", "wrong", "corp", "cmd")
+    assert e.value.kind == "auth"
+    assert FakeSession.logins == [("admin", "right"), ("admin", "wrong")]
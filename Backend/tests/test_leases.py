@@ -0,0 +1,114 @@
+# test_leases.py
+# Shard leases of distributed scans: expiry, requeueing and giving up after MAX_ATTEMPTS.
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utils import cluster_auth, coordinator
+from utils.job_manager import create_job, execute, update_target
+from utils.target_spec import TargetSpec
+
+TARGETS = "10.0.0.1-10.0.0.6"
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture
+def job(jobs_db, monkeypatch):
+    if cluster_auth.Fernet is None:
+        pytest.skip("leases need the cryptography package")
+    monkeypatch.setenv("CLUSTER_TOKEN", "test-token")
+    job_id = create_job("leases", TARGETS, "admin", "corp", "10.0.0.254", password="secret", distributed=True)
+    monkeypatch.setitem(coordinator._jobs, job_id,
+                        {"project_name": "leases", "username": "admin", "domain": "corp",
+                         "serverip": "10.0.0.254", "password": "secret"})
+    coordinator.create_shards(job_id, TargetSpec.parse(TARGETS), size=3)
+    return job_id
+
+
+def shard_states(job_id):
+    return execute("SELECT seq, state, worker, attempts FROM scan_shards WHERE job_id = ? ORDER BY seq",
+                   (job_id,), fetch="all")
+
+
+def expire_all(job_id):
+    return coordinator.reap_expired(now=time.time() + coordinator.LEASE_SECONDS + 1)
+
+
+def test_shards_are_created_once(job):
+    assert coordinator.create_shards(job, TargetSpec.parse(TARGETS), size=2) == 2
+    assert [row[1] for row in shard_states(job)] == ["queued", "queued"]
+
+
+def test_lease_seals_the_password(job):
+    order = coordinator.lease_shard("collector-a")
+    assert order["targets"] == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    assert order["attempt"] == 1
+    assert order["password"] != "secret"
+    assert cluster_auth.unseal_password(order["password"], "test-token") == "secret"
+    assert cluster_auth.unseal_password(order["password"], "wrong-token") is None
+
+
+def test_live_lease_is_not_reaped(job):
+    coordinator.lease_shard("collector-a")
+    assert coordinator.reap_expired() == 0
+    assert shard_states(job)[0][1:3] == ("leased", "collector-a")
+
+
+def test_expired_lease_is_requeued_with_unfinished_targets(job):
+    order = coordinator.lease_shard("collector-a")
+    update_target(job, order["targets"][0], "launched")
+    assert expire_all(job) == 1
+    assert shard_states(job)[0] == (0, "queued", None, 1)
+
+    # The lost collector can no longer report on the shard
+    assert not coordinator.report("collector-a", order["shard_id"], outcomes=[["10.0.0.2", "launched", None]])
+    assert coordinator.heartbeat("collector-a", [order["shard_id"]]) == [order["shard_id"]]
+
+    retry = coordinator.lease_shard("collector-b")
+    assert retry["shard_id"] == order["shard_id"]
+    assert retry["attempt"] == 2
+    assert retry["targets"] == ["10.0.0.2", "10.0.0.3"]
+
+
+def test_heartbeat_keeps_the_lease(job):
+    order = coordinator.lease_shard("collector-a")
+    execute("UPDATE scan_shards SET lease_expires = ? WHERE shard_id = ?", (time.time() - 1, order["shard_id"]))
+    assert coordinator.heartbeat("collector-a", [order["shard_id"]]) == []
+    assert coordinator.reap_expired() == 0
+
+
+def test_shard_fails_after_max_attempts(job):
+    for attempt in range(1, coordinator.MAX_ATTEMPTS + 1):
+        order = coordinator.lease_shard(f"collector-{attempt}")
+        assert order["attempt"] == attempt
+        if attempt == 1:
+            update_target(job, "10.0.0.1", "launched")
+        expire_all(job)
+
+    assert shard_states(job)[0][1] == "failed"
+    states = dict(execute("SELECT ip, state FROM job_targets WHERE job_id = ?", (job,), fetch="all"))
+    assert states == {"10.0.0.1": "launched", "10.0.0.2": "failed", "10.0.0.3": "failed"}
+    # The other shard is still offered
+    assert coordinator.lease_shard("collector-x")["targets"] == ["10.0.0.4", "10.0.0.5", "10.0.0.6"]
+
+
+def test_finished_shard_is_not_leased_again(job):
+    order = coordinator.lease_shard("collector-a")
+    assert coordinator.report("collector-a", order["shard_id"],
+                              outcomes=[[ip, "launched", None] for ip in order["targets"]], done=True)
+    assert shard_states(job)[0][1] == "done"
+    assert expire_all(job) == 0
+    assert coordinator.lease_shard("collector-b")["targets"] == ["10.0.0.4", "10.0.0.5", "10.0.0.6"]
+
+
+def test_collector_loads_no_database_module():
+    # A fresh interpreter, since this one already imported the coordinator side
+    code = ("import sys, utils.scan_worker; "
+            "print(sorted(name for name in sys.modules if name.startswith('utils.')))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True,
+                            check=True).stdout
+    for module in ("utils.job_manager", "utils.db_pool", "utils.store_data", "utils.coordinator"):
+        assert module not in output
@@ -0,0 +1,77 @@
+# test_listing.py
+import pytest
+
+from utils.asset_schema import data_revision
+from utils.db_pool import reader, submit_write
+from utils.store_data import create_db_and_store_results
+
+
+@pytest.fixture
+def client(project, tmp_path, monkeypatch):
+    # Importing the server starts its background work over db/ and state/; keep that out of tests
+    from utils import fleet_catalog, ingest_spool, job_manager, payload_store, vuln_match
+    for module, name in ((payload_store, "start_maintenance"), (ingest_spool, "start_worker"),
+                         (fleet_catalog, "start_sync"), (vuln_match, "start_matching"),
+                         (job_manager, "recover_jobs")):
+        monkeypatch.setattr(module, name, lambda: None)
+    from utils import server
+    from utils.server import app
+    monkeypatch.setattr(server, "DB_DIR", str(tmp_path))
+    app.config["TESTING"] = True
+    return app.test_client()
+
+
+def store(project, data, status="Success"):
+    details = data["AssetProjectDetails"] if status == "Success" else {}
+    ip = details.get("ClientIp", "10.0.9.9")
+    return create_db_and_store_results(project, ip, details.get("MachineName", ""), status, data,
+                                       wait=True).result()
+
+
+def revision(project):
+    with reader(project) as conn:
+        return data_revision(conn)
+
+
+def test_revision_follows_in_place_changes(project, agent_payload):
+    store(project, agent_payload())
+    first = revision(project)
+    # The same failure twice updates one row instead of adding one
+    store(project, "Error during login", status="Failed")
+    store(project, "Error during login", status="Failed")
+    assert revision(project) > first
+    updated = revision(project)
+    submit_write(project, lambda conn: conn.execute("DELETE FROM scan_results WHERE status = 'Failed'")).result()
+    assert revision(project) > updated
+
+
+def test_device_listing_pages_and_revalidates(project, agent_payload, client):
+    for n in range(5):
+        store(project, agent_payload(name=f"HOST{n:02d}", ip=f"10.0.0.{n + 1}"))
+
+    names, cursor = [], None
+    while True:
+        response = client.get(f"/project/{project}", query_string={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        names += [device["name"] for device in response.get_json()["devices"]]
+        cursor = response.get_json()["next_cursor"]
+        if not cursor:
+            break
+    assert names == [f"HOST{n:02d}" for n in range(5)]
+
+    response = client.get(f"/project/{project}")
+    etag = response.headers["ETag"]
+    assert client.get(f"/project/{project}", headers={"If-None-Match": etag}).status_code == 304
+    store(project, "Error during login", status="Failed")
+    store(project, "Error during login", status="Failed")
+    assert client.get(f"/project/{project}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_asset_etag_changes_when_the_row_is_rewritten(project, agent_payload, client):
+    scan_id = store(project, agent_payload())
+    url = f"/api/project/{project}/asset/HOST01"
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    submit_write(project, lambda conn: conn.execute(
+        "UPDATE scan_results SET json_data = json_data WHERE id = ?", (scan_id,))).result()
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,74 @@
+# test_payload_schema.py
+import gzip
+import json
+
+import pytest
+
+from utils import ingest_spool, payload_schema
+from utils.payload_schema import PayloadError, PayloadTooLarge, SchemaError
+
+
+def encode(data):
+    return json.dumps(data).encode("utf-8")
+
+
+def rejection(data):
+    with pytest.raises(PayloadError) as e:
+        payload_schema.parse(encode(data))
+    return str(e.value)
+
+
+def test_valid_upload(agent_payload):
+    data, project, ip, name = payload_schema.parse(encode(agent_payload()))
+    assert (project, ip, name) == ("tests", "10.0.0.1", "HOST01")
+    assert data == agent_payload()
+
+
+def test_single_record_stands_for_a_list(agent_payload):
+    # ConvertTo-Json unwraps one-element arrays
+    payload_schema.parse(encode(agent_payload(Users={"Name": "alice", "SID": "S-1-5-21-1-1001"})))
+
+
+def test_violations_name_their_path(agent_payload):
+    data = agent_payload()
+    del data["AssetProjectDetails"]["MachineName"]
+    assert rejection(data) == "AssetProjectDetails.MachineName: is required"
+    assert rejection(agent_payload(Software=[{"Name": "ok"}, {"Name": 5}])) == "Software[1].Name: must be a string"
+    assert rejection(agent_payload(Users=[{"Name": "bob", "Groups": ["x"]}])) == \
+        "Users[0].Groups: must be a string, number, boolean or null"
+    assert rejection(agent_payload(AssetDetails=[1])) == "AssetDetails: must be an object"
+
+
+def test_size_and_depth_limits(agent_payload):
+    nested = "leaf"
+    for _ in range(payload_schema.MAX_DEPTH + 1):
+        nested = {"level": nested}
+    assert "nested too deeply" in rejection(agent_payload(Hardware=[nested]))
+    long_value = "x" * (payload_schema.MAX_STRING + 1)
+    assert rejection(agent_payload(Hardware=[{"BIOS": {"Serial": long_value}}])) == \
+        "Hardware[0].BIOS.Serial: string too long"
+
+
+@pytest.mark.parametrize("field, value", [
+    ("ProjectName", "../db/other"), ("MachineName", "HOST\\01"), ("ClientIp", ".hidden"), ("ProjectName", " "),
+])
+def test_names_that_become_file_names(agent_payload, field, value):
+    data = agent_payload()
+    data["AssetProjectDetails"][field] = value
+    assert field in rejection(data)
+
+
+def test_schema_errors_are_payload_errors():
+    assert issubclass(SchemaError, PayloadError) and issubclass(PayloadTooLarge, PayloadError)
+    with pytest.raises(ValueError):
+        payload_schema.parse(b"{not json")
+
+
+def test_decompressed_size_limit(monkeypatch):
+    monkeypatch.setattr(ingest_spool, "MAX_PAYLOAD_BYTES", 1000)
+    body = gzip.compress(b" " * 2000)
+    with pytest.raises(PayloadTooLarge):
+        ingest_spool.decode_body(body, "gzip")
+    assert ingest_spool.decode_body(gzip.compress(b"{}"), "gzip") == b"{}"
+    with pytest.raises(PayloadError):
+        ingest_spool.decode_body(b"plain", "gzip")
@@ -0,0 +1,53 @@
+# test_payload_store.py
+from utils.db_pool import reader
+from utils.payload_store import DEDUP_SECTIONS, load_payload, section_hash
+from utils.store_data import create_db_and_store_results
+
+
+def store(project, data):
+    details = data["AssetProjectDetails"]
+    return create_db_and_store_results(project, details["ClientIp"], details["MachineName"], "Success", data,
+                                       wait=True).result()
+
+
+def stored(project, scan_id, sections=None):
+    with reader(project) as conn:
+        json_data = conn.execute("SELECT json_data FROM scan_results WHERE id = ?", (scan_id,)).fetchone()[0]
+        return load_payload(conn, json_data, sections)
+
+
+def changed_sections(project, scan_id):
+    with reader(project) as conn:
+        return {section for section, in conn.execute(
+            "SELECT section FROM scan_sections WHERE scan_id = ? AND changed = 1", (scan_id,))}
+
+
+def test_repeated_upload_stores_each_section_once(project, agent_payload):
+    first = store(project, agent_payload())
+    second = store(project, agent_payload())
+    with reader(project) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM payload_sections").fetchone() == (len(DEDUP_SECTIONS),)
+    assert changed_sections(project, first) == set(DEDUP_SECTIONS)
+    assert changed_sections(project, second) == set()
+    assert stored(project, second) == agent_payload()
+
+
+def test_only_the_changed_section_is_added(project, agent_payload):
+    store(project, agent_payload())
+    second = store(project, agent_payload(software=("Editor", "Browser", "Compiler")))
+    with reader(project) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM payload_sections").fetchone() == (len(DEDUP_SECTIONS) + 1,)
+    assert changed_sections(project, second) == {"Software"}
+    assert [sw["Name"] for sw in stored(project, second)["Software"]] == ["Editor", "Browser", "Compiler"]
+
+
+def test_projection_leaves_other_sections_unloaded(project, agent_payload):
+    scan_id = store(project, agent_payload())
+    data = stored(project, scan_id, sections=["Users"])
+    assert data["Users"] == agent_payload()["Users"]
+    assert data["Software"] == {"$ref": section_hash("Software", agent_payload()["Software"])}
+
+
+def test_section_hash_ignores_key_order():
+    assert section_hash("Users", [{"Name": "a", "SID": "1"}]) == section_hash("Users", [{"SID": "1", "Name": "a"}])
+    assert section_hash("Users", []) != section_hash("Software", [])
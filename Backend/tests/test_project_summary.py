@@ -0,0 +1,40 @@
+# test_project_summary.py
+from utils.db_pool import reader, submit_write
+from utils.project_summary import read_summary, rebuild_summary
+from utils.store_data import create_db_and_store_results
+
+
+def store(project, ip, name, status, data):
+    create_db_and_store_results(project, ip, name, status, data, wait=True).result()
+
+
+def summary(project):
+    with reader(project) as conn:
+        return read_summary(conn)
+
+
+def test_each_host_counts_once_by_its_latest_scan(project, agent_payload):
+    store(project, "10.0.0.1", "", "Failed", "Port Closed")
+    store(project, "10.0.0.2", "", "Failed", "Error during login")
+    # 10.0.0.1 comes back under its name: the failure entry of its IP goes away
+    store(project, "10.0.0.1", "HOST01", "Success", agent_payload())
+    store(project, "10.0.0.1", "HOST01", "Success", agent_payload())
+
+    result = summary(project)
+    assert result["hosts"] == 2
+    assert result["status"] == {"Failed": 1, "Success": 1}
+    assert result["failure"] == {"Error during login": 1}
+    assert result["os"] == {"Windows 11 Pro": 1}
+    assert result["ram_gb"] == 16
+
+
+def test_rebuild_matches_the_incremental_aggregates(project, agent_payload):
+    store(project, "10.0.0.1", "", "Failed", "Port Closed")
+    store(project, "10.0.0.1", "HOST01", "Success", agent_payload())
+    store(project, "10.0.0.3", "HOST03", "Success", agent_payload(name="HOST03", ip="10.0.0.3"))
+    incremental = summary(project)
+
+    submit_write(project, rebuild_summary).result()
+    rebuilt = summary(project)
+    assert {key: value for key, value in rebuilt.items() if key != "updated_at"} == \
+        {key: value for key, value in incremental.items() if key != "updated_at"}
@@ -0,0 +1,26 @@
+# test_resume.py
+from utils import job_manager
+from utils.job_manager import count_done_targets, create_job, unfinished_targets, update_target
+from utils.target_spec import TargetSpec
+
+
+def test_resume_leaves_out_finished_targets(jobs_db, monkeypatch):
+    monkeypatch.setattr(job_manager, "DONE_CHUNK", 3)
+    targets = TargetSpec.parse("10.0.0.1-10.0.0.10")
+    job_id = create_job("resume", "10.0.0.1-10.0.0.10")
+    for ip, state in (("10.0.0.2", "launched"), ("10.0.0.3", "failed"), ("10.0.0.7", "skipped"),
+                      ("10.0.0.8", "executing"), ("10.0.0.10", "uploaded")):
+        update_target(job_id, ip, state)
+
+    assert count_done_targets(job_id) == 4
+    remaining = TargetSpec.from_ips(unfinished_targets(job_id, targets))
+    assert list(remaining) == ["10.0.0.1", "10.0.0.4", "10.0.0.5", "10.0.0.6", "10.0.0.8", "10.0.0.9"]
+    assert remaining.intervals == [(167772161, 167772161), (167772164, 167772166), (167772168, 167772169)]
+
+
+def test_other_jobs_do_not_count(jobs_db):
+    first = create_job("resume", "10.0.0.1-10.0.0.2")
+    second = create_job("resume", "10.0.0.1-10.0.0.2")
+    update_target(first, "10.0.0.1", "launched")
+    assert list(unfinished_targets(second, ["10.0.0.1", "10.0.0.2"])) == ["10.0.0.1", "10.0.0.2"]
+    assert count_done_targets(second) == 0
@@ -0,0 +1,26 @@
+# test_scan_diff.py
+from utils.db_pool import reader
+from utils.scan_diff import diff_payloads, drift_since
+from utils.store_data import create_db_and_store_results
+
+
+def test_records_are_matched_by_their_key():
+    old = {"Software": [{"Name": "Editor", "Version": "1.0"}, {"Name": "Browser", "Version": "2.0"}]}
+    new = {"Software": [{"Name": "Browser", "Version": "2.1"}, {"Name": "Compiler", "Version": "1.0"}]}
+    changes = sorted(diff_payloads(old, new))
+    assert changes == [
+        ("added", "Software/Compiler", None, {"Name": "Compiler", "Version": "1.0"}),
+        ("changed", "Software/Browser/Version", "2.0", "2.1"),
+        ("removed", "Software/Editor", {"Name": "Editor", "Version": "1.0"}, None),
+    ]
+
+
+def test_drift_is_recorded_at_ingest(project, agent_payload):
+    for software in (("Editor",), ("Editor", "Browser")):
+        create_db_and_store_results(project, "10.0.0.1", "HOST01", "Success", agent_payload(software=software),
+                                    wait=True).result()
+    with reader(project) as conn:
+        drift = drift_since(conn, system_name="HOST01")
+    assert len(drift) == 1
+    assert [(c["section"], c["change"], c["path"]) for c in drift[0]["changes"]] == \
+        [("Software", "added", "Software/Browser")]
@@ -0,0 +1,46 @@
+# test_scheduler.py
+from utils import scheduler
+from utils.scheduler import AdaptiveLimiter, UploadGate
+
+
+def test_subnet_cap():
+    limiter = AdaptiveLimiter("test", 1, 10, 10, 2)
+    assert limiter.try_acquire("10.0.0.1") and limiter.try_acquire("10.0.0.2")
+    assert not limiter.try_acquire("10.0.0.3")
+    assert limiter.try_acquire("10.0.1.1")
+    limiter.release("10.0.0.1", outcome=None)
+    assert limiter.try_acquire("10.0.0.3")
+
+
+def test_limit_grows_on_success_and_halves_on_timeouts(monkeypatch):
+    limiter = AdaptiveLimiter("test", 2, 4, 8, 100)
+    for _ in range(4):
+        limiter.acquire("10.0.0.1")
+        limiter.release("10.0.0.1", 0.1, "success")
+    assert 4 < limiter.limit < 6
+
+    clock = [1000.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: clock[0])
+    before = limiter.limit
+    for _ in range(3):
+        # A burst of failures within one round trip counts once
+        limiter.acquire("10.0.0.1")
+        limiter.release("10.0.0.1", None, "timeout")
+    assert limiter.limit == before * scheduler.DECREASE_FACTOR
+    clock[0] += 10
+    for _ in range(5):
+        limiter.acquire("10.0.0.1")
+        limiter.release("10.0.0.1", None, "error")
+        clock[0] += 10
+    assert limiter.limit == limiter.minimum
+
+
+def test_upload_gate_caps_outstanding_agents():
+    gate = UploadGate(2, 900)
+    assert gate.try_acquire("p", "10.0.0.1") and gate.try_acquire("p", "10.0.0.2")
+    assert not gate.try_acquire("p", "10.0.0.3")
+    # The same host asking again keeps its slot
+    assert gate.try_acquire("p", "10.0.0.1")
+    gate.release("p", "10.0.0.2")
+    assert gate.try_acquire("p", "10.0.0.3")
+    assert gate.stats() == {"limit": 2, "outstanding": 2}
@@ -0,0 +1,103 @@
+# test_spool.py
+# Crash recovery of the ingest spool: what a restarted server reads back from the segments.
+import os
+import struct
+
+from utils import ingest_spool
+from utils.ingest_spool import HEADER, Spool
+
+
+def payloads(records):
+    return [payload for _, payload in records]
+
+
+def test_records_survive_a_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"first")
+    spool.append(b"second")
+    spool.file.close()
+
+    restarted = Spool(str(tmp_path))
+    # The new process writes to a new segment and never appends to the old one
+    assert restarted.segments() == [1, 2]
+    assert restarted.segment == 2
+    restarted.append(b"third")
+
+    records, segment, offset = restarted.read(1, 0, 10)
+    assert payloads(records) == [b"first", b"second", b"third"]
+    assert (segment, offset) == (2, os.path.getsize(restarted._path(2)))
+    assert restarted.count(1, 0) == 3
+
+
+def test_torn_record_is_left_behind(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"complete")
+    spool.append(b"torn by the crash")
+    spool.file.close()
+    # Crash halfway through writing the second record
+    path = spool._path(1)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    restarted = Spool(str(tmp_path))
+    restarted.append(b"after restart")
+    records, segment, _ = restarted.read(1, 0, 10)
+    assert payloads(records) == [b"complete", b"after restart"]
+    assert segment == 2
+    assert restarted.count(1, 0) == 2
+
+
+def test_torn_header_is_left_behind(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"complete")
+    spool.file.write(struct.pack("<I", 100))  # the header itself was cut short
+    spool.file.close()
+
+    restarted = Spool(str(tmp_path))
+    records, _, _ = restarted.read(1, 0, 10)
+    assert payloads(records) == [b"complete"]
+    assert restarted.count(1, 0) == 1
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path))
+    for payload in (b"one", b"two", b"three"):
+        spool.append(payload)
+    spool.file.close()
+    # Flip a byte inside the payload of the second record
+    with open(spool._path(1), "r+b") as f:
+        f.seek(HEADER.size + len(b"one") + HEADER.size)
+        f.write(b"T")
+
+    records, _, _ = Spool(str(tmp_path)).read(1, 0, 10)
+    assert payloads(records) == [b"one", b"three"]
+
+
+def test_reading_resumes_from_the_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_spool, "CHECKPOINT_PATH", str(tmp_path / "checkpoint.json"))
+    spool = Spool(str(tmp_path))
+    for n in range(5):
+        spool.append(f"record {n}".encode())
+
+    records, segment, offset = spool.read(1, 0, 2)
+    assert payloads(records) == [b"record 0", b"record 1"]
+    ingest_spool._save_checkpoint(segment, offset)
+    spool.file.close()
+
+    restarted = Spool(str(tmp_path))
+    segment, offset = ingest_spool._load_checkpoint()
+    assert restarted.count(segment, offset) == 3
+    records, _, _ = restarted.read(segment, offset, 10)
+    assert payloads(records) == [b"record 2", b"record 3", b"record 4"]
+
+
+def test_remove_before_keeps_unread_segments(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"old")
+    spool.file.close()
+    restarted = Spool(str(tmp_path))
+    restarted.append(b"new")
+    restarted.remove_before(2)
+    assert restarted.segments() == [2]
+    records, _, _ = restarted.read(2, 0, 10)
+    assert payloads(records) == [b"new"]
@@ -0,0 +1,80 @@
+# test_target_outcomes.py
+import sqlite3
+
+import pytest
+
+from utils import target_outcomes
+from utils.target_outcomes import (MAX_BACKOFF, TargetPlan, backoff, collapse_failure, compact_failures,
+                                   record_outcome)
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.execute("CREATE TABLE scan_results (id INTEGER PRIMARY KEY AUTOINCREMENT, client_ip TEXT NOT NULL, "
+                 "system_name TEXT NOT NULL, status TEXT NOT NULL, json_data TEXT NOT NULL)")
+    target_outcomes.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def add_row(conn, ip, status="Failed", json_data='"Port Closed"', name=""):
+    return conn.execute("INSERT INTO scan_results (client_ip, system_name, status, json_data) VALUES (?, ?, ?, ?)",
+                        (ip, name, status, json_data)).lastrowid
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert backoff("unreachable", 1) == 3600
+    assert backoff("unreachable", 3) == 4 * 3600
+    assert backoff("unreachable", 40) == MAX_BACKOFF
+    # New credentials may fix a login failure, so it is never skipped
+    assert backoff("auth_failed", 5) == 0
+    assert backoff("success", 1) == 0
+
+
+def test_failure_streak_and_recovery(conn):
+    record_outcome(conn, "10.0.0.1", "exec_timeout", now=NOW)
+    record_outcome(conn, "10.0.0.1", "unreachable", now=NOW + 10)
+    row = conn.execute("SELECT outcome, failures, first_failed, retry_after FROM target_outcomes").fetchone()
+    assert row == ("unreachable", 2, NOW, NOW + 10 + 7200)
+
+    record_outcome(conn, "10.0.0.1", "success", now=NOW + 20)
+    row = conn.execute("SELECT failures, first_failed, last_success, retry_after FROM target_outcomes").fetchone()
+    assert row == (0, None, NOW + 20, None)
+
+
+def test_plan_skips_backing_off_targets_and_defers_failing_ones():
+    rows = {"10.0.0.2": ("unreachable", 1, NOW + 60), "10.0.0.3": ("auth_failed", 2, None),
+            "10.0.0.4": ("port_closed", 1, NOW - 60)}
+    skipped = []
+    order = list(TargetPlan(rows, now=NOW).order(
+        ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.5"], on_skip=lambda ip, reason: skipped.append(ip)))
+    assert order == ["10.0.0.1", "10.0.0.5", "10.0.0.3", "10.0.0.4"]
+    assert skipped == ["10.0.0.2"]
+
+    retried = list(TargetPlan(rows, now=NOW, retry_failed=True).order(["10.0.0.2", "10.0.0.1"]))
+    assert retried == ["10.0.0.1", "10.0.0.2"]
+
+
+def test_identical_failure_updates_the_latest_row(conn):
+    first = add_row(conn, "10.0.0.1")
+    assert collapse_failure(conn, "10.0.0.1", "Failed", '"Port Closed"', NOW) == first
+    assert collapse_failure(conn, "10.0.0.1", "Failed", '"Port Closed"', NOW + 1) == first
+    assert conn.execute("SELECT attempts, updated_at FROM scan_results").fetchone() == (3, NOW + 1)
+    # Another reason, or another IP, needs its own row
+    assert collapse_failure(conn, "10.0.0.1", "Failed", '"Error during login"', NOW) is None
+    assert collapse_failure(conn, "10.0.0.2", "Failed", '"Port Closed"', NOW) is None
+
+
+def test_compaction_keeps_the_newest_row_of_each_run(conn):
+    ids = [add_row(conn, "10.0.0.1") for _ in range(3)]
+    success = add_row(conn, "10.0.0.1", "Success", "{}", "HOST01")
+    later = [add_row(conn, "10.0.0.1") for _ in range(2)]
+    other = add_row(conn, "10.0.0.2")
+
+    assert compact_failures(conn) == 3
+    rows = conn.execute("SELECT id, attempts FROM scan_results ORDER BY id").fetchall()
+    assert rows == [(ids[-1], 3), (success, 1), (later[-1], 2), (other, 1)]
+    assert compact_failures(conn) == 0
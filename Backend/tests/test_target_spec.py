@@ -0,0 +1,74 @@
+# test_target_spec.py
+import pytest
+
+from utils.get_inputs import get_input_data
+from utils.target_spec import TargetSpec, parse_target
+
+
+def test_single_ip_range_and_cidr():
+    assert parse_target("10.0.0.5") == (167772165, 167772165)
+    assert list(TargetSpec.parse("10.0.0.1-10.0.0.3")) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    # CIDRs skip the network and broadcast addresses
+    assert list(TargetSpec.parse("192.168.1.0/30")) == ["192.168.1.1", "192.168.1.2"]
+    assert list(TargetSpec.parse("192.168.1.0/31")) == ["192.168.1.0", "192.168.1.1"]
+
+
+def test_overlapping_entries_merge():
+    spec = TargetSpec.parse("10.0.0.1-10.0.0.10, 10.0.0.5, 10.0.0.8-10.0.0.12, 10.0.0.13")
+    assert spec.intervals == [(167772161, 167772173)]
+    assert len(spec) == 13
+
+
+def test_exclusions():
+    spec = TargetSpec.parse("10.0.0.0/24, !10.0.0.10-10.0.0.20, !10.0.0.100")
+    assert len(spec) == 254 - 11 - 1
+    assert "10.0.0.9" in spec
+    assert "10.0.0.10" not in spec
+    assert "10.0.0.20" not in spec
+    assert "10.0.0.21" in spec
+    assert "10.0.0.100" not in spec
+    assert "10.0.0.0" not in spec
+    assert "10.0.1.1" not in spec
+
+
+def test_exclusion_takes_whole_cidr():
+    # Excluded CIDRs keep their network and broadcast addresses
+    spec = TargetSpec.parse("10.0.0.0/23, !10.0.0.0/24")
+    assert spec[0] == "10.0.1.0"
+    assert spec[-1] == "10.0.1.254"
+
+
+def test_everything_excluded():
+    spec = TargetSpec.parse("10.0.0.1-10.0.0.5, !10.0.0.0/29")
+    assert len(spec) == 0
+    assert list(spec) == []
+
+
+def test_indexing_slicing_and_shards():
+    spec = TargetSpec.parse("10.0.0.1-10.0.0.3, 10.0.1.1-10.0.1.3")
+    assert spec[3] == "10.0.1.1"
+    with pytest.raises(IndexError):
+        spec[6]
+    assert list(spec.slice(2, 4)) == ["10.0.0.3", "10.0.1.1"]
+    shards = list(spec.shards(size=4))
+    assert [len(shard) for shard in shards] == [4, 2]
+    assert [ip for shard in shards for ip in shard] == list(spec)
+
+
+def test_to_string_round_trips():
+    spec = TargetSpec.parse("10.0.0.0/24, !10.0.0.10-10.0.0.20, 172.16.0.7")
+    assert list(TargetSpec.parse(spec.to_string())) == list(spec)
+
+
+@pytest.mark.parametrize("ip_input", [
+    "10.0.0.256", "10.0.0.9-10.0.0.1", "10.0.0.0/33", "not-an-ip", "", " , ", "!10.0.0.1",
+])
+def test_invalid_input(ip_input):
+    with pytest.raises(ValueError):
+        TargetSpec.parse(ip_input)
+    assert "error" in get_input_data(ip_input)
+
+
+def test_get_input_data_counts():
+    data = get_input_data("10.0.0.0/16, !10.0.5.0/24")
+    assert data["count"] == len(data["ips"]) == 65534 - 256
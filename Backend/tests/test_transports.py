@@ -0,0 +1,69 @@
+# test_transports.py
+import pytest
+
+from utils import transports
+from utils.transports import Transport
+
+
+class FakeTransport(Transport):
+    def __init__(self, name, port, outcome):
+        self.name = name
+        self.port = port
+        self.outcome = outcome
+        self.calls = 0
+
+    def launch(self, project_name, ip, username, password, domain, server_ip):
+        self.calls += 1
+        return self.outcome
+
+
+@pytest.fixture
+def fakes(jobs_db, monkeypatch):
+    fakes = {"wmi": FakeTransport("wmi", 135, "unreachable"),
+             "winrm-https": FakeTransport("winrm-https", 5986, "success"),
+             "winrm-http": FakeTransport("winrm-http", 5985, "success")}
+    monkeypatch.setattr(transports, "TRANSPORTS", list(fakes.values()))
+    monkeypatch.setattr(transports, "capabilities", transports.CapabilityCache())
+    return fakes
+
+
+def launch(ip, candidates):
+    return transports.launch("p", ip, "admin", "secret", "corp", "10.0.0.254", candidates)
+
+
+def test_default_order_and_open_ports(fakes):
+    assert [t.name for t in transports.select_transports("10.0.0.1", {135, 5985, 5986})] == \
+        ["wmi", "winrm-https", "winrm-http"]
+    assert [t.name for t in transports.select_transports("10.0.0.1", {5985})] == ["winrm-http"]
+
+
+def test_working_transport_is_tried_first(fakes):
+    ports = {135, 5985, 5986}
+    assert launch("10.0.0.1", transports.select_transports("10.0.0.1", ports)) == ("winrm-https", "success")
+    assert fakes["wmi"].calls == 1
+    # The host, and new hosts of its subnet, start with what worked
+    assert transports.select_transports("10.0.0.1", ports)[0].name == "winrm-https"
+    assert transports.select_transports("10.0.0.77", ports)[0].name == "winrm-https"
+    assert transports.select_transports("10.0.1.1", ports)[0].name == "wmi"
+    # and the cache outlives the process
+    assert transports.CapabilityCache().get("host", "10.0.0.1") == "winrm-https"
+
+
+def test_auth_failure_stops_the_fallback(fakes):
+    fakes["wmi"].outcome = "auth"
+    assert launch("10.0.0.1", transports.select_transports("10.0.0.1", {135, 5986})) == ("wmi", "auth")
+    assert fakes["winrm-https"].calls == 0
+
+
+def test_broken_transport_is_forgotten(fakes):
+    launch("10.0.0.1", transports.select_transports("10.0.0.1", {5986, 5985}))
+    fakes["winrm-https"].outcome = "error"
+    assert launch("10.0.0.1", transports.select_transports("10.0.0.1", {5986, 5985})) == ("winrm-http", "success")
+    assert transports.capabilities.get("host", "10.0.0.1") == "winrm-http"
+
+
+def test_collector_cache_stays_in_memory(jobs_db):
+    cache = transports.CapabilityCache(persistent=False)
+    cache.put("host", "10.0.0.1", "wmi", 60)
+    assert cache.get("host", "10.0.0.1") == "wmi"
+    assert not (jobs_db / "jobs.db").exists()
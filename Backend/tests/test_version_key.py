@@ -0,0 +1,39 @@
+# test_version_key.py
+import pytest
+
+from utils.vuln_match import version_key
+
+ASCENDING = [
+    "1.0dev1", "1.0alpha", "1.0beta2", "1.0rc1", "1.0", "1.0.1", "1.0.1a", "1.0.1b", "1.0.2",
+    "1.2", "1.10", "2", "10.0.19041",
+]
+
+
+@pytest.mark.parametrize("lower, higher", list(zip(ASCENDING, ASCENDING[1:])))
+def test_ordering(lower, higher):
+    assert version_key(lower) < version_key(higher)
+
+
+def test_sorting_matches_the_expected_order():
+    assert sorted(reversed(ASCENDING), key=version_key) == ASCENDING
+
+
+@pytest.mark.parametrize("left, right", [
+    ("1.0", "1.0.0"),
+    ("1", "1.0"),
+    ("v1.2", "1.2"),
+    ("Version 3.4", "3.4"),
+    ("1.0-RC1", "1.0rc1"),
+])
+def test_equal_versions(left, right):
+    assert version_key(left) == version_key(right)
+
+
+def test_numeric_parts_compare_as_numbers():
+    assert version_key("1.9") < version_key("1.10")
+
+
+def test_post_release_letter_ranks_above_pre_release():
+    # "b" is a post-release suffix (like 1.0.1b), not shorthand for beta
+    assert version_key("1.0b") > version_key("1.0beta2")
+    assert version_key("1.0b") > version_key("1.0")
@@ -0,0 +1,430 @@
+# asset_schema.py
+import json
+import os
+import time
+import sqlite3
+from utils.db_pool import register_schema, run_script, DB_DIR
+from utils.payload_store import load_payload
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+ASSET_SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_scan_results_system_name ON scan_results (system_name);
+CREATE INDEX IF NOT EXISTS idx_scan_results_client_ip ON scan_results (client_ip);
+CREATE INDEX IF NOT EXISTS idx_scan_results_host ON scan_results (coalesce(nullif(system_name, ''), client_ip), id);
+
+CREATE TABLE IF NOT EXISTS assets (
+    scan_id INTEGER PRIMARY KEY REFERENCES scan_results (id),
+    client_ip TEXT NOT NULL,
+    system_name TEXT NOT NULL,
+    is_latest INTEGER NOT NULL DEFAULT 1,
+    os_name TEXT,
+    os_version TEXT,
+    manufacturer TEXT,
+    model TEXT,
+    domain TEXT,
+    mac_address TEXT,
+    ram_gb REAL,
+    disk_gb REAL,
+    license_status TEXT,
+    logged_in_user TEXT,
+    scanned_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_assets_system_name ON assets (system_name, is_latest);
+CREATE INDEX IF NOT EXISTS idx_assets_client_ip ON assets (client_ip, is_latest);
+CREATE INDEX IF NOT EXISTS idx_assets_mac ON assets (mac_address);
+CREATE INDEX IF NOT EXISTS idx_assets_os ON assets (os_name);
+
+CREATE TABLE IF NOT EXISTS asset_software (
+    scan_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_norm TEXT NOT NULL,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_software_name ON asset_software (name_norm, version);
+CREATE INDEX IF NOT EXISTS idx_software_scan ON asset_software (scan_id);
+
+CREATE TABLE IF NOT EXISTS asset_users (
+    scan_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    sid TEXT,
+    domain TEXT,
+    is_active INTEGER,
+    is_lockout INTEGER,
+    is_local INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_users_name ON asset_users (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_users_scan ON asset_users (scan_id);
+
+CREATE TABLE IF NOT EXISTS asset_hotfixes (
+    scan_id INTEGER NOT NULL,
+    hotfix_id TEXT NOT NULL,
+    description TEXT,
+    installed_on TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_hotfixes_id ON asset_hotfixes (hotfix_id);
+CREATE INDEX IF NOT EXISTS idx_hotfixes_scan ON asset_hotfixes (scan_id);
+
+CREATE TABLE IF NOT EXISTS asset_network_adapters (
+    scan_id INTEGER NOT NULL,
+    nic_name TEXT,
+    ipv4 TEXT,
+    mac_address TEXT,
+    dhcp INTEGER,
+    dhcp_server TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_nics_mac ON asset_network_adapters (mac_address);
+CREATE INDEX IF NOT EXISTS idx_nics_ip ON asset_network_adapters (ipv4);
+CREATE INDEX IF NOT EXISTS idx_nics_scan ON asset_network_adapters (scan_id);
+
+CREATE TABLE IF NOT EXISTS asset_disks (
+    scan_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    device_id TEXT,
+    model TEXT,
+    file_system TEXT,
+    size_gb REAL,
+    free_gb REAL
+);
+CREATE INDEX IF NOT EXISTS idx_disks_scan ON asset_disks (scan_id);
+
+CREATE TABLE IF NOT EXISTS asset_security (
+    scan_id INTEGER PRIMARY KEY,
+    av_name TEXT,
+    av_enabled TEXT,
+    av_signature_status TEXT,
+    av_signature_version TEXT,
+    av_last_update TEXT,
+    av_realtime TEXT,
+    fw_domain TEXT,
+    fw_private TEXT,
+    fw_public TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_security_av_status ON asset_security (av_signature_status);
+'''
+
+# Bumped by triggers on every insert, update or delete of scan_results, whichever connection
+# makes it (collapsed failures, compaction and section rewrites change rows in place)
+REVISION_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS scan_results_revision (revision INTEGER NOT NULL)",
+    "INSERT INTO scan_results_revision SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM scan_results_revision)",
+] + [
+    f"CREATE TRIGGER IF NOT EXISTS scan_results_{event.lower()}_revision AFTER {event} ON scan_results "
+    f"BEGIN UPDATE scan_results_revision SET revision = revision + 1; END"
+    for event in ("INSERT", "UPDATE", "DELETE")
+]
+
+# Identity of a host in scan_results: failed rows carry no system name, only the IP
+HOST_KEY = "coalesce(nullif(system_name, ''), client_ip)"
+
+
+def superseded(alias):
+    """
+    SQL condition true for a scan_results row (as `alias`) keyed by its IP whose IP reported a
+    system name later: that failure belongs to a host now listed under its name.
+    """
+    return (f"(nullif({alias}.system_name, '') IS NULL AND EXISTS (SELECT 1 FROM scan_results later "
+            f"WHERE later.client_ip = {alias}.client_ip AND later.id > {alias}.id AND later.system_name != ''))")
+
+
+def data_revision(conn):
+    """Counter that changes whenever any scan_results row does; listing ETags are built on it."""
+    row = conn.execute("SELECT revision FROM scan_results_revision").fetchone()
+    return row[0] if row else 0
+
+
+def normalize_name(name):
+    return " ".join(str(name or "").lower().split())
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def as_record(value):
+    return value if isinstance(value, dict) else {}
+
+
+def column(value):
+    """An agent value SQLite can bind: lists are joined, objects stored as JSON."""
+    if isinstance(value, list):
+        return ", ".join(str(column(item)) for item in value if item is not None)
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def columns(*values):
+    return tuple(column(value) for value in values)
+
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def section_items(data, section):
+    """Flattens Hardware/Security style lists of single-key dicts into {key: value}."""
+    items = {}
+    for entry in as_list(data.get(section)):
+        if isinstance(entry, dict):
+            items.update(entry)
+    return items
+
+
+def index_asset(conn, scan_id, client_ip, system_name, data, scanned_at=None):
+    """
+    Writes the normalized rows for one successful payload. Runs inside the writer's transaction,
+    in its own savepoint: a payload the tables cannot take is logged and leaves the raw row stored.
+    Returns whether the asset was indexed.
+    """
+    if not isinstance(data, dict):
+        return False
+    conn.execute("SAVEPOINT asset_index")
+    try:
+        _index_rows(conn, scan_id, client_ip, system_name, data, scanned_at)
+    except (sqlite3.Error, ValueError, TypeError, AttributeError) as e:
+        conn.execute("ROLLBACK TO asset_index")
+        conn.execute("RELEASE asset_index")
+        logger.error(f"[!] Could not index scan {scan_id} of {client_ip}: {e}")
+        return False
+    conn.execute("RELEASE asset_index")
+    return True
+
+
+def _index_rows(conn, scan_id, client_ip, system_name, data, scanned_at):
+    asset = as_record(data.get("AssetDetails"))
+    hardware = section_items(data, "Hardware")
+    security = section_items(data, "Security")
+    operating_system = as_record(hardware.get("OperatingSystem"))
+    license_info = as_record(hardware.get("License"))
+
+    conn.execute("UPDATE assets SET is_latest = 0 WHERE system_name = ? AND is_latest = 1", (system_name,))
+    conn.execute('''
+        INSERT OR REPLACE INTO assets (scan_id, client_ip, system_name, is_latest, os_name, os_version, manufacturer,
+            model, domain, mac_address, ram_gb, disk_gb, license_status, logged_in_user, scanned_at)
+        VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', columns(
+        scan_id, client_ip, system_name,
+        operating_system.get("Operating System") or asset.get("OperatingSystem"),
+        operating_system.get("OSVersion"),
+        asset.get("SystemManufacturer"),
+        asset.get("SystemModel"),
+        asset.get("Domain"),
+        asset.get("MacAddress"),
+        to_number(asset.get("Ram Size")),
+        to_number(asset.get("DiskSpaceGB")),
+        license_info.get("LicenseStatus") or asset.get("LicenseStatus"),
+        asset.get("LoggedInUser"),
+        scanned_at if scanned_at is not None else time.time(),
+    ))
+
+    conn.executemany(
+        "INSERT INTO asset_software (scan_id, name, name_norm, version) VALUES (?, ?, ?, ?)",
+        [columns(scan_id, sw.get("Name"), normalize_name(sw.get("Name")), sw.get("Version"))
+         for sw in as_list(data.get("Software")) if isinstance(sw, dict) and sw.get("Name")],
+    )
+    conn.executemany(
+        "INSERT INTO asset_users (scan_id, name, sid, domain, is_active, is_lockout, is_local) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [columns(scan_id, user.get("Name"), user.get("SID"), user.get("Domain"), user.get("IsActive"),
+          user.get("IsLockout"), user.get("IsLocalAccount"))
+         for user in as_list(data.get("Users")) if isinstance(user, dict) and user.get("Name")],
+    )
+    conn.executemany(
+        "INSERT INTO asset_hotfixes (scan_id, hotfix_id, description, installed_on) VALUES (?, ?, ?, ?)",
+        [columns(scan_id, fix.get("HotFixID"), fix.get("Description"), fix.get("InstalledOn"))
+         for fix in as_list(security.get("AntiPatchUpdatesvirus")) if isinstance(fix, dict) and fix.get("HotFixID")],
+    )
+    conn.executemany(
+        "INSERT INTO asset_network_adapters (scan_id, nic_name, ipv4, mac_address, dhcp, dhcp_server) VALUES (?, ?, ?, ?, ?, ?)",
+        [columns(scan_id, nic.get("NICName"), nic.get("IPv4Addresses"), nic.get("MACAddress"), nic.get("DHCP"),
+          nic.get("DHCPServer"))
+         for nic in as_list(hardware.get("NetworkAdapters")) if isinstance(nic, dict)],
+    )
+    disks = [columns(scan_id, "physical", d.get("DriveID"), d.get("Model"), None, to_number(d.get("SizeGB")), None)
+             for d in as_list(hardware.get("PhysicalDrives")) if isinstance(d, dict)]
+    disks += [columns(scan_id, "logical", d.get("DeviceID"), d.get("VolumeName"), d.get("FileSystem"),
+               to_number(d.get("HardDiskCapacityGB")), to_number(d.get("FreeSpaceGB")))
+              for d in as_list(hardware.get("logicalDiskVolume")) if isinstance(d, dict)]
+    conn.executemany(
+        "INSERT INTO asset_disks (scan_id, kind, device_id, model, file_system, size_gb, free_gb) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        disks,
+    )
+
+    antivirus = security.get("Antivirus") or {}
+    if isinstance(antivirus, list):
+        antivirus = antivirus[0] if antivirus else {}
+    antivirus = as_record(antivirus)
+    firewall = {}
+    for profile in as_list(security.get("Firewall")):
+        if isinstance(profile, dict) and profile.get("Profile"):
+            firewall[column(profile["Profile"])] = profile.get("Enabled")
+    conn.execute('''
+        INSERT OR REPLACE INTO asset_security (scan_id, av_name, av_enabled, av_signature_status, av_signature_version,
+            av_last_update, av_realtime, fw_domain, fw_private, fw_public)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', columns(
+        scan_id, antivirus.get("Name"), antivirus.get("AntivirusEnabled"), antivirus.get("SignatureStatus"),
+        antivirus.get("AntivirusSignatureVersion"), antivirus.get("AV Signature Last Update"),
+        antivirus.get("RealTime"), firewall.get("Domain"), firewall.get("Private"), firewall.get("Public"),
+    ))
+
+
+def migrate(conn):
+    """Creates the normalized tables and back-fills them from scan_results rows not yet indexed."""
+    run_script(conn, ASSET_SCHEMA)
+    for statement in REVISION_SCHEMA:
+        conn.execute(statement)
+    rows = conn.execute('''
+        SELECT id, client_ip, system_name, json_data FROM scan_results
+        WHERE lower(status) = 'success' AND id NOT IN (SELECT scan_id FROM assets)
+        ORDER BY id
+    ''').fetchall()
+    if not rows:
+        return 0
+
+    # Legacy rows have no ingest time; 0 marks them as older than any real scan
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    try:
+        for scan_id, client_ip, system_name, json_data in rows:
+            try:
+                data = load_payload(conn, json_data)
+            except (json.JSONDecodeError, TypeError):
+                continue
+            index_asset(conn, scan_id, client_ip, system_name, data, scanned_at=0)
+        if own_transaction:
+            conn.execute("COMMIT")
+    except Exception:
+        if own_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    logger.info(f"Indexed {len(rows)} existing scan results into the normalized asset tables")
+    return len(rows)
+
+
+register_schema(migrate)
+
+
+def prefix_range(text):
+    """Bounds for an index-friendly "starts with" match on a normalized column."""
+    text = normalize_name(text)
+    return text, text + "\uffff"
+
+
+def find_hosts(conn, software=None, version=None, hotfix=None, missing_hotfix=None, av_status=None,
+               os_name=None, user=None, limit=500):
+    """
+    Returns the latest asset record of every host matching all given filters.
+    Each filter is an uncorrelated IN subquery so SQLite resolves it once through its index.
+    software matches package names starting with the given text.
+    """
+    clauses = ["a.is_latest = 1"]
+    params = []
+    if software:
+        if version:
+            clauses.append("a.scan_id IN (SELECT scan_id FROM asset_software WHERE name_norm >= ? AND name_norm < ? AND version = ?)")
+            params += [*prefix_range(software), version]
+        else:
+            clauses.append("a.scan_id IN (SELECT scan_id FROM asset_software WHERE name_norm >= ? AND name_norm < ?)")
+            params += prefix_range(software)
+    if hotfix:
+        clauses.append("a.scan_id IN (SELECT scan_id FROM asset_hotfixes WHERE hotfix_id = ?)")
+        params.append(hotfix.upper())
+    if missing_hotfix:
+        clauses.append("a.scan_id NOT IN (SELECT scan_id FROM asset_hotfixes WHERE hotfix_id = ?)")
+        params.append(missing_hotfix.upper())
+    if av_status:
+        clauses.append("a.scan_id IN (SELECT scan_id FROM asset_security WHERE av_signature_status = ?)")
+        params.append(av_status)
+    if os_name:
+        clauses.append("a.os_name LIKE ?")
+        params.append(f"%{os_name}%")
+    if user:
+        clauses.append("a.scan_id IN (SELECT scan_id FROM asset_users WHERE name = ? COLLATE NOCASE)")
+        params.append(user)
+
+    cursor = conn.execute(f'''
+        SELECT a.scan_id, a.system_name, a.client_ip, a.os_name, a.mac_address, a.scanned_at
+        FROM assets a WHERE {" AND ".join(clauses)}
+        ORDER BY a.system_name LIMIT ?
+    ''', params + [limit])
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def list_devices(conn, latest=True, status=None, limit=1000, after=None):
+    """
+    One keyset-paginated page of scan_results rows as dicts (scan_id, host, system_name, client_ip, status).
+    latest=True keeps only each host's newest row, ordered by host (after = last host);
+    otherwise every row is returned in id order (after = last scan_id).
+    A host is its system name, or its IP for failed rows that have none; an IP's failures are
+    left out of the latest view once a scan from that IP succeeded.
+    status filters on the (latest) row's status, case-insensitively.
+    """
+    columns = ("scan_id", "host", "system_name", "client_ip", "status")
+    if not latest:
+        params = [after or 0]
+        status_clause = ""
+        if status:
+            status_clause = "AND lower(status) = lower(?)"
+            params.append(status)
+        rows = conn.execute(f'''
+            SELECT id, {HOST_KEY}, system_name, client_ip, status FROM scan_results
+            WHERE id > ? {status_clause} ORDER BY id LIMIT ?
+        ''', params + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    # Streams host groups off idx_scan_results_host and stops as soon as the page is full
+    groups = conn.execute(f'''
+        SELECT {HOST_KEY}, MAX(id) FROM scan_results WHERE {HOST_KEY} > ? GROUP BY 1 ORDER BY 1
+    ''', (after or "",))
+    page = []
+    while len(page) < limit:
+        chunk = groups.fetchmany(max(limit - len(page), 256) if status else limit - len(page))
+        if not chunk:
+            break
+        placeholders = ",".join("?" * len(chunk))
+        by_id = {row[0]: row for row in conn.execute(
+            f"SELECT r.id, r.system_name, r.client_ip, r.status, {superseded('r')} FROM scan_results r "
+            f"WHERE r.id IN ({placeholders})",
+            [scan_id for _, scan_id in chunk])}
+        for host, scan_id in chunk:
+            scan_id, system_name, client_ip, row_status, replaced = by_id[scan_id]
+            if replaced:
+                continue
+            if status and str(row_status).lower() != status.lower():
+                continue
+            page.append(dict(zip(columns, (scan_id, host, system_name, client_ip, row_status))))
+            if len(page) == limit:
+                break
+    return page
+
+
+def recent_hosts(conn, since):
+    """IPs of hosts whose latest successful scan was ingested at or after `since` (epoch seconds)."""
+    return {row[0] for row in conn.execute(
+        "SELECT DISTINCT client_ip FROM assets WHERE is_latest = 1 AND scanned_at >= ?", (since,))}
+
+
+def migrate_all():
+    """Applies the normalized schema and back-fill to every db/*.db file."""
+    for file_name in sorted(os.listdir(DB_DIR)):
+        if not file_name.endswith(".db"):
+            continue
+        conn = sqlite3.connect(os.path.join(DB_DIR, file_name), isolation_level=None)
+        try:
+            count = migrate(conn)
+            print(f"{file_name}: indexed {count} rows")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    migrate_all()
@@ -0,0 +1,504 @@
+# benchmark.py
+#   python -m utils.benchmark [--hosts 2000 --concurrency 200 ...] [--save out.json] [--baseline out.json]
+import argparse
+import base64
+import copy
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+WORKDIR_MARKER = ".benchmark-workdir"
+PROJECT = "bench"
+
+STAGES = ("upload", "listing", "csv", "pdf", "scan")
+
+# --- synthetic payloads -------------------------------------------------------
+
+def make_payload(template, index, project, ip, software=200, users=10, hotfixes=50, seed=0):
+    """
+    Agent payload for synthetic host `index`, shaped like the template report.
+    Software, user and hotfix lists are scaled to the requested sizes; each host draws its
+    own mix from a shared pool so sections deduplicate about as poorly as a real fleet.
+    """
+    rng = random.Random(seed * 1000003 + index)
+    host = f"BENCH{index:06d}"
+    data = copy.deepcopy(template)
+    data["AssetProjectDetails"] = {"ProjectName": project, "ClientIp": ip, "MachineName": host}
+    details = data.setdefault("AssetDetails", {})
+    details.update(SystemName=host, IPAddress=ip, MacAddress=f"02-00-{index >> 24 & 255:02X}-"
+                   f"{index >> 16 & 255:02X}-{index >> 8 & 255:02X}-{index & 255:02X}")
+
+    pool = max(software * 3, 1)
+    names = rng.sample(range(pool), min(software, pool))
+    data["Software"] = [{"Name": f"Vendor{n % 97} Application {n}",
+                         "Version": f"{n % 13}.{rng.randrange(3)}.{n % 7}"} for n in sorted(names)]
+
+    user_template = (data.get("Users") or [{}])[0] if isinstance(data.get("Users"), list) else {}
+    data["Users"] = [dict(user_template, Name=f"user{n}", SID=f"S-1-5-21-{index}-{n}", IsActive=bool(n % 2))
+                     for n in range(users)]
+
+    security = [entry for entry in data.get("Security") or [] if "AntiPatchUpdatesvirus" not in entry]
+    security.append({"AntiPatchUpdatesvirus": [
+        {"Description": "Security Update", "HotFixID": f"KB{5000000 + n}", "InstalledOn": "1/1/2026 12:00:00 AM"}
+        for n in sorted(rng.sample(range(hotfixes * 2), hotfixes))
+    ]})
+    data["Security"] = security
+    return data
+
+
+def load_template(path):
+    """Reads a report from reports/ (manifest refs resolved) to model synthetic payloads on."""
+    from utils.payload_store import read_report
+    data = read_report(path)
+    if not isinstance(data, dict) or "AssetDetails" not in data:
+        raise SystemExit(f"{path} does not look like an agent report")
+    return data
+
+
+# --- measurement --------------------------------------------------------------
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(name, latencies, elapsed, errors=0, **extra):
+    result = {
+        "stage": name, "ops": len(latencies), "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "rss_mb": round(rss_mb(), 1), "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    result.update(extra)
+    return result
+
+
+def run_concurrently(fn, items, concurrency):
+    """Calls fn(item) from `concurrency` threads; returns (latencies, errors, elapsed)."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed(item):
+        started = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, items))
+    if errors:
+        print(f"  {len(errors)} errors, first: {errors[0]!r}", file=sys.stderr)
+    return latencies, len(errors), time.perf_counter() - started
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, path, body=None, headers=None, expect=(200,)):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+        if response.status not in expect:
+            raise RuntimeError(f"{method} {path} -> {response.status}: {data[:200]!r}")
+        return data
+
+
+def wait_for_ingest(timeout=600):
+    from utils import ingest_spool
+    deadline = time.monotonic() + timeout
+    while ingest_spool.spool_stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def stored_hosts(since=0):
+    """{system_name: scanned_at} of the benchmark project's assets."""
+    from utils.db_pool import reader
+    try:
+        with reader(PROJECT) as conn:
+            return dict(conn.execute("SELECT system_name, scanned_at FROM assets WHERE scanned_at >= ?", (since,)))
+    except FileNotFoundError:
+        return {}
+
+
+# --- stages -------------------------------------------------------------------
+
+def bench_upload(client, template, options):
+    print(f"upload: generating {options.hosts} payloads")
+    sizes = dict(software=options.software, users=options.users, hotfixes=options.hotfixes, seed=options.seed)
+    bodies = []
+    raw_bytes = 0
+    for index in range(options.hosts):
+        ip = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+        body = json.dumps(make_payload(template, index, PROJECT, ip, **sizes)).encode()
+        raw_bytes += len(body)
+        bodies.append((f"BENCH{index:06d}", gzip.compress(body, 6)))
+
+    posted = {}
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+
+    def post(item):
+        host, body = item
+        client.request("POST", "/upload", body, headers, expect=(202,))
+        posted[host] = time.time()
+
+    print(f"upload: posting with concurrency {options.concurrency}")
+    started = time.time()
+    latencies, errors, elapsed = run_concurrently(post, bodies, options.concurrency)
+    upload = summarize("upload", latencies, elapsed, errors,
+                       avg_payload_kb=round(raw_bytes / max(len(bodies), 1) / 1024, 1))
+
+    wait_for_ingest()
+    stored = stored_hosts(started)
+    lags = [stored[host] - posted[host] for host in posted if host in stored]
+    ingest = summarize("ingest", lags, max(stored.values(), default=started) - started,
+                       missing=len(posted) - len(lags))
+    return [upload, ingest]
+
+
+def bench_listing(client, options):
+    hosts = sorted(stored_hosts())
+
+    def list_all(_):
+        cursor = None
+        while True:
+            query = f"?limit={options.page_size}" + (f"&cursor={cursor}" if cursor else "")
+            page = json.loads(client.request("GET", f"/project/{PROJECT}{query}"))
+            cursor = page["next_cursor"]
+            if not cursor:
+                return
+
+    latencies, errors, elapsed = run_concurrently(list_all, range(options.rounds), min(options.rounds, 4))
+    listing = summarize("listing", latencies, elapsed, errors, hosts=len(hosts))
+
+    sample = random.Random(options.seed).sample(hosts, min(len(hosts), 500))
+    latencies, errors, elapsed = run_concurrently(
+        lambda host: client.request("GET", f"/api/project/{PROJECT}/asset/{host}?fields=AssetDetails"),
+        sample, options.concurrency)
+    asset = summarize("asset_json", latencies, elapsed, errors)
+    return [listing, asset]
+
+
+def bench_csv(client, options):
+    sizes = []
+
+    def export(_):
+        sizes.append(len(client.request("GET", f"/projects/{PROJECT}/download")))
+
+    latencies, errors, elapsed = run_concurrently(export, range(options.rounds), 1)
+    return [summarize("csv_export", latencies, elapsed, errors, bytes=max(sizes, default=0))]
+
+
+def bench_pdf(client, options):
+    hosts = sorted(stored_hosts())
+    sample = random.Random(options.seed).sample(hosts, min(len(hosts), options.pdf_samples))
+    latencies, errors, elapsed = run_concurrently(
+        lambda host: client.request("GET", f"/api/project/{PROJECT}/asset/{host}/pdf/"), sample, 4)
+    single = summarize("pdf_single", latencies, elapsed, errors)
+
+    # Everything not rendered above is a cache miss for the bulk export
+    latencies, errors, elapsed = run_concurrently(
+        lambda _: client.request("GET", f"/projects/{PROJECT}/pdf"), range(1), 1)
+    bulk = summarize("pdf_bulk", latencies, elapsed, errors, assets=len(hosts),
+                     assets_per_second=round(len(hosts) / elapsed, 1) if elapsed else None)
+    return [single, bulk]
+
+
+def start_fake_listeners(ips, ports=(135, 5985)):
+    """Accept-and-close listeners on each ip:port, run by one event loop thread."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    failure = []
+
+    async def handle(reader, writer):
+        writer.close()
+
+    async def serve():
+        try:
+            for ip in ips:
+                for port in ports:
+                    await asyncio.start_server(handle, ip, port, reuse_address=True)
+        except OSError as e:
+            failure.append(e)
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.create_task(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, name="fake-listeners", daemon=True).start()
+    ready.wait()
+    if failure:
+        raise failure[0]
+    return loop
+
+
+def stub_execute(template, options):
+    """
+    Stand-in for impacket_exec.execute(): like Win32_Process.Create it returns once the agent
+    is started, and the "agent" posts a synthetic payload to the -ServerUrl of the command
+    after options.agent_delay.
+    """
+    sizes = dict(software=options.software, users=options.users, hotfixes=options.hotfixes, seed=options.seed)
+
+    def agent(url, project, ip):
+        time.sleep(options.agent_delay)
+        # Offset so scanned hosts do not share names with the hosts of the upload stage
+        payload = make_payload(template, 1000000 + int(ip.rsplit(".", 1)[1]), project, ip, **sizes)
+        host, _, path = url.split("//", 1)[1].partition("/")
+        conn = http.client.HTTPConnection(host, timeout=60)
+        try:
+            conn.request("POST", f"/{path}", body=gzip.compress(json.dumps(payload).encode()),
+                         headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+            conn.getresponse().read()
+        finally:
+            conn.close()
+
+    def execute(ip, username, password, domain, command, timeout=None):
+        script = base64.b64decode(command.split()[-1]).decode("utf-16le")
+        url = re.search(r"-ServerUrl '([^']+)'", script).group(1)
+        project = re.search(r"-ProjectName (\S+)", script).group(1)
+        threading.Thread(target=agent, args=(url, project, ip), daemon=True).start()
+        return True
+    return execute
+
+
+def bench_scan(port, template, options):
+    from utils import impacket_exec
+    from utils.scan_runner import run_scan
+
+    live = [f"127.0.1.{n}" for n in range(1, options.scan_hosts + 1)]
+    dead = [f"127.0.2.{n}" for n in range(1, options.scan_hosts // 4 + 1)]
+    try:
+        start_fake_listeners(live)
+    except PermissionError:
+        print("scan: skipped, binding port 135 needs root (or CAP_NET_BIND_SERVICE)", file=sys.stderr)
+        return []
+
+    impacket_exec.execute = stub_execute(template, options)
+    # The stub replaces the DCOM call, so the in-process path is taken without impacket installed
+    impacket_exec.IMPACKET_AVAILABLE = True
+
+    targets = ",".join([f"{live[0]}-{live[-1]}"] + ([f"{dead[0]}-{dead[-1]}"] if dead else []))
+    print(f"scan: {len(live)} live and {len(dead)} unreachable targets, agent delay {options.agent_delay}s")
+    started = time.time()
+    run_scan(PROJECT, "bench", "bench", "", targets, f"127.0.0.1:{port}", probe_timeout=0.5)
+    # Launches return before the agents post, as with real hosts
+    deadline = time.monotonic() + options.agent_delay + 60
+    while len([name for name in stored_hosts(started) if name.startswith("BENCH")]) < len(live) \
+            and time.monotonic() < deadline:
+        time.sleep(0.1)
+    wait_for_ingest()
+    done = [scanned_at - started for name, scanned_at in stored_hosts(started).items()
+            if name.startswith("BENCH")]
+    return [summarize("scan", done, time.time() - started, len(live) - len(done), targets=len(live) + len(dead))]
+
+
+# --- orchestration ------------------------------------------------------------
+
+def _prepare_workdir(workdir, template_source):
+    shutil.copytree(os.path.join(BACKEND_DIR, "utils"), os.path.join(workdir, "utils"),
+                    ignore=shutil.ignore_patterns("__pycache__", "logs"))
+    shutil.copytree(os.path.join(BACKEND_DIR, "scripts"), os.path.join(workdir, "scripts"))
+    for name in ("db", "logs", "reports"):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+
+    # The template report plus the section objects its manifest refers to
+    target = os.path.join(workdir, "reports", os.path.basename(template_source))
+    shutil.copy(template_source, target)
+    with open(template_source, encoding="utf-8") as f:
+        manifest = json.load(f)
+    for value in manifest.values():
+        if isinstance(value, dict) and set(value) == {"$ref"}:
+            relative = os.path.join("objects", value["$ref"][:2], f"{value['$ref']}.json.gz")
+            os.makedirs(os.path.dirname(os.path.join(workdir, "reports", relative)), exist_ok=True)
+            shutil.copy(os.path.join(os.path.dirname(template_source), relative),
+                        os.path.join(workdir, "reports", relative))
+    open(os.path.join(workdir, WORKDIR_MARKER), "w").close()
+    return target
+
+
+def _default_template():
+    reports = os.path.join(BACKEND_DIR, "reports")
+    names = sorted(name for name in os.listdir(reports) if name.endswith(".json")) if os.path.isdir(reports) else []
+    if not names:
+        raise SystemExit("No report in reports/ to model payloads on; pass --template")
+    return os.path.join(reports, names[0])
+
+
+def run_stages(options):
+    """Runs inside the scratch copy: starts the app on a free port and executes the stages."""
+    import logging
+    from werkzeug.serving import make_server
+    if not os.path.exists(WORKDIR_MARKER):
+        raise SystemExit("--child only runs inside a scratch copy made by python -m utils.benchmark")
+    from utils.server import app
+    logging.getLogger("werkzeug").setLevel(options.log_level)
+
+    template = load_template(options.template)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    server.socket.listen(4096)  # the default backlog drops connections under a few hundred clients
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    client = Client(server.server_port)
+
+    results = []
+    stages = options.stages.split(",")
+    if "upload" in stages:
+        results += bench_upload(client, template, options)
+    if "listing" in stages:
+        results += bench_listing(client, options)
+    if "csv" in stages:
+        results += bench_csv(client, options)
+    if "pdf" in stages:
+        results += bench_pdf(client, options)
+    if "scan" in stages:
+        results += bench_scan(server.server_port, template, options)
+    server.shutdown()
+    return results
+
+
+def print_results(results):
+    columns = ("stage", "ops", "errors", "throughput", "p50_ms", "p99_ms", "rss_mb", "peak_rss_mb")
+    print()
+    print("".join(f"{column:>13}" for column in columns))
+    for result in results:
+        print("".join(f"{'-' if result.get(column) is None else result[column]!s:>13}" for column in columns))
+
+
+def compare(results, baseline_path, tolerance):
+    """Lists stages whose throughput dropped or p99 grew by more than `tolerance` (a fraction)."""
+    with open(baseline_path) as f:
+        baseline = {result["stage"]: result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get(result["stage"])
+        if not before:
+            continue
+        if before.get("throughput") and result.get("throughput") is not None \
+                and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{result['stage']}: throughput {before['throughput']} -> {result['throughput']}/s")
+        if before.get("p99_ms") and result.get("p99_ms") is not None \
+                and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{result['stage']}: p99 {before['p99_ms']} -> {result['p99_ms']} ms")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.benchmark",
+        description="Benchmarks ingest, listing, CSV export, PDF rendering and scanning against a scratch copy.")
+    parser.add_argument("--hosts", type=int, default=2000, help="synthetic agents uploading")
+    parser.add_argument("--concurrency", type=int, default=200, help="uploads in flight at once")
+    parser.add_argument("--software", type=int, default=200, help="installed programs per payload")
+    parser.add_argument("--users", type=int, default=10, help="user accounts per payload")
+    parser.add_argument("--hotfixes", type=int, default=50, help="hotfixes per payload")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=5, help="repetitions of the listing and CSV stages")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--pdf-samples", type=int, default=20, help="single-asset PDFs rendered")
+    parser.add_argument("--scan-hosts", type=int, default=100, help="live targets of the scan stage (max 254)")
+    parser.add_argument("--agent-delay", type=float, default=0.2, help="seconds the stub agent takes")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma separated subset of {','.join(STAGES)}")
+    parser.add_argument("--template", help="report to model payloads on (default: first file in reports/)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--save", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    options.scan_hosts = max(1, min(options.scan_hosts, 254))
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.child:
+        results = run_stages(options)
+        print(json.dumps({"results": results}), file=sys.stdout)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix="asset-discovery-bench-")
+    try:
+        template = _prepare_workdir(workdir, os.path.abspath(options.template or _default_template()))
+        args = [arg for arg in (argv if argv is not None else sys.argv[1:])
+                if not arg.startswith("--template")]
+        env = dict(os.environ, LOG_LEVEL=options.log_level, PYTHONPATH=workdir)
+        child = subprocess.run([sys.executable, "-m", "utils.benchmark", "--child", "--template", template, *args],
+                               cwd=workdir, env=env, stdout=subprocess.PIPE, text=True)
+        if child.returncode:
+            print(child.stdout, end="")
+            return child.returncode
+        lines = child.stdout.strip().splitlines()
+        for line in lines[:-1]:
+            print(line)
+        results = json.loads(lines[-1])["results"]
+    finally:
+        if options.keep:
+            print(f"Scratch directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    run = {"results": results, "options": {key: value for key, value in vars(options).items()
+                                            if key not in ("child", "save", "baseline", "keep")},
+           "python": sys.version.split()[0], "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(run, f, indent=2)
+    if options.baseline:
+        regressions = compare(results, options.baseline, options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+# cluster_auth.py
+import base64
+import hashlib
+import hmac
+import os
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+
+def cluster_token():
+    return os.environ.get("CLUSTER_TOKEN")
+
+
+def authorized(header):
+    """Collectors authenticate with 'Authorization: Bearer <CLUSTER_TOKEN>'; no token disables the API."""
+    token = cluster_token()
+    return bool(token) and hmac.compare_digest(str(header or ""), f"Bearer {token}")
+
+
+def cluster_cipher(token=None):
+    """
+    Fernet keyed from CLUSTER_TOKEN (or `token`, on the collector side). Leases carry the
+    scan password sealed with it, so it never crosses the network in clear text.
+    """
+    token = token or cluster_token()
+    if Fernet is None or not token:
+        return None
+    digest = hashlib.sha256(b"asset-discovery-credentials:" + token.encode("utf-8")).digest()
+    return Fernet(base64.urlsafe_b64encode(digest))
+
+
+def unseal_password(sealed, token):
+    """Collector side of the sealed lease password; None when it cannot be decrypted."""
+    cipher = cluster_cipher(token)
+    if not cipher or not sealed:
+        return None
+    try:
+        return cipher.decrypt(sealed.encode("ascii")).decode("utf-8")
+    except (InvalidToken, ValueError):
+        return None
@@ -0,0 +1,140 @@
+# compression.py
+import gzip
+import hashlib
+import os
+import threading
+import time
+import zlib
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 1024            # smaller bodies are sent as they are
+GZIP_LEVEL = 5             # dynamic responses: cheap levels, the CPU is needed for ingest
+BROTLI_QUALITY = 4
+STATIC_CHECK_INTERVAL = 2.0  # seconds between mtime checks of a cached file
+
+COMPRESSIBLE_TYPES = ("application/json", "text/csv", "text/plain", "text/html", "text/css",
+                      "application/javascript")
+
+
+def choose_encoding(accept_encoding, available=None):
+    """Best of 'br' and 'gzip' the client accepts (q > 0), or None."""
+    available = available or (("br", "gzip") if brotli else ("gzip",))
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def _compressor(encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response):
+    """after_request hook: compresses JSON, CSV and text bodies for clients that accept it."""
+    if (request.method == "HEAD" or response.status_code != 200 or response.direct_passthrough
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # Streamed exports (CSV) stay streamed: each chunk goes through one compressor
+        response.response = _compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        compress, finish = _compressor(encoding)
+        response.set_data(compress(body) + finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def enable_compression(app):
+    app.after_request(compress_response)
+
+
+class CachedFile:
+    """
+    A static file served from memory with precomputed gzip (and brotli) copies and an ETag.
+    The file is re-read when its mtime changes, checked at most every STATIC_CHECK_INTERVAL.
+    """
+
+    def __init__(self, path, download_name=None, mimetype="application/octet-stream"):
+        self.path = path
+        self.download_name = download_name
+        self.mimetype = mimetype
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.checked_at = 0.0
+        self.variants = {}
+        self.etag = None
+
+    def _load(self):
+        now = time.monotonic()
+        if self.variants and now - self.checked_at < STATIC_CHECK_INTERVAL:
+            return
+        with self.lock:
+            if self.variants and now - self.checked_at < STATIC_CHECK_INTERVAL:
+                return
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self.mtime:
+                with open(self.path, "rb") as f:
+                    data = f.read()
+                # Built off to the side so concurrent requests keep serving the old copy
+                variants = {None: data, "gzip": gzip.compress(data, 9, mtime=0)}
+                if brotli:
+                    variants["br"] = brotli.compress(data, quality=11)
+                self.variants, self.etag = variants, hashlib.sha256(data).hexdigest()[:32]
+                self.mtime = mtime
+            self.checked_at = now
+
+    def response(self):
+        """Response for the current request; 304 when If-None-Match carries the current ETag."""
+        self._load()
+        variants, etag = self.variants, self.etag
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            encoding = choose_encoding(request.headers.get("Accept-Encoding"),
+                                       tuple(name for name in ("br", "gzip") if name in variants))
+            response = Response(variants[encoding], mimetype=self.mimetype)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+            if self.download_name:
+                response.headers["Content-Disposition"] = f'attachment; filename="{self.download_name}"'
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,265 @@
+# coordinator.py
+import threading
+import time
+from utils.get_inputs import get_input_data
+from utils.target_spec import TargetSpec
+from utils.job_manager import (execute, execute_many, update_target, set_job_total, done_targets,
+                               TARGET_STATES)
+from utils.scan_runner import fresh_hosts, record_failure_row
+from utils.scan_stages import FAILURE_REASONS
+from utils.scheduler import upload_gate
+from utils.target_outcomes import record_target_outcome, load_plan, OUTCOMES
+from utils.cluster_auth import cluster_cipher
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+SHARD_SIZE = 256           # targets per shard
+LEASE_SECONDS = 60         # a shard returns to the queue when its collector is silent this long
+HEARTBEAT_INTERVAL = 15    # how often collectors renew their leases and flush outcomes
+MAX_ATTEMPTS = 3           # leases of one shard before its remaining targets are failed
+REAP_INTERVAL = 1.0        # seconds between checks of a running job's shards
+
+# Credentials of the distributed jobs running in this process, handed out with their leases
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _touch_worker(worker, address):
+    now = time.time()
+    execute('''
+        INSERT INTO scan_workers (worker, address, first_seen, last_seen) VALUES (?, ?, ?, ?)
+        ON CONFLICT (worker) DO UPDATE SET address = coalesce(excluded.address, address), last_seen = excluded.last_seen
+    ''', (worker, address, now, now))
+
+
+def create_shards(job_id, targets, size=SHARD_SIZE):
+    """Splits a job's TargetSpec into queued shards, once; a resumed job keeps its shards. Returns the count."""
+    existing = execute("SELECT COUNT(*) FROM scan_shards WHERE job_id = ?", (job_id,), fetch="one")[0]
+    if existing:
+        return existing
+    now = time.time()
+    rows = [(job_id, seq, spec.to_string(), "queued", now) for seq, spec in enumerate(targets.shards(size=size))]
+    execute_many("INSERT INTO scan_shards (job_id, seq, targets, state, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def _finish_shard(shard_id, state="done"):
+    execute("UPDATE scan_shards SET state = ?, lease_expires = NULL, finished_at = ? WHERE shard_id = ?",
+             (state, time.time(), shard_id))
+
+
+def _job_project(job_id):
+    row = execute("SELECT project_name FROM scan_jobs WHERE job_id = ?", (job_id,), fetch="one")
+    return row[0] if row else None
+
+
+def _release_gate(job_id, targets):
+    """Frees upload slots a lost collector held for targets it never reported as launched."""
+    project_name = _job_project(job_id)
+    ips = list(TargetSpec.parse(targets))
+    done = done_targets(job_id, ips)
+    for ip in ips:
+        if ip not in done:
+            upload_gate.release(project_name, ip)
+
+
+def reap_expired(now=None):
+    """Requeues shards whose lease ran out; after MAX_ATTEMPTS their remaining targets fail. Returns shards reaped."""
+    now = now or time.time()
+    expired = execute('''
+        SELECT shard_id, job_id, targets, worker, attempts FROM scan_shards
+        WHERE state = 'leased' AND lease_expires < ?
+    ''', (now,), fetch="all")
+    for shard_id, job_id, targets, worker, attempts in expired:
+        _release_gate(job_id, targets)
+        if attempts < MAX_ATTEMPTS:
+            # Guarded on the lease owner so a heartbeat that just renewed it wins
+            execute('''
+                UPDATE scan_shards SET state = 'queued', worker = NULL, lease_expires = NULL
+                WHERE shard_id = ? AND state = 'leased' AND worker = ? AND lease_expires < ?
+            ''', (shard_id, worker, now))
+            logger.warning(f"Lease of shard {shard_id} (job {job_id}) held by {worker} expired; requeued")
+            continue
+        ips = list(TargetSpec.parse(targets))
+        done = done_targets(job_id, ips)
+        for ip in ips:
+            if ip not in done:
+                update_target(job_id, ip, "failed", f"No collector finished this shard after {attempts} attempts")
+        _finish_shard(shard_id, "failed")
+        logger.error(f"Shard {shard_id} (job {job_id}) failed after {attempts} leases")
+    return len(expired)
+
+
+def lease_shard(worker, address=None):
+    """
+    Leases the oldest queued shard of a running distributed job to `worker`.
+    Returns the work order (targets not finished yet, credentials with the password sealed
+    by cluster_cipher(), lease length) or None.
+    """
+    _touch_worker(worker, address)
+    cipher = cluster_cipher()
+    if cipher is None:
+        logger.error("Distributed scans need the cryptography package and CLUSTER_TOKEN to hand out credentials")
+        return None
+    with _jobs_lock:
+        jobs = dict(_jobs)
+    if not jobs:
+        return None
+    placeholders = ",".join("?" * len(jobs))
+    while True:
+        row = execute(f'''
+            UPDATE scan_shards SET state = 'leased', worker = ?, attempts = attempts + 1, lease_expires = ?
+            WHERE shard_id = (
+                SELECT shard_id FROM scan_shards WHERE state = 'queued' AND job_id IN ({placeholders})
+                ORDER BY created_at, seq LIMIT 1)
+            RETURNING shard_id, job_id, targets, attempts
+        ''', (worker, time.time() + LEASE_SECONDS, *jobs), fetch="one")
+        if row is None:
+            return None
+        shard_id, job_id, targets, attempts = row
+        ips = list(TargetSpec.parse(targets))
+        done = done_targets(job_id, ips)
+        remaining = [ip for ip in ips if ip not in done]
+        if not remaining:
+            _finish_shard(shard_id)
+            continue
+        job = dict(jobs[job_id])
+        job["password"] = cipher.encrypt(job["password"].encode("utf-8")).decode("ascii")
+        logger.info(f"Leased shard {shard_id} (job {job_id}, {len(remaining)} targets, attempt {attempts}) to {worker}")
+        return {
+            "shard_id": shard_id, "job_id": job_id, "attempt": attempts, "targets": remaining,
+            "lease_seconds": LEASE_SECONDS, "heartbeat_interval": HEARTBEAT_INTERVAL, **job,
+        }
+
+
+def heartbeat(worker, shard_ids, address=None):
+    """Renews the worker's leases on shard_ids and returns the ones it no longer holds."""
+    _touch_worker(worker, address)
+    shard_ids = [int(shard_id) for shard_id in shard_ids]
+    if not shard_ids:
+        return []
+    placeholders = ",".join("?" * len(shard_ids))
+    held = {row[0] for row in execute(f'''
+        UPDATE scan_shards SET lease_expires = ?
+        WHERE worker = ? AND state = 'leased' AND shard_id IN ({placeholders})
+        RETURNING shard_id
+    ''', (time.time() + LEASE_SECONDS, worker, *shard_ids), fetch="all")}
+    return [shard_id for shard_id in shard_ids if shard_id not in held]
+
+
+def report(worker, shard_id, outcomes=(), failures=(), done=False, results=()):
+    """
+    Records a collector's results for a shard it holds: outcomes are [ip, job state, detail],
+    failures [ip, reason] rows for the project DB and results [ip, target outcome, detail]
+    for target_outcomes. Renews the lease, and with done=True closes the shard. Returns
+    False when the worker no longer holds the lease.
+    """
+    row = execute("SELECT job_id, state, worker FROM scan_shards WHERE shard_id = ?", (shard_id,), fetch="one")
+    if not row or row[1] != "leased" or row[2] != worker:
+        return False
+    job_id = row[0]
+    project_name = _job_project(job_id)
+
+    for ip, reason in failures:
+        if reason in FAILURE_REASONS:
+            record_failure_row(project_name, str(ip), reason)
+    for ip, outcome, detail in results:
+        if outcome in OUTCOMES:
+            record_target_outcome(project_name, str(ip), outcome, detail)
+    for ip, state, detail in outcomes:
+        if state in TARGET_STATES:
+            update_target(job_id, str(ip), state, detail)
+        # The slot a collector took through acquire_gate() lasts until the agent uploads here
+        if state == "launched":
+            upload_gate.launched(project_name, str(ip))
+        elif state == "failed":
+            upload_gate.release(project_name, str(ip))
+    if done:
+        _finish_shard(shard_id)
+    else:
+        execute("UPDATE scan_shards SET lease_expires = ? WHERE shard_id = ?", (time.time() + LEASE_SECONDS, shard_id))
+    return True
+
+
+def acquire_gate(worker, shard_id, ip):
+    """
+    Takes an upload slot for a collector about to launch the agent on ip, without waiting.
+    Returns True (granted), False (the gate is full, ask again) or None (lease lost).
+    """
+    row = execute("SELECT job_id, state, worker FROM scan_shards WHERE shard_id = ?", (shard_id,), fetch="one")
+    if not row or row[1] != "leased" or row[2] != worker:
+        return None
+    return upload_gate.try_acquire(_job_project(row[0]), ip)
+
+
+def run_distributed(project_name, username, password, domain, ip_input, serverip, job_id=None, freshness=0,
+                    retry_failed=False):
+    """
+    run_scan() counterpart for distributed jobs: shards the targets, offers them to collectors
+    and returns once every shard is done or failed. Expired leases are reaped meanwhile.
+    Targets still backing off are skipped as in run_scan(); shards are contiguous ranges, so
+    the rest keep their order.
+    """
+    input_data = get_input_data(ip_input)
+    if "error" in input_data:
+        return {"status": "error", "message": input_data["error"]}
+    if job_id is None:
+        return {"status": "error", "message": "Distributed scans run as jobs"}
+
+    ips = input_data["ips"]
+    set_job_total(job_id, len(ips))
+    # Only the project's fresh and backing-off hosts are looked up, never every done target
+    plan = load_plan(project_name, retry_failed)
+    skips = {}
+    for ip in plan.rows:
+        reason = plan.skip_reason(ip)
+        if reason and ip in ips:
+            skips[ip] = reason
+    for ip in fresh_hosts(project_name, freshness):
+        if ip in ips:
+            skips[ip] = "Reported within the freshness window"
+    done = done_targets(job_id, skips)
+    for ip, reason in skips.items():
+        if ip not in done:
+            update_target(job_id, ip, "skipped", reason)
+    shards = create_shards(job_id, ips)
+    logger.info(f"Distributed scan job {job_id}: {len(ips)} targets in {shards} shards")
+
+    with _jobs_lock:
+        _jobs[job_id] = {"project_name": project_name, "username": username, "password": password,
+                         "domain": domain, "serverip": serverip}
+    try:
+        while True:
+            reap_expired()
+            counts = dict(execute("SELECT state, COUNT(*) FROM scan_shards WHERE job_id = ? GROUP BY state",
+                                   (job_id,), fetch="all"))
+            if not counts.get("queued") and not counts.get("leased"):
+                break
+            time.sleep(REAP_INTERVAL)
+    finally:
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+
+    if counts.get("failed"):
+        return {"status": "success", "message": f"Scan complete; {counts['failed']} of {shards} shards failed"}
+    return {"status": "success", "message": "Scan complete"}
+
+
+def cluster_status():
+    """Known collectors with the shards they hold, and shard counts of the running jobs."""
+    now = time.time()
+    held = dict(execute("SELECT worker, COUNT(*) FROM scan_shards WHERE state = 'leased' GROUP BY worker",
+                         fetch="all"))
+    workers = [{
+        "worker": worker, "address": address, "first_seen": first_seen, "last_seen": last_seen,
+        "alive": now - last_seen < LEASE_SECONDS, "shards": held.get(worker, 0),
+    } for worker, address, first_seen, last_seen in execute(
+        "SELECT worker, address, first_seen, last_seen FROM scan_workers ORDER BY last_seen DESC", fetch="all")]
+    with _jobs_lock:
+        job_ids = list(_jobs)
+    jobs = {}
+    for job_id in job_ids:
+        jobs[job_id] = dict(execute("SELECT state, COUNT(*) FROM scan_shards WHERE job_id = ? GROUP BY state",
+                                     (job_id,), fetch="all"))
+    return {"workers": workers, "jobs": jobs}
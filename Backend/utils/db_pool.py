@@ -0,0 +1,216 @@
+# db_pool.py
+import os
+import queue
+import sqlite3
+import threading
+import time
+import atexit
+from concurrent.futures import Future
+from contextlib import contextmanager
+from utils.logging_config import setup_logging
+from utils.metrics import DB_COMMIT_SECONDS, DB_BATCH_SIZE
+
+logger = setup_logging()
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DB_DIR = os.path.join(BASE_DIR, "db")
+
+BATCH_SIZE = 200          # writes grouped into one transaction
+BATCH_INTERVAL = 0.05     # seconds the writer waits for more work before committing
+READERS_PER_PROJECT = 4   # pooled read-only connections kept per project
+
+SCAN_RESULTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scan_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_ip TEXT NOT NULL,
+    system_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    json_data TEXT NOT NULL
+)
+'''
+
+# Callables run once on every project DB when its writer opens it: schema(conn)
+_schema_hooks = [lambda conn: conn.execute(SCAN_RESULTS_SCHEMA)]
+
+_writers = {}
+_readers = {}
+_registry_lock = threading.Lock()
+
+
+def register_schema(hook):
+    """Adds a callable that prepares extra tables/indexes on every project DB."""
+    _schema_hooks.append(hook)
+    # DBs that are already open get the new schema through their writer
+    with _registry_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.submit(hook).result()
+    return hook
+
+
+def run_script(conn, script):
+    """Runs a multi-statement DDL script without executescript()'s implicit COMMIT."""
+    for statement in script.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def db_path(project_name):
+    return os.path.join(DB_DIR, f"{project_name}.db")
+
+
+def connect(path, readonly=False):
+    """A connection with the pool's settings: WAL writer, or a query-only reader."""
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class ProjectWriter(threading.Thread):
+    """
+    Owns the only write connection of one project DB (or of another DB given by path,
+    with its own schema_hooks).
+    Work items are callables fn(conn); they are grouped into one transaction per batch,
+    each in its own savepoint so a failing item does not roll back its neighbours.
+    """
+
+    def __init__(self, project_name, path=None, schema_hooks=None):
+        super().__init__(name=f"db-writer-{project_name}", daemon=True)
+        self.project_name = project_name
+        self.path = path or db_path(project_name)
+        # Metrics label: every project shares one series, other DBs get their own
+        self.database = "project" if path is None else project_name
+        self.queue = queue.Queue()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = connect(self.path)
+        for hook in (_schema_hooks if schema_hooks is None else schema_hooks):
+            hook(self.conn)
+        self.start()
+
+    def submit(self, fn):
+        future = Future()
+        self.queue.put((fn, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + BATCH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit_batch(self, work):
+        results = []
+        started = time.perf_counter()
+        try:
+            self.conn.execute("BEGIN")
+            for fn, future in work:
+                try:
+                    self.conn.execute("SAVEPOINT item")
+                    results.append((future, fn(self.conn), None))
+                    self.conn.execute("RELEASE item")
+                except Exception as e:
+                    self.conn.execute("ROLLBACK TO item")
+                    self.conn.execute("RELEASE item")
+                    results.append((future, None, e))
+            self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"[!] SQLite commit failed for project {self.project_name}: {e}")
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            results = [(future, None, e) for _, future in work]
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started, database=self.database)
+        DB_BATCH_SIZE.observe(len(work), database=self.database)
+
+        # Waiters are only released once their data is committed
+        for future, value, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            work = [(fn, future) for fn, future in batch if fn is not None]
+            if work:
+                self._commit_batch(work)
+            if len(work) < len(batch):
+                break
+        self.conn.close()
+
+    def stop(self):
+        self.queue.put((None, None))
+
+
+def get_writer(project_name):
+    with _registry_lock:
+        writer = _writers.get(project_name)
+        if writer is None:
+            writer = ProjectWriter(project_name)
+            _writers[project_name] = writer
+        return writer
+
+
+def submit_write(project_name, fn):
+    """Queues fn(conn) on the project's writer; returns a Future resolved after commit."""
+    return get_writer(project_name).submit(fn)
+
+
+@contextmanager
+def reader(project_name):
+    """
+    Borrows a pooled read-only connection to a project DB.
+    Reads never wait on ingest: WAL lets them see the last committed state.
+    """
+    path = db_path(project_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    with _registry_lock:
+        pool = _readers.setdefault(project_name, queue.LifoQueue(maxsize=READERS_PER_PROJECT))
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        # Make sure WAL mode and the schema are in place before the first read-only open
+        get_writer(project_name)
+        conn = connect(path, readonly=True)
+
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def close_all():
+    with _registry_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+        pools = list(_readers.values())
+        _readers.clear()
+    for writer in writers:
+        writer.stop()
+        writer.join(timeout=5)
+    for pool in pools:
+        while not pool.empty():
+            pool.get_nowait().close()
+
+
+atexit.register(close_all)
@@ -0,0 +1,286 @@
+# fleet_catalog.py
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from utils.db_pool import ProjectWriter, reader, run_script, connect, DB_DIR
+from utils.asset_schema import normalize_name
+from utils.pagination import encode_cursor, decode_cursor, page_size
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# Kept out of db/ so it is not listed as a project
+CATALOG_DB = os.path.join(BASE_DIR, "state", "catalog.db")
+
+SYNC_INTERVAL = 1.0       # seconds between catalog syncs of projects that received uploads
+SYNC_BATCH = 500          # latest assets copied into the catalog per transaction
+MAX_PAGE_SIZE = 500
+
+# Searchable term kinds; each maps to (project, asset) pairs
+KINDS = ("host", "ip", "mac", "software", "hotfix")
+
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog_assets (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    system_name TEXT NOT NULL,
+    client_ip TEXT,
+    mac_address TEXT,
+    os_name TEXT,
+    scan_id INTEGER NOT NULL,
+    scanned_at REAL,
+    UNIQUE (project, system_name)
+);
+CREATE TABLE IF NOT EXISTS catalog_terms (
+    kind TEXT NOT NULL,
+    term TEXT NOT NULL,
+    version TEXT NOT NULL DEFAULT '',
+    asset_id INTEGER NOT NULL,
+    PRIMARY KEY (kind, term, version, asset_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_catalog_terms_asset ON catalog_terms (asset_id);
+CREATE TABLE IF NOT EXISTS catalog_sync (
+    project TEXT PRIMARY KEY,
+    last_scan_id INTEGER NOT NULL
+);
+'''
+
+
+def normalize_term(kind, value):
+    if value is None:
+        return ""
+    if kind == "mac":
+        return str(value).strip().upper().replace("-", ":")
+    if kind in ("ip", "hotfix"):
+        return str(value).strip().upper()
+    return normalize_name(value)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ProjectWriter("catalog", CATALOG_DB, [lambda conn: run_script(conn, CATALOG_SCHEMA)])
+        return _writer
+
+
+def _read_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        _get_writer()  # creates the file and schema on first use
+        conn = connect(CATALOG_DB, readonly=True)
+        _local.conn = conn
+    return conn
+
+
+def _store_assets(project, assets, last_scan_id):
+    """Writer work item: upserts assets [(row dict, [(kind, term, version)])] of one project."""
+    def store(conn):
+        for asset, terms in assets:
+            existing = conn.execute(
+                "SELECT id, scan_id FROM catalog_assets WHERE project = ? AND system_name = ?",
+                (project, asset["system_name"])).fetchone()
+            if existing and existing[1] >= asset["scan_id"]:
+                continue
+            if existing:
+                asset_id = existing[0]
+                conn.execute('''
+                    UPDATE catalog_assets SET client_ip = ?, mac_address = ?, os_name = ?, scan_id = ?, scanned_at = ?
+                    WHERE id = ?
+                ''', (asset["client_ip"], asset["mac_address"], asset["os_name"], asset["scan_id"],
+                      asset["scanned_at"], asset_id))
+                conn.execute("DELETE FROM catalog_terms WHERE asset_id = ?", (asset_id,))
+            else:
+                asset_id = conn.execute('''
+                    INSERT INTO catalog_assets (project, system_name, client_ip, mac_address, os_name, scan_id, scanned_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (project, asset["system_name"], asset["client_ip"], asset["mac_address"], asset["os_name"],
+                      asset["scan_id"], asset["scanned_at"])).lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO catalog_terms (kind, term, version, asset_id) VALUES (?, ?, ?, ?)",
+                [(kind, term, version, asset_id) for kind, term, version in terms if term],
+            )
+        conn.execute('''
+            INSERT INTO catalog_sync (project, last_scan_id) VALUES (?, ?)
+            ON CONFLICT (project) DO UPDATE SET last_scan_id = MAX(last_scan_id, excluded.last_scan_id)
+        ''', (project, last_scan_id))
+        return len(assets)
+    return store
+
+
+def _collect_terms(conn, scan_ids):
+    """Searchable terms of the given scans, read from the project's normalized tables."""
+    terms = {scan_id: [] for scan_id in scan_ids}
+    placeholders = ",".join("?" * len(scan_ids))
+    for scan_id, name_norm, version in conn.execute(
+            f"SELECT scan_id, name_norm, version FROM asset_software WHERE scan_id IN ({placeholders})", scan_ids):
+        terms[scan_id].append(("software", name_norm, version or ""))
+    for scan_id, hotfix_id in conn.execute(
+            f"SELECT scan_id, hotfix_id FROM asset_hotfixes WHERE scan_id IN ({placeholders})", scan_ids):
+        terms[scan_id].append(("hotfix", normalize_term("hotfix", hotfix_id), ""))
+    for scan_id, ipv4, mac_address in conn.execute(
+            f"SELECT scan_id, ipv4, mac_address FROM asset_network_adapters WHERE scan_id IN ({placeholders})", scan_ids):
+        # Adapters with several addresses report them comma separated
+        for address in str(ipv4 or "").replace(";", ",").split(","):
+            terms[scan_id].append(("ip", normalize_term("ip", address), ""))
+        terms[scan_id].append(("mac", normalize_term("mac", mac_address), ""))
+    return terms
+
+
+def sync_project(project):
+    """Copies assets scanned since the project's last catalog sync into the catalog. Returns assets synced."""
+    row = _read_conn().execute("SELECT last_scan_id FROM catalog_sync WHERE project = ?", (project,)).fetchone()
+    last_scan_id = row[0] if row else 0
+    synced = 0
+    while True:
+        with reader(project) as conn:
+            cursor = conn.execute('''
+                SELECT scan_id, system_name, client_ip, mac_address, os_name, scanned_at FROM assets
+                WHERE is_latest = 1 AND scan_id > ? ORDER BY scan_id LIMIT ?
+            ''', (last_scan_id, SYNC_BATCH))
+            columns = [col[0] for col in cursor.description]
+            rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+            if not rows:
+                return synced
+            terms = _collect_terms(conn, [asset["scan_id"] for asset in rows])
+
+        assets = []
+        for asset in rows:
+            asset_terms = terms[asset["scan_id"]]
+            asset_terms += [("host", normalize_term("host", asset["system_name"]), ""),
+                            ("ip", normalize_term("ip", asset["client_ip"]), ""),
+                            ("mac", normalize_term("mac", asset["mac_address"]), "")]
+            assets.append((asset, asset_terms))
+        last_scan_id = rows[-1]["scan_id"]
+        synced += _get_writer().submit(_store_assets(project, assets, last_scan_id)).result()
+
+
+def remove_project(project):
+    def remove(conn):
+        conn.execute('''
+            DELETE FROM catalog_terms WHERE asset_id IN (SELECT id FROM catalog_assets WHERE project = ?)
+        ''', (project,))
+        conn.execute("DELETE FROM catalog_assets WHERE project = ?", (project,))
+        conn.execute("DELETE FROM catalog_sync WHERE project = ?", (project,))
+    return _get_writer().submit(remove).result()
+
+
+def sync_all():
+    """Brings the catalog in line with db/: syncs every project and drops deleted ones."""
+    projects = sorted(name[:-3] for name in os.listdir(DB_DIR) if name.endswith(".db"))
+    for project in projects:
+        try:
+            count = sync_project(project)
+            if count:
+                logger.info(f"Fleet catalog: synced {count} assets of project {project}")
+        except sqlite3.Error as e:
+            logger.error(f"Fleet catalog sync of project {project} failed: {e}")
+    known = [row[0] for row in _read_conn().execute("SELECT project FROM catalog_sync")]
+    for project in set(known) - set(projects):
+        remove_project(project)
+    return projects
+
+
+_dirty = set()
+_dirty_lock = threading.Lock()
+_sync_thread = None
+
+
+def mark_dirty(project):
+    """Schedules a catalog sync of a project that just received data."""
+    with _dirty_lock:
+        _dirty.add(project)
+
+
+def _sync_loop():
+    try:
+        sync_all()
+    except Exception as e:
+        logger.error(f"Initial fleet catalog sync failed: {e}")
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        with _dirty_lock:
+            projects = list(_dirty)
+            _dirty.clear()
+        for project in projects:
+            try:
+                sync_project(project)
+            except Exception as e:
+                # Picked up again on the next upload or restart; last_scan_id did not move
+                logger.error(f"Fleet catalog sync of project {project} failed: {e}")
+
+
+def start_sync():
+    """Starts the background thread that keeps the catalog up to date with uploads."""
+    global _sync_thread
+    with _dirty_lock:
+        if _sync_thread is not None:
+            return
+        _sync_thread = threading.Thread(target=_sync_loop, name="fleet-catalog", daemon=True)
+    _sync_thread.start()
+
+
+def search(kind, query, version=None, project=None, exact=False, limit=50, cursor=None):
+    """
+    Finds assets across all projects whose `kind` term starts with (or equals, when exact)
+    query. Results follow the (term, version, asset) primary key order, so each page is an
+    index range scan; pass the returned next_cursor to continue.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind: {kind}")
+    limit = page_size(limit, default=50, maximum=MAX_PAGE_SIZE)
+    term = normalize_term(kind, query)
+    # Terms are stored normalized, so "starts with" is a plain range on the primary key
+    low, high = (term, term + "\0") if exact else (term, term + "\uffff")
+
+    clauses = ["t.kind = ?", "t.term >= ?", "t.term < ?"]
+    params = [kind, low, high]
+    if version:
+        clauses.append("t.version = ?")
+        params.append(version)
+    if project:
+        clauses.append("a.project = ?")
+        params.append(project)
+    if cursor:
+        clauses.append("(t.term, t.version, t.asset_id) > (?, ?, ?)")
+        term_after, version_after, asset_after = decode_cursor(cursor, 3)
+        params += [str(term_after), str(version_after), int(asset_after)]
+
+    rows = _read_conn().execute(f'''
+        SELECT t.term, t.version, t.asset_id, a.project, a.system_name, a.client_ip, a.mac_address, a.os_name,
+               a.scan_id, a.scanned_at
+        FROM catalog_terms t JOIN catalog_assets a ON a.id = t.asset_id
+        WHERE {" AND ".join(clauses)}
+        ORDER BY t.term, t.version, t.asset_id
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    results = [{
+        "project": row[3], "system_name": row[4], "client_ip": row[5], "mac_address": row[6], "os_name": row[7],
+        "scan_id": row[8], "scanned_at": row[9], "kind": kind, "term": row[0], "version": row[1] or None,
+    } for row in rows[:limit]]
+    next_cursor = encode_cursor(list(rows[limit - 1][:3])) if len(rows) > limit else None
+    return {"results": results, "next_cursor": next_cursor}
+
+
+def _close():
+    if _writer is not None:
+        _writer.stop()
+        _writer.join(timeout=5)
+
+
+atexit.register(_close)
+
+
+if __name__ == "__main__":
+    # python -m utils.fleet_catalog  (builds or refreshes the catalog from every project)
+    for name in sync_all():
+        print(f"{name}: synced")
@@ -1,54 +1,37 @@
-import ipaddress
-import re
+from utils.target_spec import TargetSpec, parse_target, int_to_ip
 
 def parse_ip_range(ip_range):
     """Parses an IP range like 192.168.1.1-192.168.1.10 into a list of IPs."""
-    start_ip, end_ip = ip_range.split('-')
-    start = ipaddress.IPv4Address(start_ip.strip())
-    end = ipaddress.IPv4Address(end_ip.strip())
-    if end < start:
-        raise ValueError("Invalid IP range: end IP is before start IP.")
-    return [str(ip) for ip in range(int(start), int(end) + 1)]
+    start, end = parse_target(ip_range)
+    return [int_to_ip(ip) for ip in range(start, end + 1)]
 
-def normalize_ip_list(ip_input):
-    """Parses and normalizes different formats of IP input."""
-    ip_list = set()
+def parse_targets(ip_input):
+    """
+    Parses IPs, CIDRs, ranges and '!' exclusions into a lazily iterable TargetSpec.
+    Raises ValueError on malformed input.
+    """
+    return TargetSpec.parse(ip_input)
 
-    # Split by comma first
-    parts = ip_input.split(',')
-    for part in parts:
-        part = part.strip()
-        if '-' in part:
-            # IP Range
-            ip_list.update(parse_ip_range(part))
-        elif '/' in part:
-            # CIDR Notation
-            try:
-                net = ipaddress.IPv4Network(part, strict=False)
-                ip_list.update([str(ip) for ip in net.hosts()])
-            except ValueError:
-                raise ValueError(f"Invalid CIDR: {part}")
-        else:
-            # Single IP
-            try:
-                ipaddress.IPv4Address(part)
-                ip_list.add(part)
-            except ValueError:
-                raise ValueError(f"Invalid IP address: {part}")
+def normalize_ip_list(ip_input):
+    """Parses and normalizes different formats of IP input into a sorted list of IPs.
 
-    return sorted(ip_list)
+    Materializes every address; prefer parse_targets() for large inputs.
+    """
+    return list(parse_targets(ip_input))
 
 def get_input_data(ip_input):
     """
     Returns a dictionary of normalized inputs for scanning.
+    "ips" is a TargetSpec: iterate it lazily, len() is O(1).
     """
     try:
-        ip_list = normalize_ip_list(ip_input)
+        targets = parse_targets(ip_input)
     except ValueError as e:
         return {"error": str(e)}
 
     return {
-        "ips": ip_list # ,
+        "ips": targets,
+        "count": len(targets)
         # "username": username,
         # "password": password,
         # "domain": domain_name
@@ -0,0 +1,227 @@
+# impacket_exec.py
+import hashlib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+try:
+    from impacket.dcerpc.v5.dcom import wmi
+    from impacket.dcerpc.v5.dcomrt import DCOMConnection, INTERFACE
+    from impacket.dcerpc.v5.dtypes import NULL
+    IMPACKET_AVAILABLE = True
+except ImportError:
+    IMPACKET_AVAILABLE = False
+
+EXEC_POOL_SIZE = 64        # upper bound of concurrent DCOM executions; the scan scheduler sets the pace
+EXEC_TIMEOUT = 120         # seconds allowed per host (connect + login + process create)
+CALL_TIMEOUT = 30          # socket timeout of each DCE-RPC connection (impacket uses 300s for DCOM interfaces)
+SESSION_TTL = 300          # seconds an idle authenticated WMI session is kept for reuse
+MAX_CACHED_SESSIONS = 256
+
+# Substrings impacket puts in errors when the credentials are rejected
+AUTH_ERROR_MARKERS = ("rpc_s_access_denied", "STATUS_LOGON_FAILURE", "STATUS_ACCESS_DENIED",
+                      "E_ACCESSDENIED", "WBEM_E_ACCESS_DENIED", "0x80070005")
+NETWORK_ERROR_MARKERS = ("Could not connect", "Connection refused", "timed out", "No route to host",
+                         "Connection reset")
+
+
+class ExecError(Exception):
+    """Raised when remote execution fails; `kind` is 'auth', 'unreachable', 'timeout' or 'error'."""
+
+    def __init__(self, message, kind="error"):
+        super().__init__(message)
+        self.kind = kind
+
+
+class _WmiSession:
+    def __init__(self, ip):
+        self.ip = ip
+        self.thread = threading.current_thread().name
+        self.dcom = None
+        self.aborted = False
+        self.last_used = time.monotonic()
+
+    def login(self, username, password, domain):
+        self.dcom = DCOMConnection(self.ip, username, password, domain, oxidResolver=True)
+        try:
+            self.limit_sockets()
+            iInterface = self.dcom.CoCreateInstanceEx(wmi.CLSID_WbemLevel1Login, wmi.IID_IWbemLevel1Login)
+            iWbemLevel1Login = wmi.IWbemLevel1Login(iInterface)
+            # Open the interface connection before the first call so that the call runs under CALL_TIMEOUT
+            iWbemLevel1Login.connect(wmi.IID_IWbemLevel1Login)
+            self.limit_sockets()
+            self.services = iWbemLevel1Login.NTLMLogin('//./root/cimv2', NULL, NULL)
+            iWbemLevel1Login.RemRelease()
+            self.win32_process, _ = self.services.GetObject('Win32_Process')
+        except Exception:
+            self.dcom.disconnect()
+            raise
+        self.last_used = time.monotonic()
+
+    def _transports(self):
+        # impacket keeps the DCE-RPC connections of a session per target and calling thread
+        transports = []
+        if self.dcom is None:
+            return transports
+        try:
+            transports.append(self.dcom.get_dce_rpc().get_rpc_transport())
+            connections = INTERFACE.CONNECTIONS.get(self.ip, {}).get(self.thread, {})
+            transports.extend(entry["dce"].get_rpc_transport() for entry in list(connections.values()))
+        except (KeyError, RuntimeError):
+            pass
+        return transports
+
+    def limit_sockets(self):
+        """Bounds every blocking send/recv of the session's connections by CALL_TIMEOUT."""
+        if self.aborted:
+            raise ExecError(f"WMI session to {self.ip} was aborted", "timeout")
+        for rpc_transport in self._transports():
+            rpc_transport.set_connect_timeout(CALL_TIMEOUT)
+            sock = rpc_transport.get_socket()
+            if sock:
+                sock.settimeout(CALL_TIMEOUT)
+
+    def abort(self):
+        """Shuts the session's sockets down from another thread, failing the call blocked on them."""
+        self.aborted = True
+        for rpc_transport in self._transports():
+            sock = rpc_transport.get_socket()
+            if sock:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def create_process(self, command):
+        self.thread = threading.current_thread().name
+        self.limit_sockets()
+        result = self.win32_process.Create(command, 'C:\\', None)
+        self.last_used = time.monotonic()
+        return getattr(result, "ReturnValue", 0)
+
+    def close(self):
+        if self.dcom is None:
+            return
+        try:
+            self.dcom.disconnect()
+        except Exception:
+            pass
+
+
+_pool = ThreadPoolExecutor(max_workers=EXEC_POOL_SIZE, thread_name_prefix="wmi-exec")
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _take_session(key):
+    with _sessions_lock:
+        session = _sessions.pop(key, None)
+    if session and time.monotonic() - session.last_used > SESSION_TTL:
+        session.close()
+        return None
+    return session
+
+
+def _return_session(key, session):
+    with _sessions_lock:
+        if len(_sessions) >= MAX_CACHED_SESSIONS:
+            oldest = min(_sessions, key=lambda k: _sessions[k].last_used)
+            _sessions.pop(oldest).close()
+        previous = _sessions.get(key)
+        _sessions[key] = session
+    if previous:
+        previous.close()
+
+
+def classify_error(error):
+    """Maps an impacket/wmiexec error (or its text) to an ExecError kind."""
+    text = str(error)
+    if any(marker.lower() in text.lower() for marker in AUTH_ERROR_MARKERS):
+        return "auth"
+    if any(marker.lower() in text.lower() for marker in NETWORK_ERROR_MARKERS):
+        return "unreachable"
+    return "error"
+
+
+class _Call:
+    """One execute() call: the session its worker is using, and whether the caller gave up on it."""
+
+    def __init__(self):
+        self.session = None
+        self.timed_out = False
+
+    def use(self, session):
+        self.session = session
+        if self.timed_out and session is not None:
+            session.abort()
+
+
+def _run(call, ip, username, password, domain, command):
+    # The password is part of the key so a session is only reused under credentials that logged it in
+    key = (ip, (domain or "").lower(), username.lower(), hashlib.sha256(password.encode()).hexdigest())
+    session = _take_session(key)
+    call.use(session)
+    if session is not None:
+        try:
+            return_value = session.create_process(command)
+        except Exception as e:
+            session.close()
+            session = None
+            if call.timed_out:
+                raise ExecError(f"WMI execution on {ip} was aborted: {e}", "timeout")
+            # The cached session went stale (host rebooted, DCOM timed out); log in again
+            logger.info(f"Cached WMI session for {ip} is no longer usable: {e}")
+
+    if session is None:
+        try:
+            session = _WmiSession(ip)
+            call.use(session)
+            session.login(username, password, domain)
+            return_value = session.create_process(command)
+        except Exception as e:
+            if session:
+                session.close()
+            raise ExecError(f"WMI execution on {ip} failed: {e}", classify_error(e))
+
+    if call.timed_out:
+        # The caller already reported a timeout; a session that hung once is not kept
+        session.close()
+        return False
+    _return_session(key, session)
+    if return_value not in (0, None):
+        raise ExecError(f"Win32_Process.Create on {ip} returned {return_value}")
+    return True
+
+
+def execute(ip, username, password, domain, command, timeout=EXEC_TIMEOUT):
+    """
+    Runs `command` on ip via WMI Win32_Process.Create inside this process.
+    Reuses a cached authenticated session for the host when one is still alive.
+    Blocks until the process is created or `timeout` expires; raises ExecError on failure.
+    """
+    if not IMPACKET_AVAILABLE:
+        raise ExecError("impacket is not installed")
+
+    call = _Call()
+    future = _pool.submit(_run, call, ip, username, password, domain, command)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        # Fail the worker's blocked DCE-RPC call so the pool thread is freed; the session
+        # it was using is closed instead of being cached again
+        call.timed_out = True
+        if not future.cancel() and call.session is not None:
+            call.session.abort()
+        raise ExecError(f"WMI execution on {ip} timed out after {timeout}s", "timeout")
+
+
+def close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,318 @@
+# ingest_spool.py
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from utils.logging_config import setup_logging
+from utils.store_data import create_db_and_store_results
+from utils.payload_store import write_report
+from utils import job_manager
+from utils.scheduler import upload_gate
+from utils.metrics import Gauge
+from utils import payload_schema
+from utils.payload_schema import PayloadError, PayloadTooLarge
+
+logger = setup_logging()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SPOOL_DIR = os.path.join(BASE_DIR, "spool")
+CHECKPOINT_PATH = os.path.join(SPOOL_DIR, "checkpoint.json")
+
+MAX_PAYLOAD_BYTES = 32 * 1024 * 1024   # decompressed upload size limit
+SEGMENT_BYTES = 16 * 1024 * 1024       # spool segment rotation size
+INGEST_BATCH = 200                     # records drained per DB round trip
+IDLE_POLL = 0.2                        # seconds the worker sleeps when the spool is empty
+
+# Record layout: payload length, CRC32 of the payload, enqueue time, payload bytes
+HEADER = struct.Struct("<IId")
+
+
+def decode_body(raw, content_encoding):
+    """Decompresses a request body (identity, gzip, deflate or zstd) with a hard size cap."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        body = raw
+    elif encoding in ("gzip", "x-gzip", "deflate"):
+        wbits = 16 + zlib.MAX_WBITS if encoding != "deflate" else zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            body = decompressor.decompress(raw, MAX_PAYLOAD_BYTES + 1)
+        except zlib.error as e:
+            raise PayloadError(f"Invalid {encoding} body: {e}")
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise PayloadError("zstd uploads need the 'zstandard' package on the server")
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+                body = stream.read(MAX_PAYLOAD_BYTES + 1)
+        except zstandard.ZstdError as e:
+            raise PayloadError(f"Invalid zstd body: {e}")
+    else:
+        raise PayloadError(f"Unsupported Content-Encoding: {encoding}")
+
+    if len(body) > MAX_PAYLOAD_BYTES:
+        raise PayloadTooLarge("Payload too large")
+    return body
+
+
+def parse_payload(body):
+    """Decodes and checks an upload in one pass; returns (data, project_name, client_ip, system_name)."""
+    return payload_schema.parse(body)
+
+
+class Spool:
+    """
+    Durable append-only queue of accepted uploads, stored as numbered segment files.
+    Appends are fsynced with group commit: one fsync covers every record written before it.
+    """
+
+    def __init__(self, directory=SPOOL_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.appended = 0
+        self.synced = 0
+        # Always start a fresh segment so a record torn by a crash can only sit in a closed one
+        segments = self.segments()
+        self.segment = segments[-1] + 1 if segments else 1
+        self.file = open(self._path(self.segment), "ab")
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}.seg")
+
+    def segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def append(self, payload):
+        record = HEADER.pack(len(payload), zlib.crc32(payload), time.time()) + payload
+        with self.lock:
+            if self.file.tell() >= SEGMENT_BYTES:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.segment += 1
+                self.file = open(self._path(self.segment), "ab")
+            self.file.write(record)
+            self.file.flush()
+            self.appended += 1
+            my_seq = self.appended
+            file = self.file
+
+        with self.sync_lock:
+            if self.synced < my_seq:
+                with self.lock:
+                    upto = self.appended
+                os.fsync(file.fileno())
+                self.synced = max(self.synced, upto)
+
+    def _scan(self, segment, offset, limit, on_record):
+        """Walks complete records of one segment from offset; returns (records seen, new offset)."""
+        seen = 0
+        path = self._path(segment)
+        if not os.path.exists(path):
+            return seen, offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while limit is None or seen < limit:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, crc, enqueued_at = HEADER.unpack(header)
+                payload = f.read(length) if on_record else None
+                if on_record is None:
+                    f.seek(length, os.SEEK_CUR)
+                    if f.tell() > os.fstat(f.fileno()).st_size:
+                        break
+                elif len(payload) < length:
+                    break  # record still being written, or torn by a crash
+                offset = f.tell()
+                seen += 1
+                if on_record:
+                    if zlib.crc32(payload) != crc:
+                        logger.error(f"Skipping corrupt spool record in segment {segment}")
+                        continue
+                    on_record(enqueued_at, payload)
+        return seen, offset
+
+    def read(self, segment, offset, limit):
+        """Returns (records, next_segment, next_offset); records are (enqueued_at, payload)."""
+        records = []
+        while len(records) < limit:
+            with self.lock:
+                current = self.segment
+            _, offset = self._scan(segment, offset, limit - len(records),
+                                   lambda enqueued_at, payload: records.append((enqueued_at, payload)))
+            # A segment that was already closed before this pass has now been read completely
+            if len(records) >= limit or segment >= current:
+                break
+            segment, offset = segment + 1, 0
+        return records, segment, offset
+
+    def count(self, segment, offset):
+        """Number of records from (segment, offset) to the end of the spool."""
+        total = 0
+        for current in self.segments():
+            if current < segment:
+                continue
+            seen, _ = self._scan(current, offset if current == segment else 0, None, None)
+            total += seen
+        return total
+
+    def peek_time(self, segment, offset):
+        """Enqueue time of the record at (segment, offset), or None if there is none yet."""
+        for current in self.segments():
+            if current < segment:
+                continue
+            path = self._path(current)
+            with open(path, "rb") as f:
+                f.seek(offset if current == segment else 0)
+                header = f.read(HEADER.size)
+            if len(header) == HEADER.size:
+                return HEADER.unpack(header)[2]
+        return None
+
+    def remove_before(self, segment):
+        for old in self.segments():
+            if old < segment:
+                os.remove(self._path(old))
+
+
+_spool = None
+_spool_lock = threading.Lock()
+_state = {"ingested": 0, "failed": 0, "pending": 0, "position": None, "last_batch_at": None}
+
+
+def get_spool():
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = Spool()
+        return _spool
+
+
+def enqueue(payload):
+    """Durably spools an already validated upload body (decompressed JSON bytes)."""
+    get_spool().append(payload)
+    with _spool_lock:
+        _state["pending"] += 1
+
+
+def _load_checkpoint():
+    try:
+        with open(CHECKPOINT_PATH, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        return checkpoint["segment"], checkpoint["offset"]
+    except (FileNotFoundError, KeyError, json.JSONDecodeError):
+        segments = get_spool().segments()
+        return (segments[0] if segments else 1), 0
+
+
+def _save_checkpoint(segment, offset):
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"segment": segment, "offset": offset}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def _ingest_batch(records):
+    futures = []
+    uploaded = []
+    for enqueued_at, payload in records:
+        try:
+            data, project_name, client_ip, system_name = parse_payload(payload)
+            timestamp = datetime.fromtimestamp(enqueued_at).strftime('%Y%m%d_%H%M%S')
+            write_report(f"{client_ip}_{system_name}_{timestamp}.json", data)
+            futures.append(create_db_and_store_results(project_name, client_ip, system_name, "Success", data))
+            uploaded.append((project_name, client_ip, enqueued_at))
+        except Exception as e:
+            _state["failed"] += 1
+            logger.error(f"Dropping spooled upload: {e}")
+
+    # Every project writer commits its share of the batch as one transaction
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            _state["failed"] += 1
+    for project_name, client_ip, enqueued_at in uploaded:
+        job_manager.mark_uploaded(project_name, client_ip)
+        upload_gate.release(project_name, client_ip, enqueued_at)
+    return len(futures)
+
+
+def _worker_loop():
+    spool = get_spool()
+    segment, offset = _load_checkpoint()
+    backlog = spool.count(segment, offset)
+    with _spool_lock:
+        _state["pending"] += backlog
+        _state["position"] = (segment, offset)
+    if backlog:
+        logger.info(f"Resuming ingest of {backlog} spooled uploads")
+
+    while True:
+        try:
+            records, next_segment, next_offset = spool.read(segment, offset, INGEST_BATCH)
+            if not records:
+                time.sleep(IDLE_POLL)
+                continue
+
+            ingested = _ingest_batch(records)
+            # Records are replayed from the last checkpoint after a crash (at-least-once)
+            _save_checkpoint(next_segment, next_offset)
+            if next_segment != segment:
+                spool.remove_before(next_segment)
+            segment, offset = next_segment, next_offset
+
+            with _spool_lock:
+                _state["ingested"] += ingested
+                _state["pending"] = max(_state["pending"] - len(records), 0)
+                _state["position"] = (segment, offset)
+                _state["last_batch_at"] = time.time()
+        except Exception as e:
+            logger.exception(f"Ingest worker error: {e}")
+            time.sleep(1)
+
+
+_worker = None
+
+
+def start_worker():
+    """Starts the background thread that drains the spool into the project DBs."""
+    global _worker
+    with _spool_lock:
+        if _worker is not None:
+            return
+        _worker = threading.Thread(target=_worker_loop, name="ingest-worker", daemon=True)
+    get_spool()
+    _worker.start()
+
+
+def spool_stats():
+    """Spool depth and ingest lag (age of the oldest upload not yet in the DB)."""
+    spool = get_spool()
+    with _spool_lock:
+        state = dict(_state)
+    position = state.pop("position")
+    oldest = spool.peek_time(*position) if position else None
+    state["lag_seconds"] = round(max(time.time() - oldest, 0), 3) if oldest else 0.0
+    state["spool_bytes"] = sum(
+        os.path.getsize(spool._path(segment)) for segment in spool.segments()
+        if os.path.exists(spool._path(segment))
+    )
+    return state
+
+
+Gauge("ingest_pending_uploads", "Uploads spooled but not yet stored.", callback=lambda: {(): spool_stats()["pending"]})
+Gauge("ingest_lag_seconds", "Age of the oldest upload not yet stored.", callback=lambda: {(): spool_stats()["lag_seconds"]})
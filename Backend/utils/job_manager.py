@@ -0,0 +1,495 @@
+# job_manager.py
+import itertools
+import os
+import sqlite3
+import threading
+import queue
+import time
+import uuid
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STATE_DIR = os.path.join(BASE_DIR, "state")
+JOBS_DB = os.path.join(STATE_DIR, "jobs.db")
+# Key for the credentials of unfinished jobs; SCAN_CREDENTIAL_KEY (a Fernet key) takes precedence
+CREDENTIAL_KEY_FILE = os.path.join(STATE_DIR, "credentials.key")
+
+# Number of scans that may run side by side; the rest wait in the queue
+MAX_CONCURRENT_JOBS = 2
+
+# Hosts that reported successfully this recently are not scanned again (seconds, 0 = never skip)
+DEFAULT_FRESHNESS = 12 * 3600
+
+# Per-IP lifecycle. "queued" is implicit: a target has no row until it is picked up.
+# "launched" means the agent was started and its upload is still awaited.
+TARGET_STATES = ("queued", "probing", "executing", "launched", "uploaded", "failed", "skipped")
+# Targets in these states are not touched again when an interrupted job resumes
+DONE_TARGET_STATES = ("launched", "uploaded", "failed", "skipped")
+FINAL_JOB_STATES = ("completed", "failed")
+# Seconds between writes of target states buffered by TargetUpdates
+TARGET_FLUSH_INTERVAL = 0.5
+# IPs per done_targets() lookup
+DONE_CHUNK = 500
+# Non-secret arguments kept with the job so it can be resumed after a restart
+JOB_ARG_COLUMNS = ("username", "domain", "serverip", "freshness", "distributed", "retry_failed")
+
+_job_queue = queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+_db_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn():
+    """Returns the shared job DB connection, creating the schema on first use."""
+    global _conn
+    if _conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(JOBS_DB, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript('''
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            job_id TEXT PRIMARY KEY,
+            project_name TEXT NOT NULL,
+            ip_input TEXT NOT NULL,
+            status TEXT NOT NULL,
+            message TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS job_targets (
+            job_id TEXT NOT NULL,
+            ip TEXT NOT NULL,
+            state TEXT NOT NULL,
+            detail TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (job_id, ip)
+        );
+        CREATE INDEX IF NOT EXISTS idx_job_targets_state ON job_targets (job_id, state);
+        CREATE INDEX IF NOT EXISTS idx_job_targets_ip ON job_targets (ip, state);
+        CREATE TABLE IF NOT EXISTS scan_shards (
+            shard_id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            targets TEXT NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_expires REAL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            UNIQUE (job_id, seq)
+        );
+        CREATE INDEX IF NOT EXISTS idx_scan_shards_state ON scan_shards (state, created_at, seq);
+        CREATE TABLE IF NOT EXISTS scan_workers (
+            worker TEXT PRIMARY KEY,
+            address TEXT,
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transport_capabilities (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            transport TEXT NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (scope, key)
+        );
+        ''')
+        # Columns added after the first release of this table
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(scan_jobs)")}
+        for column, definition in (("username", "TEXT"), ("domain", "TEXT"), ("serverip", "TEXT"),
+                                   ("freshness", "REAL"), ("credentials", "BLOB"), ("distributed", "INTEGER"),
+                                   ("retry_failed", "INTEGER")):
+            if column not in existing:
+                conn.execute(f"ALTER TABLE scan_jobs ADD COLUMN {column} {definition}")
+        conn.commit()
+        _conn = conn
+    return _conn
+
+
+def execute(sql, params=(), fetch=None):
+    """
+    Runs one statement on the jobs DB and commits. fetch="one"/"all" returns rows,
+    otherwise the row count. Other modules keep their tables (shards, capabilities) there too.
+    """
+    with _db_lock:
+        conn = _get_conn()
+        cursor = conn.execute(sql, params)
+        if fetch == "one":
+            result = cursor.fetchone()
+        elif fetch == "all":
+            result = cursor.fetchall()
+        else:
+            result = cursor.rowcount
+        conn.commit()
+        return result
+
+
+def execute_many(sql, rows):
+    """Runs one statement per row on the jobs DB in a single transaction."""
+    with _db_lock:
+        conn = _get_conn()
+        conn.executemany(sql, rows)
+        conn.commit()
+
+
+_cipher = None
+
+
+def _get_cipher():
+    """Fernet used to keep credentials of unfinished jobs at rest, or None without `cryptography`."""
+    global _cipher
+    if _cipher is None and Fernet is not None:
+        key = os.environ.get("SCAN_CREDENTIAL_KEY")
+        if not key:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            try:
+                with open(CREDENTIAL_KEY_FILE, "rb") as f:
+                    key = f.read().strip()
+            except FileNotFoundError:
+                key = Fernet.generate_key()
+                fd = os.open(CREDENTIAL_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(key)
+        _cipher = Fernet(key)
+    return _cipher
+
+
+def _seal(password):
+    cipher = _get_cipher()
+    return cipher.encrypt(password.encode("utf-8")) if cipher else None
+
+
+def _unseal(token):
+    cipher = _get_cipher()
+    if not cipher or not token:
+        return None
+    try:
+        return cipher.decrypt(token).decode("utf-8")
+    except (InvalidToken, ValueError):
+        return None
+
+
+def create_job(project_name, ip_input, username=None, domain=None, serverip=None, freshness=None, password=None,
+               distributed=False, retry_failed=False):
+    """
+    Registers a new scan job and returns its ID.
+    The password is only stored encrypted, and only until the job finishes.
+    """
+    job_id = uuid.uuid4().hex
+    execute('''
+        INSERT INTO scan_jobs (job_id, project_name, ip_input, status, created_at, username, domain, serverip,
+            freshness, credentials, distributed, retry_failed)
+        VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (job_id, project_name, ip_input, time.time(), username, domain, serverip, freshness,
+          _seal(password) if password else None, int(bool(distributed)), int(bool(retry_failed))))
+    return job_id
+
+
+def set_job_total(job_id, total):
+    execute("UPDATE scan_jobs SET total = ? WHERE job_id = ?", (total, job_id))
+
+
+def set_job_status(job_id, status, message=None):
+    now = time.time()
+    if status == "running":
+        execute("UPDATE scan_jobs SET status = ?, started_at = ? WHERE job_id = ?", (status, now, job_id))
+    elif status in FINAL_JOB_STATES:
+        execute(
+            "UPDATE scan_jobs SET status = ?, message = ?, finished_at = ?, credentials = NULL WHERE job_id = ?",
+            (status, message, now, job_id),
+        )
+    else:
+        execute("UPDATE scan_jobs SET status = ?, message = ? WHERE job_id = ?", (status, message, job_id))
+
+
+# Target state upsert; a row older than the stored state (a buffered change) is ignored
+_UPSERT_TARGET = '''
+    INSERT INTO job_targets (job_id, ip, state, detail, updated_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(job_id, ip) DO UPDATE SET state = excluded.state, detail = excluded.detail,
+        updated_at = excluded.updated_at
+    WHERE excluded.updated_at >= job_targets.updated_at
+'''
+
+
+def update_target(job_id, ip, state, detail=None):
+    """Records the current state of one IP inside a job. No-op when job_id is None."""
+    if job_id is None:
+        return
+    if state not in TARGET_STATES:
+        raise ValueError(f"Unknown target state: {state}")
+    execute(_UPSERT_TARGET, (job_id, ip, state, detail, time.time()))
+
+
+class TargetUpdates:
+    """
+    Buffers target states of one job and writes them in batches from a background thread.
+    For callers that must not block on SQLite, like the discovery event loop. Each change
+    keeps the time it was made, so a late flush never overwrites a newer update_target().
+    Use as a context manager; leaving it writes what is still buffered.
+    """
+
+    def __init__(self, job_id, interval=TARGET_FLUSH_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self.rows = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, ip, state, detail=None):
+        if self.job_id is None:
+            return
+        if state not in TARGET_STATES:
+            raise ValueError(f"Unknown target state: {state}")
+        with self.lock:
+            self.rows.append((self.job_id, ip, state, detail, time.time()))
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            execute_many(_UPSERT_TARGET, rows)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Could not write target states of job {self.job_id}: {e}")
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._run, name=f"targets-{self.job_id}", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+
+
+def mark_uploaded(project_name, client_ip):
+    """Moves a host that is waiting on its agent to 'uploaded' once the agent reports in."""
+    return execute('''
+        UPDATE job_targets SET state = 'uploaded', detail = NULL, updated_at = ?
+        WHERE ip = ? AND state IN ('executing', 'launched')
+          AND job_id IN (SELECT job_id FROM scan_jobs WHERE project_name = ?)
+    ''', (time.time(), client_ip, project_name))
+
+
+def get_job(job_id):
+    """Returns a progress snapshot for a job, or None if it does not exist."""
+    row = execute(
+        "SELECT job_id, project_name, ip_input, status, message, total, created_at, started_at, finished_at "
+        "FROM scan_jobs WHERE job_id = ?", (job_id,), fetch="one")
+    if not row:
+        return None
+
+    job = dict(zip(
+        ("job_id", "project_name", "ip_input", "status", "message", "total", "created_at", "started_at", "finished_at"),
+        row,
+    ))
+    counts = {state: 0 for state in TARGET_STATES}
+    for state, count in execute(
+            "SELECT state, COUNT(*) FROM job_targets WHERE job_id = ? GROUP BY state", (job_id,), fetch="all"):
+        counts[state] = count
+    counts["queued"] += max(job["total"] - sum(counts.values()), 0)
+    job["counts"] = counts
+
+    # A target is "processed" once it has left the probe/exec stages
+    processed = counts["executing"] + counts["launched"] + counts["uploaded"] + counts["failed"] + counts["skipped"]
+    job["processed"] = processed
+    job["eta_seconds"] = None
+    if job["started_at"] and job["status"] == "running" and processed:
+        elapsed = time.time() - job["started_at"]
+        job["eta_seconds"] = round(elapsed / processed * (job["total"] - processed), 1)
+    return job
+
+
+def list_jobs(project_name=None, limit=50):
+    if project_name:
+        rows = execute(
+            "SELECT job_id FROM scan_jobs WHERE project_name = ? ORDER BY created_at DESC LIMIT ?",
+            (project_name, limit), fetch="all")
+    else:
+        rows = execute("SELECT job_id FROM scan_jobs ORDER BY created_at DESC LIMIT ?", (limit,), fetch="all")
+    return [get_job(row[0]) for row in rows]
+
+
+def list_targets(job_id, state=None, limit=100, offset=0):
+    if state:
+        rows = execute(
+            "SELECT ip, state, detail, updated_at FROM job_targets WHERE job_id = ? AND state = ? "
+            "ORDER BY updated_at LIMIT ? OFFSET ?", (job_id, state, limit, offset), fetch="all")
+    else:
+        rows = execute(
+            "SELECT ip, state, detail, updated_at FROM job_targets WHERE job_id = ? "
+            "ORDER BY updated_at LIMIT ? OFFSET ?", (job_id, limit, offset), fetch="all")
+    return [{"ip": r[0], "state": r[1], "detail": r[2], "updated_at": r[3]} for r in rows]
+
+
+def done_targets(job_id, ips):
+    """IPs among `ips` that the job needs no more work on, looked up DONE_CHUNK at a time."""
+    placeholders = ",".join("?" * len(DONE_TARGET_STATES))
+    ips = list(ips)
+    done = set()
+    for start in range(0, len(ips), DONE_CHUNK):
+        chunk = ips[start:start + DONE_CHUNK]
+        done.update(row[0] for row in execute(
+            f"SELECT ip FROM job_targets WHERE job_id = ? AND state IN ({placeholders}) "
+            f"AND ip IN ({','.join('?' * len(chunk))})", (job_id, *DONE_TARGET_STATES, *chunk), fetch="all"))
+    return done
+
+
+def count_done_targets(job_id):
+    placeholders = ",".join("?" * len(DONE_TARGET_STATES))
+    return execute(f"SELECT COUNT(*) FROM job_targets WHERE job_id = ? AND state IN ({placeholders})",
+                    (job_id, *DONE_TARGET_STATES), fetch="one")[0]
+
+
+def unfinished_targets(job_id, ips):
+    """
+    Yields the ips a resumed job has not finished, checking them against job_targets a chunk
+    at a time, so a large job never holds the set of its done targets in memory.
+    """
+    ips = iter(ips)
+    while True:
+        chunk = list(itertools.islice(ips, DONE_CHUNK))
+        if not chunk:
+            return
+        done = done_targets(job_id, chunk)
+        yield from (ip for ip in chunk if ip not in done)
+
+
+def _run_job(job_id, scan_args):
+    # Imported here to avoid a circular import: scan_runner reports progress through this module
+    from utils.scan_runner import run_scan
+    from utils.coordinator import run_distributed
+
+    scan_args = dict(scan_args)
+    run = run_distributed if scan_args.pop("distributed", False) else run_scan
+    set_job_status(job_id, "running")
+    try:
+        result = run(job_id=job_id, **scan_args)
+        if result.get("status") == "error":
+            set_job_status(job_id, "failed", result.get("message"))
+        else:
+            set_job_status(job_id, "completed", result.get("message"))
+    except Exception as e:
+        logger.exception(f"Scan job {job_id} crashed: {e}")
+        set_job_status(job_id, "failed", str(e))
+
+
+def _worker_loop():
+    while True:
+        job_id, scan_args = _job_queue.get()
+        try:
+            _run_job(job_id, scan_args)
+        finally:
+            _job_queue.task_done()
+
+
+def _ensure_workers():
+    with _workers_lock:
+        while len(_workers) < MAX_CONCURRENT_JOBS:
+            worker = threading.Thread(target=_worker_loop, name=f"scan-job-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _enqueue(job_id, scan_args):
+    _ensure_workers()
+    _job_queue.put((job_id, scan_args))
+
+
+def submit_scan(project_name, username, password, domain, ip_input, serverip, freshness=DEFAULT_FRESHNESS,
+                distributed=False, retry_failed=False):
+    """
+    Queues a scan for background execution and returns the job ID immediately.
+    The job and its per-target progress are durable: a scan cut short by a restart is
+    resumed by recover_jobs(), skipping targets that were already finished.
+    Hosts that uploaded within `freshness` seconds are skipped. A distributed scan is
+    split into shards that remote collectors lease (see utils.coordinator). Targets that
+    failed recently are skipped while they back off, unless retry_failed is set.
+    """
+    job_id = create_job(project_name, ip_input, username, domain, serverip, freshness, password, distributed,
+                        retry_failed)
+    scan_args = {
+        "project_name": project_name,
+        "username": username,
+        "password": password,
+        "domain": domain,
+        "ip_input": ip_input,
+        "serverip": serverip,
+        "freshness": freshness,
+        "distributed": bool(distributed),
+        "retry_failed": bool(retry_failed),
+    }
+    _enqueue(job_id, scan_args)
+    logger.info(f"Queued scan job {job_id} for project {project_name}")
+    return job_id
+
+
+def _stored_args(job_id):
+    row = execute(
+        f"SELECT project_name, ip_input, {', '.join(JOB_ARG_COLUMNS)}, credentials FROM scan_jobs WHERE job_id = ?",
+        (job_id,), fetch="one")
+    if not row:
+        return None, None
+    scan_args = dict(zip(("project_name", "ip_input", *JOB_ARG_COLUMNS), row[:-1]))
+    if scan_args["freshness"] is None:
+        scan_args["freshness"] = DEFAULT_FRESHNESS
+    scan_args["distributed"] = bool(scan_args["distributed"])
+    scan_args["retry_failed"] = bool(scan_args["retry_failed"])
+    return scan_args, row[-1]
+
+
+def resume_job(job_id, username=None, password=None, domain=None):
+    """
+    Re-queues an interrupted job; finished targets are skipped.
+    Credentials are needed when the stored ones cannot be decrypted (e.g. the key changed).
+    Returns False if the job does not exist, is finished, or lacks credentials.
+    """
+    scan_args, sealed = _stored_args(job_id)
+    job = get_job(job_id)
+    if not scan_args or job["status"] in FINAL_JOB_STATES:
+        return False
+    if password:
+        scan_args.update(password=password, username=username or scan_args["username"],
+                         domain=domain if domain is not None else scan_args["domain"])
+        execute("UPDATE scan_jobs SET credentials = ?, username = ?, domain = ? WHERE job_id = ?",
+                 (_seal(password), scan_args["username"], scan_args["domain"], job_id))
+    else:
+        scan_args["password"] = _unseal(sealed)
+    if not scan_args["password"] or not scan_args["username"]:
+        return False
+    scan_args["domain"] = scan_args["domain"] or ""
+    set_job_status(job_id, "queued", "Resuming")
+    _enqueue(job_id, scan_args)
+    logger.info(f"Resuming scan job {job_id} for project {scan_args['project_name']}")
+    return True
+
+
+def recover_jobs():
+    """
+    Called at startup: jobs that were queued or running when the server stopped are resumed,
+    or marked 'interrupted' until POST /scans/<id>/resume supplies credentials.
+    """
+    rows = execute("SELECT job_id FROM scan_jobs WHERE status IN ('queued', 'running') ORDER BY created_at",
+                    fetch="all")
+    for (job_id,) in rows:
+        if not resume_job(job_id):
+            set_job_status(job_id, "interrupted", "Server restarted; resume the scan with credentials")
+            logger.warning(f"Scan job {job_id} was interrupted and needs credentials to resume")
+    return len(rows)
@@ -1,34 +1,157 @@
 # logging_config.py
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import queue
+import threading
+import time
+import zlib
+from utils.metrics import Counter
+
+LOG_DIR = "logs"
+LOG_FILE = os.path.join(LOG_DIR, "application.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+MAX_BYTES = 10 * 1024 * 1024   # the log file is rotated when it grows past this size...
+MAX_AGE = 24 * 3600            # ...or when it is older than this many seconds
+BACKUP_COUNT = 7
+QUEUE_SIZE = 10000             # records waiting for the writer thread; further records are dropped
+
+MAX_MESSAGE_CHARS = 4000       # longer messages are cut before they are queued
+OUTPUT_PREVIEW_CHARS = 500     # per-host command output kept in the log
+OUTPUT_SAMPLE_RATE = 50        # successful command output is logged for one host in this many
+
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s: %(message)s"
+
+
+def truncate(text, limit):
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed with extra={...} are included."""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """Rotates on size like RotatingFileHandler and additionally once the file is max_age seconds old."""
+
+    def __init__(self, filename, max_bytes, max_age, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.max_age = max_age
+        self.opened_at = self._created()
+
+    def _created(self):
+        try:
+            with open(self.baseFilename, "rb") as f:
+                first = f.readline()
+            # Age is counted from the first record, which survives restarts unlike the file's ctime
+            return time.mktime(time.strptime(json.loads(first)["time"][:19], "%Y-%m-%d %H:%M:%S"))
+        except (OSError, ValueError, KeyError, TypeError):
+            return time.time()
+
+    def shouldRollover(self, record):
+        if self.max_age and time.time() - self.opened_at >= self.max_age and os.path.getsize(self.baseFilename):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without waiting on file I/O. The message is rendered
+    and truncated here, and when the queue is full the record is counted and dropped.
+    """
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.msg = truncate(record.msg, MAX_MESSAGE_CHARS)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
 
 def setup_logging():
-    """Set up logging configuration."""
+    """
+    Configures the root logger once per process and returns it: callers log through a queue,
+    and one listener thread writes JSON lines to a rotating logs/application.log and plain
+    text to the console. Worker processes only log to the console so that a single process
+    owns (and rotates) the file.
+    """
+    global _listener
     logger = logging.getLogger()
+    with _setup_lock:
+        if _listener is not None:
+            return logger
 
-    # Check if any handler is already present (prevents adding multiple handlers)
-    if not logger.hasHandlers():
-        # Ensure logs directory exists
-        os.makedirs("logs", exist_ok=True)
-        
-        # Set up a file handler to save logs
-        file_handler = logging.FileHandler("logs/application.log")
-        file_handler.setLevel(logging.INFO)
-        
-        # Create a formatter
-        formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-        file_handler.setFormatter(formatter)
-        
-        # Add the handler to the logger
-        logger.addHandler(file_handler)
-
-        # Set the root logger to INFO level
-        logger.setLevel(logging.INFO)
-        
-        # Optionally, add a console handler if you want console logs too
         console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers = [console_handler]
+        if multiprocessing.parent_process() is None:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            file_handler = RotatingLogHandler(LOG_FILE, MAX_BYTES, MAX_AGE, BACKUP_COUNT)
+            file_handler.setFormatter(JsonFormatter())
+            handlers.insert(0, file_handler)
 
+        log_queue = queue.Queue(QUEUE_SIZE)
+        # Replaces any earlier configuration (e.g. a basicConfig() made by a library)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(NonBlockingQueueHandler(log_queue))
+        logger.setLevel(LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
     return logger
+
+
+def log_command_output(logger, ip, output, ok=True):
+    """
+    Logs the output of a command run on a host without flooding the log: output is cut to
+    OUTPUT_PREVIEW_CHARS, and for successful runs only one host in OUTPUT_SAMPLE_RATE
+    (picked by a hash of the IP, so a given host is logged consistently) gets its output
+    logged at all. Failures are always logged.
+    """
+    size = len(output or "")
+    if ok:
+        if zlib.crc32(str(ip).encode()) % OUTPUT_SAMPLE_RATE:
+            return
+        logger.info(f"[+] Output from {ip} ({size} chars):\n{truncate(output, OUTPUT_PREVIEW_CHARS)}",
+                    extra={"host": ip, "output_chars": size})
+    else:
+        logger.error(f"[!] Error from {ip} ({size} chars):\n{truncate(output, OUTPUT_PREVIEW_CHARS)}",
+                     extra={"host": ip, "output_chars": size})
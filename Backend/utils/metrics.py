@@ -0,0 +1,153 @@
+# metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "asset_discovery_"
+
+# Seconds; covers fast SQLite commits up to multi-minute agent runs
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 200, 500)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, description, labels=()):
+        self.name = PREFIX + name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = list(self.series.items())
+        for key, value in sorted(series):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value set directly, or read from callback() (returning {label tuple: value}) at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), callback=None):
+        super().__init__(name, description, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = value
+
+    def render(self):
+        if self.callback:
+            try:
+                values = self.callback()
+            except Exception:
+                values = {}
+            with self.lock:
+                self.series = {tuple(str(v) for v in key): value for key, value in values.items() if value is not None}
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.series.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self.series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_all():
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Per-stage instrumentation shared by the modules that do the work
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency.",
+                                 ("method", "endpoint", "status"))
+PROBE_SECONDS = Histogram("probe_duration_seconds", "TCP discovery time per host.", ("outcome",))
+EXEC_SECONDS = Histogram("exec_duration_seconds", "Remote agent launch time per host.", ("backend", "outcome"))
+AGENT_RUNTIME_SECONDS = Histogram("agent_runtime_seconds", "Time from agent launch to its upload.")
+UPLOAD_PARSE_SECONDS = Histogram("upload_parse_duration_seconds", "Decompress, parse and validate time per upload.")
+UPLOADS_TOTAL = Counter("uploads_total", "Uploads received by result.", ("result",))
+DB_COMMIT_SECONDS = Histogram("db_commit_duration_seconds", "SQLite batch transaction time.", ("database",))
+DB_BATCH_SIZE = Histogram("db_batch_size", "Work items per SQLite transaction.", ("database",), SIZE_BUCKETS)
+PDF_RENDER_SECONDS = Histogram("pdf_render_duration_seconds", "PDF render time per asset.", ("mode",))
+PDF_CACHE_TOTAL = Counter("pdf_cache_requests_total", "PDF cache lookups by result.", ("result",))
@@ -0,0 +1,239 @@
+# payload_schema.py
+import json
+
+MAX_DEPTH = 12              # ConvertTo-Json -Depth 10 plus the section level
+MAX_STRING = 64 * 1024      # characters in one string value
+MAX_KEYS = 1000             # keys in one object
+MAX_ITEMS = 100000          # items in one list (installed software is the largest)
+
+SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+class PayloadError(ValueError):
+    """Raised for uploads that are rejected before they reach the spool."""
+
+
+class PayloadTooLarge(PayloadError):
+    """The upload is over the size limit once decompressed."""
+
+
+class SchemaError(PayloadError):
+    """A schema violation; the path to the offending value is collected while unwinding."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+        self.path = []
+
+    def __str__(self):
+        path = "".join(f"[{part}]" if isinstance(part, int) else f".{part}" for part in reversed(self.path))
+        return f"{path.lstrip('.') or 'payload'}: {self.message}"
+
+
+def any_value(depth=MAX_DEPTH):
+    """Any JSON value within the global depth and size limits, checked by walking it."""
+    def check(value, level=0):
+        kind = type(value)
+        if kind is str:
+            if len(value) > MAX_STRING:
+                raise SchemaError("string too long")
+        elif kind is dict or kind is list:
+            if level >= depth:
+                raise SchemaError("nested too deeply")
+            position = None
+            try:
+                if kind is dict:
+                    if len(value) > MAX_KEYS:
+                        raise SchemaError("too many keys")
+                    for position, item in value.items():
+                        check(item, level + 1)
+                else:
+                    if len(value) > MAX_ITEMS:
+                        raise SchemaError("too many items")
+                    for position, item in enumerate(value):
+                        check(item, level + 1)
+            except SchemaError as e:
+                if position is not None:
+                    e.path.append(position)
+                raise
+        elif kind not in SCALARS:
+            raise SchemaError(f"unsupported value {kind.__name__}")
+    return check
+
+
+_limits = any_value()
+
+
+def decode(body):
+    """
+    Decodes an upload (bytes or str), checking the size and depth limits on the way.
+    Returns (data, containers): containers maps the id() of every object holding a list or
+    an object to its depth. Raises SchemaError for a violation, ValueError for bad JSON.
+    """
+    containers = {}
+    violations = []
+    depth_of = containers.get
+
+    def list_depth(items):
+        if len(items) > MAX_ITEMS:
+            violations.append(items)
+        depth = 0
+        for value in items:
+            kind = type(value)
+            if kind is str:
+                if len(value) > MAX_STRING:
+                    violations.append(value)
+            elif kind is dict:
+                child = depth_of(id(value), 1)
+                if child > depth:
+                    depth = child
+            elif kind is list:
+                child = list_depth(value)
+                if child > depth:
+                    depth = child
+        return depth + 1
+
+    def on_object(obj):
+        if len(obj) > MAX_KEYS:
+            violations.append(obj)
+        depth = 0
+        for value in obj.values():
+            kind = type(value)
+            if kind is str:
+                if len(value) > MAX_STRING:
+                    violations.append(value)
+            elif kind is dict:
+                child = depth_of(id(value), 1)
+                if child > depth:
+                    depth = child
+            elif kind is list:
+                child = list_depth(value)
+                if child > depth:
+                    depth = child
+        if depth:
+            containers[id(obj)] = depth + 1
+        return obj
+
+    if isinstance(body, (bytes, bytearray)):
+        body = body.decode("utf-8")
+    data = json.JSONDecoder(object_hook=on_object).decode(body)
+    kind = type(data)
+    depth = depth_of(id(data), 1) if kind is dict else list_depth(data) if kind is list else 0
+    if violations or depth > MAX_DEPTH:
+        # Walk again only to name the offending path
+        _limits(data)
+    return data, containers
+
+
+def string(required=False):
+    def check(value, containers):
+        if value is None and not required:
+            return
+        if type(value) is not str:
+            raise SchemaError("must be a string")
+        if required and not value.strip():
+            raise SchemaError("must not be empty")
+    return check
+
+
+def _scalar(value, containers):
+    if type(value) not in SCALARS:
+        raise SchemaError("must be a string, number, boolean or null")
+
+
+def scalar():
+    return _scalar
+
+
+def record(fields=None, required=(), scalars=False):
+    """
+    An object whose known `fields` follow their own rules. With scalars=True every other
+    key must hold a scalar; decode() already knows whether the object holds any container,
+    so its values are only looked at when it does. Keys listed in `required` must be present.
+    """
+    fields = dict(fields or {})
+    # Scalar fields of a scalars-only record hold when the record holds no container
+    checked = [(key, rule) for key, rule in fields.items() if not (scalars and rule is _scalar)]
+
+    def check(value, containers):
+        if type(value) is not dict:
+            raise SchemaError("must be an object")
+        key = None
+        try:
+            for key in required:
+                if key not in value:
+                    raise SchemaError("is required")
+            if scalars and id(value) in containers:
+                for key, item in value.items():
+                    if key not in fields:
+                        _scalar(item, containers)
+            for key, rule in checked:
+                if key in value:
+                    rule(value[key], containers)
+        except SchemaError as e:
+            e.path.append(key)
+            raise
+    return check
+
+
+def records(item):
+    """A list of `item`, or a single `item` (ConvertTo-Json unwraps one-element arrays)."""
+    def check(value, containers):
+        if type(value) is dict:
+            item(value, containers)
+            return
+        if type(value) is not list:
+            raise SchemaError("must be a list or an object")
+        index = None
+        try:
+            for index, entry in enumerate(value):
+                item(entry, containers)
+        except SchemaError as e:
+            e.path.append(index)
+            raise
+    return check
+
+
+def nullable(rule):
+    def check(value, containers):
+        if value is not None:
+            rule(value, containers)
+    return check
+
+
+AGENT_PAYLOAD = record(
+    fields={
+        "AssetProjectDetails": record(
+            fields={"ProjectName": string(True), "ClientIp": string(True), "MachineName": string(True)},
+            required=("ProjectName", "ClientIp", "MachineName"),
+            scalars=True,
+        ),
+        "AssetDetails": nullable(record(scalars=True)),
+        "Users": nullable(records(record(fields={"Name": string(), "SID": string()}, scalars=True))),
+        # One single-key object per category (ComputerSystem, OperatingSystem, Processor, ...)
+        "Hardware": nullable(records(record())),
+        "Software": nullable(records(record(fields={"Name": string(), "Version": scalar()}, scalars=True))),
+        # Antivirus, Firewall and the installed hotfixes
+        "Security": nullable(records(record())),
+    },
+    required=("AssetProjectDetails",),
+)
+
+# Project, machine and IP become DB and report file names
+NAMED_FIELDS = ("ProjectName", "MachineName", "ClientIp")
+
+
+def parse(body):
+    """
+    Decodes an upload and checks it against the compiled schema in one pass. Returns
+    (data, project_name, client_ip, system_name); raises PayloadError naming the offending
+    path, or ValueError for malformed JSON.
+    """
+    data, containers = decode(body)
+    AGENT_PAYLOAD(data, containers)
+    details = data["AssetProjectDetails"]
+    for field in NAMED_FIELDS:
+        value = details[field]
+        if "/" in value or "\\" in value or value.startswith("."):
+            raise PayloadError(f"AssetProjectDetails.{field}: must not contain path separators or start with a dot")
+    return data, details["ProjectName"], details["ClientIp"], details["MachineName"]
@@ -0,0 +1,307 @@
+# payload_store.py
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import msgpack
+from utils.db_pool import register_schema, run_script
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS_DIR = os.path.join(BASE_DIR, "reports")
+OBJECTS_DIR = os.path.join(REPORTS_DIR, "objects")
+
+# Bulky, slowly changing payload sections stored once per distinct content
+DEDUP_SECTIONS = ("Software", "Users", "Hardware", "Security")
+
+RETENTION_DAYS = 90        # report manifests older than this are pruned...
+KEEP_PER_HOST = 5          # ...but the newest N per host are always kept
+MAINTENANCE_INTERVAL = 24 * 3600
+
+PAYLOAD_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS payload_sections (
+    hash TEXT PRIMARY KEY,
+    section TEXT NOT NULL,
+    body BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scan_sections (
+    scan_id INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    changed INTEGER NOT NULL,
+    PRIMARY KEY (scan_id, section)
+);
+CREATE INDEX IF NOT EXISTS idx_scan_sections_hash ON scan_sections (hash);
+'''
+
+register_schema(lambda conn: run_script(conn, PAYLOAD_SCHEMA))
+
+REPORT_NAME = re.compile(r"^(?P<host>.+)_(?P<ts>\d{8}_\d{6})\.json$")
+
+
+def section_hash(section, value):
+    """Content hash of a section, independent of key order inside the agent's JSON."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{section}\0{canonical}".encode("utf-8")).hexdigest()
+
+
+def is_ref(value):
+    return isinstance(value, dict) and len(value) == 1 and "$ref" in value
+
+
+def split_payload(data):
+    """Returns (skeleton, {section: (hash, value)}) with deduplicated sections replaced by refs."""
+    skeleton = dict(data)
+    sections = {}
+    for section in DEDUP_SECTIONS:
+        if section in data and not is_ref(data[section]):
+            digest = section_hash(section, data[section])
+            sections[section] = (digest, data[section])
+            skeleton[section] = {"$ref": digest}
+    return skeleton, sections
+
+
+def encode_section(value):
+    """Section bodies are stored as MessagePack: smaller than JSON text and faster to decode."""
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def decode_section(body):
+    # Bodies written before the binary encoding are JSON text
+    if isinstance(body, str):
+        return json.loads(body)
+    return msgpack.unpackb(body, raw=False, strict_map_key=False)
+
+
+def pack_payload(conn, data, previous_scan_id=None):
+    """
+    Stores each deduplicated section once and returns (json_text, section_hashes, changed_sections).
+    json_text is the payload with those sections replaced by {"$ref": hash}.
+    """
+    skeleton, sections = split_payload(data)
+    previous = {}
+    if previous_scan_id is not None:
+        previous = dict(conn.execute(
+            "SELECT section, hash FROM scan_sections WHERE scan_id = ?", (previous_scan_id,)).fetchall())
+
+    now = time.time()
+    conn.executemany(
+        "INSERT OR IGNORE INTO payload_sections (hash, section, body, created_at) VALUES (?, ?, ?, ?)",
+        [(digest, section, encode_section(value), now) for section, (digest, value) in sections.items()],
+    )
+    hashes = {section: digest for section, (digest, _) in sections.items()}
+    changed = [section for section, digest in hashes.items() if previous.get(section) != digest]
+    return json.dumps(skeleton, separators=(",", ":")), hashes, changed
+
+
+def record_scan_sections(conn, scan_id, hashes, changed):
+    conn.executemany(
+        "INSERT OR REPLACE INTO scan_sections (scan_id, section, hash, changed) VALUES (?, ?, ?, ?)",
+        [(scan_id, section, digest, int(section in changed)) for section, digest in hashes.items()],
+    )
+
+
+def load_payload(conn, json_text, sections=None):
+    """
+    Parses a stored payload and resolves section refs.
+    Only the sections listed in `sections` are fetched (all when None); others keep their ref,
+    so a reader that needs AssetDetails never loads the software list.
+    Rows written before deduplication have no refs and are returned unchanged.
+    """
+    data = json.loads(json_text)
+    if not isinstance(data, dict):
+        return data
+    for section, value in data.items():
+        if is_ref(value) and (sections is None or section in sections):
+            row = conn.execute("SELECT body FROM payload_sections WHERE hash = ?", (value["$ref"],)).fetchone()
+            data[section] = decode_section(row[0]) if row else None
+    return data
+
+
+def payload_loader(conn, sections=None):
+    return lambda json_text: load_payload(conn, json_text, sections)
+
+
+def recode_sections(conn, batch=500):
+    """Re-encodes section bodies stored as JSON text to MessagePack. Returns bodies converted."""
+    converted = 0
+    while True:
+        rows = conn.execute(
+            "SELECT hash, body FROM payload_sections WHERE typeof(body) = 'text' LIMIT ?", (batch,)).fetchall()
+        if not rows:
+            return converted
+        conn.executemany("UPDATE payload_sections SET body = ? WHERE hash = ?",
+                         [(encode_section(json.loads(body)), digest) for digest, body in rows])
+        converted += len(rows)
+
+
+def compact_project(conn):
+    """Rewrites legacy full-blob success rows into the deduplicated form. Returns rows converted."""
+    converted = 0
+    rows = conn.execute('''
+        SELECT id, json_data FROM scan_results
+        WHERE lower(status) = 'success' AND id NOT IN (SELECT scan_id FROM scan_sections)
+        ORDER BY id
+    ''').fetchall()
+    previous_by_host = {}
+    for scan_id, json_text in rows:
+        try:
+            data = json.loads(json_text)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        if not isinstance(data, dict):
+            continue
+        host = (data.get("AssetProjectDetails") or {}).get("MachineName")
+        packed, hashes, changed = pack_payload(conn, data, previous_by_host.get(host))
+        conn.execute("UPDATE scan_results SET json_data = ? WHERE id = ?", (packed, scan_id))
+        record_scan_sections(conn, scan_id, hashes, changed)
+        previous_by_host[host] = scan_id
+        converted += 1
+    return converted
+
+
+# --- reports/ directory -------------------------------------------------------
+
+def _object_path(digest):
+    return os.path.join(OBJECTS_DIR, digest[:2], f"{digest}.json.gz")
+
+
+def _write_object(digest, body):
+    path = _object_path(digest)
+    if os.path.exists(path):
+        # Refresh mtime so a compaction running right now does not collect it
+        os.utime(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def write_report(base_name, data):
+    """
+    Archives a payload under reports/: each deduplicated section goes to a content-addressed,
+    gzipped object written only once, and base_name holds a small manifest of refs.
+    """
+    skeleton, sections = split_payload(data)
+    for digest, value in sections.values():
+        _write_object(digest, json.dumps(value, separators=(",", ":")))
+    with open(os.path.join(REPORTS_DIR, base_name), "w", encoding="utf-8") as f:
+        json.dump(skeleton, f, separators=(",", ":"))
+
+
+def read_report(path):
+    """Loads a report manifest (or a legacy full report) with its sections resolved."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for section, value in data.items():
+        if is_ref(value):
+            with gzip.open(_object_path(value["$ref"]), "rt", encoding="utf-8") as f:
+                data[section] = json.load(f)
+    return data
+
+
+def compact_reports(retention_days=RETENTION_DAYS, keep_per_host=KEEP_PER_HOST):
+    """
+    Applies the retention policy to reports/ and deduplicates what is left:
+    old manifests are pruned (keeping the newest keep_per_host per host), legacy
+    full reports are converted to manifests, and unreferenced objects are deleted.
+    """
+    if not os.path.isdir(REPORTS_DIR):
+        return {"pruned": 0, "converted": 0, "objects_removed": 0}
+
+    by_host = {}
+    for name in os.listdir(REPORTS_DIR):
+        match = REPORT_NAME.match(name)
+        if match:
+            by_host.setdefault(match.group("host"), []).append((match.group("ts"), name))
+
+    started = time.time()
+    cutoff = time.strftime("%Y%m%d_%H%M%S", time.localtime(time.time() - retention_days * 86400))
+    pruned = converted = 0
+    referenced = set()
+    for reports in by_host.values():
+        reports.sort(reverse=True)
+        for index, (ts, name) in enumerate(reports):
+            path = os.path.join(REPORTS_DIR, name)
+            if index >= keep_per_host and ts < cutoff:
+                os.remove(path)
+                pruned += 1
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Skipping unreadable report {name}: {e}")
+                continue
+            if not isinstance(data, dict):
+                continue
+            if any(section in data and not is_ref(data[section]) for section in DEDUP_SECTIONS):
+                write_report(name, data)
+                converted += 1
+                data, _ = split_payload(data)
+            referenced.update(value["$ref"] for value in data.values() if is_ref(value))
+
+    objects_removed = 0
+    if os.path.isdir(OBJECTS_DIR):
+        for root, _, files in os.walk(OBJECTS_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                if not name.endswith(".json.gz") or name[:-len(".json.gz")] in referenced:
+                    continue
+                # Objects touched during this run may belong to a manifest written meanwhile
+                if os.path.getmtime(path) >= started - 3600:
+                    continue
+                os.remove(path)
+                objects_removed += 1
+
+    result = {"pruned": pruned, "converted": converted, "objects_removed": objects_removed}
+    logger.info(f"Reports compaction: {result}")
+    return result
+
+
+_maintenance_started = False
+
+
+def start_maintenance(interval=MAINTENANCE_INTERVAL):
+    """Runs compact_reports() in a daemon thread every `interval` seconds."""
+    global _maintenance_started
+    if _maintenance_started:
+        return
+    _maintenance_started = True
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                compact_reports()
+            except Exception as e:
+                logger.error(f"Reports compaction failed: {e}")
+
+    threading.Thread(target=loop, name="reports-maintenance", daemon=True).start()
+
+
+def compact_all_projects():
+    """Converts legacy rows of every db/*.db project to the deduplicated form."""
+    from utils import asset_schema  # noqa: F401  (registers its schema before the writers open)
+    from utils.db_pool import submit_write, DB_DIR
+    for file_name in sorted(os.listdir(DB_DIR)):
+        if file_name.endswith(".db"):
+            count = submit_write(file_name[:-3], compact_project).result()
+            recoded = submit_write(file_name[:-3], recode_sections).result()
+            print(f"{file_name}: compacted {count} rows, re-encoded {recoded} sections")
+
+
+if __name__ == "__main__":
+    # python -m utils.payload_store [retention_days] [keep_per_host]
+    args = [int(arg) for arg in sys.argv[1:3]]
+    compact_all_projects()
+    print(compact_reports(*args))
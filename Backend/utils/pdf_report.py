@@ -0,0 +1,298 @@
+# pdf_report.py
+import hashlib
+import json
+import os
+import threading
+import time
+import multiprocessing
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from io import BytesIO
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from utils.logging_config import setup_logging
+from utils.metrics import PDF_RENDER_SECONDS, PDF_CACHE_TOTAL
+
+logger = setup_logging()
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PDF_CACHE_DIR = os.path.join(BASE_DIR, "reports", "pdf_cache")
+PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+BULK_RENDER_WORKERS = os.cpu_count() or 2
+
+REPORT_SECTIONS = ["AssetDetails", "Hardware", "Software", "Users", "Security"]
+
+
+@lru_cache(maxsize=65536)
+def measure(word):
+    return stringWidth(word, "Helvetica", 10)
+
+
+def render_asset_pdf(asset_name, json_data):
+    """Renders one asset report and returns the PDF bytes. json_data is the parsed payload."""
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=letter, invariant=1)
+    width, height = letter
+
+    y = height - 50
+    left_margin = 40
+    line_height = 15
+    max_width = width - 2 * left_margin
+
+    def check_page_space(y, lines_needed=1):
+        if y < 60 + line_height * lines_needed:
+            p.showPage()
+            p.setFont("Helvetica", 10)
+            return height - 50
+        return y
+
+    space_width = stringWidth(" ", "Helvetica", 10)
+
+    def draw_wrapped_text(key, value, y, indent=0):
+        x = left_margin + indent
+        p.setFont("Helvetica-Bold", 10)
+        p.drawString(x, y, f"{key}:")
+        y -= line_height
+
+        p.setFont("Helvetica", 10)
+        text = str(value)
+        limit = max_width - indent
+        # Each word is measured once and the line width is kept as a running sum,
+        # which matches measuring the whole line since Helvetica widths are additive
+        line_words = []
+        line_width = 0
+        for word in text.split():
+            word_width = measure(word) + space_width
+            if line_width + word_width <= limit:
+                line_words.append(word)
+                line_width += word_width
+            else:
+                p.drawString(x + 20, y, " ".join(line_words))
+                y = check_page_space(y)
+                y -= line_height
+                line_words = [word]
+                line_width = word_width
+        if line_words:
+            y = check_page_space(y)
+            p.drawString(x + 20, y, " ".join(line_words))
+            y -= line_height
+        return y
+
+    def draw_dict(data, y, indent=0):
+        for key, value in data.items():
+            y = check_page_space(y)
+            if isinstance(value, dict):
+                p.setFont("Helvetica-Bold", 10)
+                p.drawString(left_margin + indent, y, f"{key}:")
+                y -= line_height
+                y = draw_dict(value, y, indent + 20)
+            elif isinstance(value, list):
+                p.setFont("Helvetica-Bold", 10)
+                p.drawString(left_margin + indent, y, f"{key}:")
+                y -= line_height
+                for idx, item in enumerate(value):
+                    if isinstance(item, dict):
+                        y = draw_dict(item, y, indent + 20)
+                    else:
+                        y = draw_wrapped_text(f"- Item {idx + 1}", item, y, indent + 20)
+            else:
+                y = draw_wrapped_text(key, value, y, indent)
+        return y
+
+    def draw_section(title, section_data, y):
+        y = check_page_space(y, 2)
+        p.setFont("Helvetica-Bold", 12)
+        p.drawString(left_margin, y, title)
+        y -= line_height
+
+        if isinstance(section_data, list):
+            for item in section_data:
+                if isinstance(item, dict) and len(item) == 1:
+                    for key, val in item.items():
+                        y = check_page_space(y)
+                        p.setFont("Helvetica-Bold", 10)
+                        p.drawString(left_margin + 10, y, f"{key}:")
+                        y -= line_height
+                        if isinstance(val, dict):
+                            y = draw_dict(val, y, indent=20)
+                        elif isinstance(val, list):
+                            for idx, subval in enumerate(val):
+                                if isinstance(subval, dict):
+                                    y = check_page_space(y)
+                                    p.setFont("Helvetica-Oblique", 10)
+                                    p.drawString(left_margin + 20, y, f"- Item {idx + 1}")
+                                    y -= line_height
+                                    y = draw_dict(subval, y, indent=30)
+                                else:
+                                    y = draw_wrapped_text(f"- Item {idx + 1}", subval, y, indent=30)
+                        else:
+                            y = draw_wrapped_text(key, val, y, indent=20)
+                elif isinstance(item, dict):
+                    y = draw_dict(item, y, indent=10)
+                else:
+                    y = draw_wrapped_text("Item", item, y, indent=10)
+        elif isinstance(section_data, dict):
+            y = draw_dict(section_data, y, indent=10)
+        else:
+            y = draw_wrapped_text(title, section_data, y, indent=10)
+
+        y -= 10
+        return y
+
+    # Header
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(left_margin, y, f"Asset Report: {asset_name}")
+    y -= 30
+
+    for section in REPORT_SECTIONS:
+        if section in json_data:
+            y = draw_section(section, json_data[section], y)
+
+    p.save()
+    return buffer.getvalue()
+
+
+_cache_lock = threading.Lock()
+_cache_size = None
+
+
+def payload_hash(json_text):
+    return hashlib.sha256(json_text.encode("utf-8")).hexdigest()
+
+
+def cache_path(project_name, asset_name, digest):
+    key = hashlib.sha256(f"{project_name}\0{asset_name}\0{digest}".encode("utf-8")).hexdigest()
+    return os.path.join(PDF_CACHE_DIR, key[:2], f"{key}.pdf")
+
+
+def _cached_files():
+    for root, _, files in os.walk(PDF_CACHE_DIR):
+        for name in files:
+            if name.endswith(".pdf"):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+
+def _store(path, pdf_bytes):
+    """Atomically writes a rendered PDF and evicts least recently used entries past the size cap."""
+    global _cache_size
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf_bytes)
+    os.replace(tmp_path, path)
+
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(size for _, size, _ in _cached_files())
+        else:
+            _cache_size += len(pdf_bytes)
+        if _cache_size <= PDF_CACHE_MAX_BYTES:
+            return
+        # Hits refresh mtime, so the oldest mtime is the least recently used report
+        for old_path, size, _ in sorted(_cached_files(), key=lambda entry: entry[2]):
+            if _cache_size <= PDF_CACHE_MAX_BYTES * 0.9:
+                break
+            if old_path == path:
+                continue
+            try:
+                os.remove(old_path)
+                _cache_size -= size
+            except FileNotFoundError:
+                pass
+
+
+def get_asset_pdf(project_name, asset_name, json_text, load=json.loads):
+    """
+    Returns the path of the asset's PDF, rendering it only when this payload has not been rendered before.
+    load(json_text) produces the payload dict and is only called on a cache miss.
+    """
+    path = cache_path(project_name, asset_name, payload_hash(json_text))
+    try:
+        os.utime(path)
+        PDF_CACHE_TOTAL.inc(result="hit")
+        return path
+    except FileNotFoundError:
+        PDF_CACHE_TOTAL.inc(result="miss")
+    with PDF_RENDER_SECONDS.time(mode="single"):
+        pdf_bytes = render_asset_pdf(asset_name, load(json_text))
+    _store(path, pdf_bytes)
+    return path
+
+
+def _timed_render(asset_name, json_data):
+    """render_asset_pdf for the worker processes; the duration is reported back to the parent."""
+    started = time.perf_counter()
+    pdf_bytes = render_asset_pdf(asset_name, json_data)
+    return pdf_bytes, time.perf_counter() - started
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: forking a process that owns DB writer threads is not safe
+            _process_pool = ProcessPoolExecutor(max_workers=BULK_RENDER_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def write_project_zip(project_name, assets, out_file, load=json.loads):
+    """
+    Writes a ZIP with one PDF per asset into out_file.
+    assets yields (asset_name, json_text); cache misses are loaded with load(json_text) and
+    rendered in parallel worker processes with a bounded number of payloads in flight.
+    """
+    pool = _get_process_pool()
+    window = BULK_RENDER_WORKERS * 2
+    try:
+        _write_zip(project_name, assets, out_file, pool, window, load)
+    except BrokenProcessPool:
+        # A crashed worker poisons the pool; start a fresh one for the next export
+        global _process_pool
+        with _process_pool_lock:
+            if _process_pool is pool:
+                _process_pool = None
+        pool.shutdown(wait=False)
+        raise
+
+
+def _write_zip(project_name, assets, out_file, pool, window, load):
+    in_flight = []
+
+    def finish(entry):
+        asset_name, path, future = entry
+        if future is not None:
+            pdf_bytes, seconds = future.result()
+            PDF_RENDER_SECONDS.observe(seconds, mode="bulk")
+            _store(path, pdf_bytes)
+            archive.writestr(f"{asset_name}_details.pdf", pdf_bytes)
+        else:
+            archive.write(path, f"{asset_name}_details.pdf")
+
+    with zipfile.ZipFile(out_file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for asset_name, json_text in assets:
+            path = cache_path(project_name, asset_name, payload_hash(json_text))
+            if os.path.exists(path):
+                os.utime(path)
+                PDF_CACHE_TOTAL.inc(result="hit")
+                in_flight.append((asset_name, path, None))
+            else:
+                PDF_CACHE_TOTAL.inc(result="miss")
+                in_flight.append((asset_name, path, pool.submit(_timed_render, asset_name, load(json_text))))
+            if len(in_flight) >= window:
+                finish(in_flight.pop(0))
+        for entry in in_flight:
+            finish(entry)
@@ -0,0 +1,158 @@
+# port_prober.py
+import asyncio
+import errno
+import time
+from utils.logging_config import setup_logging
+from utils.metrics import PROBE_SECONDS
+
+logger = setup_logging()
+
+# Management ports checked during discovery: WMI/DCOM, WinRM HTTP, WinRM HTTPS
+DISCOVERY_PORTS = (135, 5985, 5986)
+
+DEFAULT_CONCURRENCY = 512     # hosts probed at the same time
+DEFAULT_TIMEOUT = 1.0         # seconds allowed per host (all ports are tried in parallel)
+DEFAULT_RATE = 2000           # connection attempts per second across the whole sweep, 0 = unlimited
+
+
+class RateLimiter:
+    """Token bucket shared by every probe in one event loop."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _max_safe_concurrency(ports_per_host):
+    """Caps host concurrency so open sockets stay below the process file descriptor limit."""
+    try:
+        import resource
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return None
+    if soft_limit == resource.RLIM_INFINITY:
+        return None
+    # Leave headroom for the DB, log files and the Flask server itself
+    return max((soft_limit - 128) // max(ports_per_host, 1), 1)
+
+
+# Local resource exhaustion: the collector, not the target, is overloaded
+RESOURCE_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL}
+
+
+async def _probe_port(ip, port, timeout):
+    """Returns (state, seconds) with state 'open', 'closed' (refused), 'error' (local resources) or None."""
+    started = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except ConnectionRefusedError:
+        return "closed", time.monotonic() - started
+    except asyncio.TimeoutError:
+        return None, time.monotonic() - started
+    except OSError as e:
+        return ("error" if e.errno in RESOURCE_ERRNOS else None), time.monotonic() - started
+    elapsed = time.monotonic() - started
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return "open", elapsed
+
+
+async def _probe_host(ip, ports, timeout, limiter):
+    """Returns (open_ports, outcome, latency) where latency is the fastest answer from the host."""
+    # Rate-limit tokens are taken first: waiting for them must not eat into the connect timeout
+    for _ in ports:
+        await limiter.acquire()
+    results = await asyncio.gather(*[_probe_port(ip, port, timeout) for port in ports])
+    open_ports = [port for port, (state, _) in zip(ports, results) if state == "open"]
+    answered = [elapsed for state, elapsed in results if state in ("open", "closed")]
+    if any(state == "error" for state, _ in results):
+        return open_ports, "error", None
+    if answered:
+        return open_ports, "success", min(answered)
+    # Silence is normal for unused addresses and says nothing about congestion
+    return open_ports, None, None
+
+
+async def probe_hosts(ips, on_result, ports=DISCOVERY_PORTS, concurrency=DEFAULT_CONCURRENCY,
+                      timeout=DEFAULT_TIMEOUT, rate=DEFAULT_RATE, on_start=None, scheduler=None):
+    """
+    Probes every IP in ips for the given ports using non-blocking connects.
+    ips is consumed lazily, so at most `concurrency` hosts are held in memory at once.
+    on_result(ip, open_ports, reachable) is called as soon as each host finishes; reachable
+    is True when any port answered (open or refused), False when the host stayed silent and
+    None when the probe could not tell (local resource errors).
+    scheduler is an optional AdaptiveLimiter that paces hosts below `concurrency`
+    (per subnet and across all scans) and learns from the probe latencies.
+    """
+    safe_limit = _max_safe_concurrency(len(ports))
+    if safe_limit and concurrency > safe_limit:
+        logger.warning(f"Lowering probe concurrency from {concurrency} to {safe_limit} (file descriptor limit)")
+        concurrency = safe_limit
+
+    limiter = RateLimiter(rate)
+    pending = {}
+
+    async def probe(ip):
+        started = time.monotonic()
+        try:
+            open_ports, outcome, latency = await _probe_host(ip, ports, timeout, limiter)
+            PROBE_SECONDS.observe(time.monotonic() - started, outcome=outcome or "silent")
+        except BaseException:
+            if scheduler:
+                scheduler.release(ip, None, None)
+            raise
+        if scheduler:
+            scheduler.release(ip, latency, outcome)
+        return open_ports, {"success": True, None: False}.get(outcome)
+
+    def report(tasks):
+        for task in tasks:
+            ip = pending.pop(task)
+            try:
+                open_ports, reachable = task.result()
+            except Exception as e:
+                logger.error(f"Probe error on {ip}: {e}")
+                open_ports, reachable = [], None
+            on_result(ip, open_ports, reachable)
+
+    async def drain(return_when):
+        done, _ = await asyncio.wait(pending, return_when=return_when)
+        report(done)
+
+    for ip in ips:
+        if len(pending) >= concurrency:
+            await drain(asyncio.FIRST_COMPLETED)
+        if scheduler:
+            await scheduler.acquire_async(ip)
+            report([task for task in pending if task.done()])
+        if on_start:
+            on_start(ip)
+        pending[asyncio.ensure_future(probe(ip))] = ip
+
+    if pending:
+        await drain(asyncio.ALL_COMPLETED)
+
+
+def discover_live_hosts(ips, on_result, **options):
+    """Blocking wrapper around probe_hosts for use from worker threads."""
+    started = time.monotonic()
+    asyncio.run(probe_hosts(ips, on_result, **options))
+    logger.info(f"Discovery sweep finished in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,182 @@
+# project_summary.py
+import time
+from utils.db_pool import register_schema, run_script
+from utils.asset_schema import HOST_KEY
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+SUMMARY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS summary_hosts (
+    host TEXT PRIMARY KEY,
+    scan_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    failure TEXT,
+    os_name TEXT,
+    license_status TEXT,
+    av_signature_status TEXT,
+    av_realtime TEXT,
+    fw_domain TEXT,
+    fw_private TEXT,
+    fw_public TEXT,
+    ram_gb REAL,
+    disk_gb REAL
+);
+CREATE TABLE IF NOT EXISTS summary_counts (
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    hosts INTEGER NOT NULL,
+    PRIMARY KEY (dimension, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summary_totals (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+'''
+
+# summary_hosts column -> breakdown reported by the summary endpoint
+DIMENSIONS = {
+    "status": "status",
+    "failure": "failure",
+    "os_name": "os",
+    "license_status": "license",
+    "av_signature_status": "av_signature",
+    "av_realtime": "av_realtime",
+    "fw_domain": "firewall_domain",
+    "fw_private": "firewall_private",
+    "fw_public": "firewall_public",
+}
+UNKNOWN = "Unknown"
+# Bumped when the way hosts are keyed changes; older summaries are rebuilt on migration
+SUMMARY_VERSION = 2
+COLUMNS = ("scan_id", "status", *[c for c in DIMENSIONS if c != "status"], "ram_gb", "disk_gb")
+
+
+def _apply(conn, state, sign):
+    """
+    Adds (sign=1) or removes (sign=-1) one host's contribution to the aggregates. Failed hosts
+    only count towards status and failure; the inventory breakdowns cover scanned hosts.
+    """
+    conn.executemany('''
+        INSERT INTO summary_counts (dimension, value, hosts) VALUES (?, ?, ?)
+        ON CONFLICT (dimension, value) DO UPDATE SET hosts = hosts + excluded.hosts
+    ''', [(dimension, str(state[column]) if state[column] not in (None, "") else UNKNOWN, sign)
+          for column, dimension in DIMENSIONS.items()
+          if column == "status" or (column == "failure") == (state["status"] == "Failed")])
+    conn.executemany('''
+        INSERT INTO summary_totals (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    ''', [("hosts", sign), ("ram_gb", sign * (state["ram_gb"] or 0)), ("disk_gb", sign * (state["disk_gb"] or 0))])
+
+
+def _host_state(conn, scan_id, status, failure):
+    state = dict.fromkeys(COLUMNS)
+    state.update(scan_id=scan_id, status="Success" if status.lower() == "success" else "Failed")
+    if state["status"] == "Failed":
+        state["failure"] = failure
+        return state
+    row = conn.execute('''
+        SELECT a.os_name, a.license_status, a.ram_gb, a.disk_gb, s.av_signature_status, s.av_realtime,
+               s.fw_domain, s.fw_private, s.fw_public
+        FROM assets a LEFT JOIN asset_security s ON s.scan_id = a.scan_id WHERE a.scan_id = ?
+    ''', (scan_id,)).fetchone()
+    if row:
+        state.update(zip(("os_name", "license_status", "ram_gb", "disk_gb", "av_signature_status", "av_realtime",
+                          "fw_domain", "fw_private", "fw_public"), row))
+    return state
+
+
+def record_summary(conn, scan_id, client_ip, system_name, status, failure=None):
+    """
+    Moves a host's contribution from its previous latest scan to this one. Runs inside the
+    writer's transaction after index_asset(), so the normalized rows of a success are readable.
+    Hosts are keyed like the device list: by system name, or by IP for failed rows. A success
+    replaces the earlier failure entry of its IP, which was the same host before it had a name.
+    """
+    host = system_name or client_ip
+    previous = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM summary_hosts WHERE host = ?", (host,)).fetchone()
+    if previous and previous[0] > scan_id:
+        return
+    if previous:
+        _apply(conn, dict(zip(COLUMNS, previous)), -1)
+    if system_name and client_ip and client_ip != host:
+        failed = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM summary_hosts WHERE host = ? AND scan_id < ?",
+                              (client_ip, scan_id)).fetchone()
+        if failed:
+            _apply(conn, dict(zip(COLUMNS, failed)), -1)
+            conn.execute("DELETE FROM summary_hosts WHERE host = ?", (client_ip,))
+    state = _host_state(conn, scan_id, status, failure)
+    conn.execute(f'''
+        INSERT OR REPLACE INTO summary_hosts (host, {', '.join(COLUMNS)}) VALUES (?, {', '.join('?' * len(COLUMNS))})
+    ''', [host, *[state[column] for column in COLUMNS]])
+    _apply(conn, state, 1)
+    conn.execute("DELETE FROM summary_counts WHERE hosts = 0")
+    conn.execute('''
+        INSERT INTO summary_totals (name, value) VALUES ('updated_at', ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    ''', (time.time(),))
+
+
+def rebuild_summary(conn):
+    """Recomputes the aggregates from each host's latest scan_results row. Returns hosts summarized."""
+    for table in ("summary_hosts", "summary_counts", "summary_totals"):
+        conn.execute(f"DELETE FROM {table}")
+    rows = conn.execute(f'''
+        SELECT r.id, r.client_ip, r.system_name, r.status, r.json_data FROM scan_results r
+        WHERE r.id IN (SELECT MAX(id) FROM scan_results GROUP BY {HOST_KEY}) ORDER BY r.id
+    ''').fetchall()
+    for scan_id, client_ip, system_name, status, json_data in rows:
+        failure = None if status.lower() == "success" else _failure_reason(json_data)
+        record_summary(conn, scan_id, client_ip, system_name, status, failure)
+    conn.execute("INSERT OR REPLACE INTO summary_totals (name, value) VALUES ('version', ?)", (SUMMARY_VERSION,))
+    return len(rows)
+
+
+def _failure_reason(json_data):
+    # Failed rows store the reason as a JSON string ("Port Closed", "Error during login", ...)
+    text = str(json_data or "")
+    return text[1:-1] if len(text) > 1 and text[0] == text[-1] == '"' else text or None
+
+
+def migrate(conn):
+    run_script(conn, SUMMARY_SCHEMA)
+    summarized = conn.execute("SELECT 1 FROM summary_totals WHERE name = 'version' AND value >= ?",
+                              (SUMMARY_VERSION,)).fetchone()
+    if summarized:
+        return 0
+    if not conn.execute("SELECT 1 FROM scan_results LIMIT 1").fetchone():
+        conn.execute("INSERT OR REPLACE INTO summary_totals (name, value) VALUES ('version', ?)", (SUMMARY_VERSION,))
+        return 0
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    try:
+        count = rebuild_summary(conn)
+        if own_transaction:
+            conn.execute("COMMIT")
+    except Exception:
+        if own_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    logger.info(f"Built the project summary from {count} hosts")
+    return count
+
+
+register_schema(migrate)
+
+
+def read_summary(conn):
+    """The materialized breakdowns and totals; cost depends on distinct values, not on hosts."""
+    totals = dict(conn.execute("SELECT name, value FROM summary_totals"))
+    summary = {
+        "hosts": int(totals.get("hosts", 0)),
+        "ram_gb": round(totals.get("ram_gb", 0.0), 2),
+        "disk_gb": round(totals.get("disk_gb", 0.0), 2),
+        "updated_at": totals.get("updated_at"),
+    }
+    for dimension in DIMENSIONS.values():
+        summary[dimension] = {}
+    for dimension, value, hosts in conn.execute(
+            "SELECT dimension, value, hosts FROM summary_counts ORDER BY dimension, hosts DESC, value"):
+        summary.setdefault(dimension, {})[value] = hosts
+    return summary
@@ -0,0 +1,214 @@
+# scan_diff.py
+import json
+import os
+import time
+from utils.db_pool import register_schema, run_script, DB_DIR
+from utils.payload_store import load_payload, DEDUP_SECTIONS
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+DRIFT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scan_drift (
+    scan_id INTEGER PRIMARY KEY,
+    previous_scan_id INTEGER NOT NULL,
+    system_name TEXT NOT NULL,
+    detected_at REAL NOT NULL,
+    change_count INTEGER NOT NULL,
+    sections TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scan_drift_host ON scan_drift (system_name, detected_at);
+CREATE INDEX IF NOT EXISTS idx_scan_drift_time ON scan_drift (detected_at);
+
+CREATE TABLE IF NOT EXISTS scan_changes (
+    scan_id INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    change TEXT NOT NULL,
+    path TEXT NOT NULL,
+    old_value TEXT,
+    new_value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scan_changes_scan ON scan_changes (scan_id);
+CREATE INDEX IF NOT EXISTS idx_scan_changes_section ON scan_changes (section, change);
+'''
+
+register_schema(lambda conn: run_script(conn, DRIFT_SCHEMA))
+
+# Fields that identify an entry in a list of records (hotfixes, firewall profiles, users, software, ...)
+ITEM_KEYS = ("HotFixID", "Profile", "SID", "Name", "DeviceID", "DriveID", "NICName", "MACAddress")
+
+
+def _item_key(item):
+    for field in ITEM_KEYS:
+        if item.get(field) not in (None, ""):
+            return str(item[field])
+    return None
+
+
+def _as_mapping(value):
+    """
+    Turns the agent's lists into dicts so they can be compared entry by entry:
+    lists of records become {item key: record}, Hardware/Security style lists of
+    single-key dicts are merged. Returns None for lists that fit neither shape.
+    """
+    if isinstance(value, dict):
+        return value
+    if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+        return None
+    keys = [_item_key(item) for item in value]
+    if value and None not in keys:
+        if len(set(keys)) < len(keys):
+            # Same name twice (e.g. two installed versions): identify entries by content instead
+            keys = [json.dumps(item, sort_keys=True) for item in value]
+        return dict(zip(keys, value))
+    if all(len(item) == 1 for item in value):
+        merged = {}
+        for item in value:
+            merged.update(item)
+        if len(merged) == len(value):
+            return merged
+    return None
+
+
+def diff_values(path, old, new, changes):
+    """Appends (change, path, old, new) tuples describing how `old` became `new`."""
+    if old == new:
+        return
+    old_map, new_map = _as_mapping(old), _as_mapping(new)
+    if old_map is None or new_map is None:
+        changes.append(("changed", path, old, new))
+        return
+    for key, value in old_map.items():
+        if key not in new_map:
+            changes.append(("removed", f"{path}/{key}", value, None))
+        else:
+            diff_values(f"{path}/{key}", value, new_map[key], changes)
+    for key, value in new_map.items():
+        if key not in old_map:
+            changes.append(("added", f"{path}/{key}", None, value))
+
+
+def diff_payloads(old, new, sections=None):
+    """Structured delta between two payloads, limited to `sections` when given."""
+    changes = []
+    for section in sections if sections is not None else list(dict.fromkeys([*old, *new])):
+        diff_values(section, old.get(section), new.get(section), changes)
+    return changes
+
+
+def _encode(value):
+    return None if value is None else json.dumps(value, separators=(",", ":"))
+
+
+def store_drift(conn, scan_id, previous_scan_id, system_name, changes, detected_at=None):
+    sections = sorted({path.split("/", 1)[0] for _, path, _, _ in changes})
+    conn.execute('''
+        INSERT OR REPLACE INTO scan_drift (scan_id, previous_scan_id, system_name, detected_at, change_count, sections)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (scan_id, previous_scan_id, system_name, detected_at if detected_at is not None else time.time(),
+          len(changes), ",".join(sections)))
+    conn.execute("DELETE FROM scan_changes WHERE scan_id = ?", (scan_id,))
+    conn.executemany(
+        "INSERT INTO scan_changes (scan_id, section, change, path, old_value, new_value) VALUES (?, ?, ?, ?, ?, ?)",
+        [(scan_id, path.split("/", 1)[0], change, path, _encode(old), _encode(new))
+         for change, path, old, new in changes],
+    )
+
+
+def record_drift(conn, scan_id, previous_scan_id, system_name, data, changed_sections):
+    """
+    Computes and stores the delta of a new payload against the host's previous scan.
+    Runs inside the writer's transaction at ingest; deduplicated sections whose hash did
+    not change are skipped without being loaded.
+    """
+    if previous_scan_id is None or not isinstance(data, dict):
+        return
+    row = conn.execute("SELECT json_data FROM scan_results WHERE id = ?", (previous_scan_id,)).fetchone()
+    if not row:
+        return
+    previous = load_payload(conn, row[0], sections=changed_sections)
+    if not isinstance(previous, dict):
+        return
+    skeleton_sections = [s for s in dict.fromkeys([*previous, *data]) if s not in DEDUP_SECTIONS]
+    changes = diff_payloads(previous, data, skeleton_sections + list(changed_sections))
+    store_drift(conn, scan_id, previous_scan_id, system_name, changes)
+
+
+def drift_since(conn, since=0, system_name=None, section=None, change=None, limit=200):
+    """
+    Scans with changes detected at or after `since` (epoch seconds), newest first, each with
+    its list of changes; optionally restricted to one host, section or change type.
+    """
+    clauses = ["change_count > 0", "detected_at >= ?"]
+    params = [since]
+    if system_name:
+        clauses.append("system_name = ?")
+        params.append(system_name)
+    if section:
+        clauses.append("(',' || sections || ',') LIKE ?")
+        params.append(f"%,{section},%")
+    rows = conn.execute(f'''
+        SELECT scan_id, previous_scan_id, system_name, detected_at FROM scan_drift
+        WHERE {" AND ".join(clauses)} ORDER BY detected_at DESC, scan_id DESC LIMIT ?
+    ''', params + [limit]).fetchall()
+
+    drift = []
+    for scan_id, previous_scan_id, host, detected_at in rows:
+        change_clauses = ["scan_id = ?"]
+        change_params = [scan_id]
+        if section:
+            change_clauses.append("section = ?")
+            change_params.append(section)
+        if change:
+            change_clauses.append("change = ?")
+            change_params.append(change)
+        changes = [{
+            "section": row[0], "change": row[1], "path": row[2],
+            "old": json.loads(row[3]) if row[3] is not None else None,
+            "new": json.loads(row[4]) if row[4] is not None else None,
+        } for row in conn.execute(f'''
+            SELECT section, change, path, old_value, new_value FROM scan_changes
+            WHERE {" AND ".join(change_clauses)} ORDER BY rowid
+        ''', change_params)]
+        if changes:
+            drift.append({"scan_id": scan_id, "previous_scan_id": previous_scan_id, "system_name": host,
+                          "detected_at": detected_at, "changes": changes})
+    return drift
+
+
+def backfill(conn):
+    """Computes drift for successful scans stored before the diff engine existed. Returns scans diffed."""
+    rows = conn.execute('''
+        SELECT scan_id, system_name, scanned_at FROM assets
+        WHERE scan_id NOT IN (SELECT scan_id FROM scan_drift) ORDER BY scan_id
+    ''').fetchall()
+    diffed = 0
+    for scan_id, system_name, scanned_at in rows:
+        previous = conn.execute('''
+            SELECT scan_id FROM assets WHERE system_name = ? AND scan_id < ? ORDER BY scan_id DESC LIMIT 1
+        ''', (system_name, scan_id)).fetchone()
+        if not previous:
+            continue
+        old_text, new_text = [conn.execute("SELECT json_data FROM scan_results WHERE id = ?", (sid,)).fetchone()[0]
+                              for sid in (previous[0], scan_id)]
+        try:
+            old, new = load_payload(conn, old_text), load_payload(conn, new_text)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        store_drift(conn, scan_id, previous[0], system_name, diff_payloads(old, new), scanned_at or 0)
+        diffed += 1
+    return diffed
+
+
+def backfill_all():
+    """Back-fills drift for every db/*.db project through its writer."""
+    from utils import asset_schema  # noqa: F401  (registers the assets table before the writers open)
+    from utils.db_pool import submit_write
+    for file_name in sorted(os.listdir(DB_DIR)):
+        if file_name.endswith(".db"):
+            count = submit_write(file_name[:-3], backfill).result()
+            print(f"{file_name}: diffed {count} scans")
+
+
+if __name__ == "__main__":
+    backfill_all()
@@ -1,22 +1,48 @@
 # scan_runner.py
-import socket
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 from utils.get_inputs import get_input_data
-from utils.wmiconnect import connect_and_execute as connect_wmi
-# from winrm import connect_and_execute as connect_winrm
+from utils.target_spec import TargetSpec
 from utils.logging_config import setup_logging
 from utils.store_data import create_db_and_store_results
+from utils.job_manager import update_target, set_job_total, count_done_targets, unfinished_targets, TargetUpdates
+from utils.asset_schema import recent_hosts
+from utils.db_pool import reader
+from utils.port_prober import DEFAULT_TIMEOUT, DEFAULT_RATE
+from utils.target_outcomes import record_target_outcome, load_plan
+from utils.scheduler import DISCOVERY_MAX
+from utils.scan_stages import scan_targets
 
 logger = setup_logging()
 
-def is_port_open(ip, port, timeout=1):
+def fresh_hosts(project_name, freshness):
+    """IPs of the project that reported successfully within the last `freshness` seconds."""
+    if not freshness:
+        return set()
     try:
-        with socket.create_connection((ip, port), timeout=timeout):
-            return True
-    except (socket.timeout, socket.error):
-        return False
-
-def run_scan(project_name, username, password, domain, ip_input, serverip):
+        with reader(project_name) as conn:
+            return recent_hosts(conn, time.time() - freshness)
+    except FileNotFoundError:
+        return set()
+
+def record_failure_row(project_name, ip, reason):
+    """Stores a failed host (one of FAILURE_REASONS) in the project DB."""
+    create_db_and_store_results(project_name, ip, '', "Failed", reason)
+
+def run_scan(project_name, username, password, domain, ip_input, serverip, job_id=None, freshness=0,
+             retry_failed=False, probe_concurrency=DISCOVERY_MAX, probe_timeout=DEFAULT_TIMEOUT,
+             probe_rate=DEFAULT_RATE):
+    """
+    Discovers and scans every target in ip_input.
+    Discovery is a single asyncio sweep over all targets; only hosts with a management
+    port open are handed to the (expensive) execution pool.
+    Both stages are paced by the shared adaptive limiters in utils.scheduler, and agent
+    launches wait for a free upload slot.
+    When job_id is given, per-IP progress is reported to the job table, and targets the job
+    already finished (before a restart) are skipped. Hosts that reported successfully within
+    `freshness` seconds are skipped as well, and so are targets still backing off after
+    failing the last scans (unless retry_failed); other targets with a failure streak are
+    scanned after the rest (see utils.target_outcomes).
+    """
     logger.info("Starting asset discovery")
 
     input_data = get_input_data(ip_input)
@@ -25,87 +51,30 @@ def run_scan(project_name, username, password, domain, ip_input, serverip):
         return {"status": "error", "message": input_data["error"]}
 
     ips = input_data['ips']
-    max_threads = 10
-
-    def scan(ip):
-        logger.info(f"Checking services on {ip}...")
-
-        # winrm_http_open = is_port_open(ip, 5985)
-        # winrm_https_open = is_port_open(ip, 5986)
-        wmi_open = is_port_open(ip, 135)
-        try:
-            # Prefer WinRM if available
-            if wmi_open:
-                logger.info(f"WMI port 135 open on {ip}. Attempting WMI connection.")
-                if connect_wmi(project_name, ip, username, password, domain, serverip):
-                    logger.info(f"WMI scan successful for {ip}")
-                else:
-                    logger.warning(f"WMI scan failed for {ip}")
-            else:
-                logger.warning(f"No known management ports open on {ip}. Skipping.")
-                # project_name = project_name
-                ip = ip
-                system_name = ''
-                status = "Failed"
-                data = "Port Closed"
-                create_db_and_store_results(project_name, ip, system_name, status, data)
-
-        except Exception as e:
-            logger.error(f"Error during scan for {ip}: {str(e)}")
-
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        futures = [executor.submit(scan, ip) for ip in ips]
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                logger.error(f"Thread execution error: {str(e)}")
+    if job_id:
+        set_job_total(job_id, len(ips))
+        done = count_done_targets(job_id)
+        if done:
+            logger.info(f"Resuming scan job {job_id}: {done} of {len(ips)} targets already done")
+            # Resolved before discovery starts: its event loop must not wait on the jobs DB
+            ips = TargetSpec.from_ips(unfinished_targets(job_id, ips))
+    fresh = fresh_hosts(project_name, freshness)
+    plan = load_plan(project_name, retry_failed)
+
+    # Targets are drawn by the discovery event loop: states set there are written in batches
+    with TargetUpdates(job_id) as updates:
+        def pending_targets():
+            for ip in ips:
+                if ip in fresh:
+                    updates.add(ip, "skipped", "Reported within the freshness window")
+                    continue
+                yield ip
+
+        targets = plan.order(pending_targets(), on_skip=lambda ip, reason: updates.add(ip, "skipped", reason))
+        scan_targets(project_name, targets, username, password, domain, serverip,
+                     lambda ip, state, detail: update_target(job_id, ip, state, detail),
+                     record_failure_row, record_target_outcome, on_probe=lambda ip: updates.add(ip, "probing"),
+                     probe_concurrency=probe_concurrency, probe_timeout=probe_timeout, probe_rate=probe_rate)
 
     return {"status": "success", "message": "Scan complete"}
 
-
-##########################
-
-#    Evil Winrm
-
-##########################
-
-    #     try:
-    #         # Prefer WinRM if available
-    #         if winrm_http_open or winrm_https_open:
-    #             logger.info(f"WinRM port {'5985' if winrm_http_open else '5986'} open on {ip}. Attempting WinRM connection.")
-    #             if connect_winrm(project_name, ip, username, password, domain, serverip):
-    #                 logger.info(f"WinRM scan successful for {ip}")
-    #                 return
-    #             else:
-    #                 logger.warning(f"WinRM scan failed for {ip}")
-    #                 # Try WMI if also open
-    #                 if wmi_open:
-    #                     logger.info(f"Falling back to WMI on {ip}")
-    #                     if connect_wmi(project_name, ip, username, password, domain, serverip):
-    #                         logger.info(f"WMI scan successful for {ip}")
-    #                     else:
-    #                         logger.warning(f"WMI scan also failed for {ip}")
-    #                 else:
-    #                     logger.warning(f"No fallback option available for {ip}")
-    #         elif wmi_open:
-    #             logger.info(f"WMI port 135 open on {ip}. Attempting WMI connection.")
-    #             if connect_wmi(project_name, ip, username, password, domain, serverip):
-    #                 logger.info(f"WMI scan successful for {ip}")
-    #             else:
-    #                 logger.warning(f"WMI scan failed for {ip}")
-    #         else:
-    #             logger.warning(f"No known management ports open on {ip}. Skipping.")
-
-    #     except Exception as e:
-    #         logger.error(f"Error during scan for {ip}: {str(e)}")
-
-    # with ThreadPoolExecutor(max_workers=max_threads) as executor:
-    #     futures = [executor.submit(scan, ip) for ip in ips]
-    #     for future in as_completed(futures):
-    #         try:
-    #             future.result()
-    #         except Exception as e:
-    #             logger.error(f"Thread execution error: {str(e)}")
-
-    # return {"status": "success", "message": "Scan complete"}
@@ -0,0 +1,100 @@
+# scan_stages.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import transports
+from utils.logging_config import setup_logging
+from utils.port_prober import discover_live_hosts, DEFAULT_TIMEOUT, DEFAULT_RATE
+from utils.scheduler import discovery_limiter, exec_limiter, upload_gate, DISCOVERY_MAX, EXEC_MAX
+
+logger = setup_logging()
+
+# Launch failure kinds (see wmiconnect.launch_agent) -> (failure row text, target outcome)
+LAUNCH_FAILURES = {
+    "auth": ("Error during login", "auth_failed"),
+    "timeout": ("Execution timed out", "exec_timeout"),
+    "unreachable": ("Host unreachable", "unreachable"),
+    "error": ("Execution failed", "exec_error"),
+}
+FAILURE_REASONS = ("Port Closed", *[reason for reason, _ in LAUNCH_FAILURES.values()])
+
+def scan_targets(project_name, targets, username, password, domain, serverip, report, record_failure,
+                 record_outcome, gate=upload_gate, cancelled=None, on_probe=None, probe_concurrency=DISCOVERY_MAX,
+                 probe_timeout=DEFAULT_TIMEOUT, probe_rate=DEFAULT_RATE):
+    """
+    Runs the probe and exec stages over targets (any iterable of IPs).
+    report(ip, state, detail) receives the per-target job states ("probing", "executing",
+    "launched", "failed"), record_failure(project_name, ip, reason) the hosts that get a
+    failure row and record_outcome(project_name, ip, outcome, detail) the failure kind of
+    each failed target (successes are recorded when the agent uploads). Agent launches wait
+    for a slot of `gate` (the local upload gate; collectors pass one backed by the
+    coordinator's, None disables the wait). Setting the `cancelled` event stops handing out
+    new targets. Nothing here touches the jobs or project databases: collectors run it too.
+    The "probing" state goes to on_probe(ip) instead of report() when given: it is called
+    on the discovery event loop, where nothing may block on SQLite.
+    """
+    def execute(ip, open_ports, reachable):
+        try:
+            candidates = transports.select_transports(ip, open_ports)
+            if candidates:
+                logger.info(f"Ports {sorted(open_ports)} open on {ip}. Trying {', '.join(t.name for t in candidates)}.")
+                if gate:
+                    gate.acquire(project_name, ip)
+                exec_limiter.acquire(ip)
+                report(ip, "executing", None)
+                started = time.monotonic()
+                transport, outcome = None, "error"
+                try:
+                    transport, outcome = transports.launch(project_name, ip, username, password, domain,
+                                                           serverip, candidates)
+                finally:
+                    exec_limiter.release(ip, time.monotonic() - started, outcome)
+                if outcome == "success":
+                    logger.info(f"Agent launched on {ip} via {transport}")
+                    report(ip, "launched", None)
+                    if gate:
+                        gate.launched(project_name, ip)
+                else:
+                    if gate:
+                        gate.release(project_name, ip)
+                    logger.warning(f"Agent launch failed on {ip} ({transport}: {outcome})")
+                    reason, target_outcome = LAUNCH_FAILURES.get(outcome, LAUNCH_FAILURES["error"])
+                    record_failure(project_name, ip, reason)
+                    record_outcome(project_name, ip, target_outcome, transport)
+                    report(ip, "failed", reason)
+            else:
+                if open_ports:
+                    logger.warning(f"No usable transport for the ports {sorted(open_ports)} open on {ip}. Skipping.")
+                else:
+                    logger.warning(f"No known management ports open on {ip}. Skipping.")
+                data = "Port Closed"
+                record_failure(project_name, ip, data)
+                if reachable is not None:
+                    record_outcome(project_name, ip, "port_closed" if reachable else "unreachable", None)
+                report(ip, "failed", data)
+
+        except Exception as e:
+            logger.error(f"Error during scan for {ip}: {str(e)}")
+            report(ip, "failed", str(e))
+
+    def log_thread_error(future):
+        if future.exception():
+            logger.error(f"Thread execution error: {str(future.exception())}")
+
+    def pending_targets():
+        for ip in targets:
+            if cancelled is not None and cancelled.is_set():
+                return
+            yield ip
+
+    # Threads only bound how many hosts can wait; exec_limiter decides how many actually run
+    with ThreadPoolExecutor(max_workers=EXEC_MAX) as executor:
+        def on_probed(ip, open_ports, reachable):
+            # Runs on the event loop, so hand everything that touches SQLite to the pool
+            executor.submit(execute, ip, open_ports, reachable).add_done_callback(log_thread_error)
+
+        discover_live_hosts(
+            pending_targets(), on_probed, ports=transports.transport_ports(),
+            concurrency=probe_concurrency, timeout=probe_timeout, rate=probe_rate,
+            on_start=on_probe or (lambda ip: report(ip, "probing", None)),
+            scheduler=discovery_limiter,
+        )
@@ -0,0 +1,188 @@
+# scan_worker.py
+#   CLUSTER_TOKEN=... python -m utils.scan_worker --coordinator http://10.0.0.5 --name collector-1
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from utils.logging_config import setup_logging
+from utils.port_prober import DEFAULT_TIMEOUT, DEFAULT_RATE
+from utils.scheduler import DISCOVERY_MAX
+from utils.scan_stages import scan_targets
+from utils.cluster_auth import unseal_password
+from utils import transports
+
+logger = setup_logging()
+
+POLL_INTERVAL = 5.0        # seconds between lease requests while there is no work
+GATE_RETRY = 1.0           # seconds between upload slot requests while the coordinator's gate is full
+REQUEST_TIMEOUT = 30
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class RemoteGate:
+    """
+    scan_targets() gate backed by the coordinator's upload gate. Only acquire() is a request;
+    the coordinator marks slots launched or frees them when the outcomes are reported.
+    """
+
+    def __init__(self, collector, shard_id, cancelled):
+        self.collector = collector
+        self.shard_id = shard_id
+        self.cancelled = cancelled
+
+    def acquire(self, project_name, ip):
+        while not self.cancelled.is_set():
+            try:
+                status, body = self.collector._post("/cluster/gate", {"shard_id": self.shard_id, "ip": ip})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Upload slot request for {ip} failed: {e}")
+                status, body = None, None
+            if status == 409:
+                raise LeaseLost()
+            if status == 200 and (body or {}).get("granted"):
+                return
+            time.sleep(GATE_RETRY)
+        raise LeaseLost()
+
+    def launched(self, project_name, ip):
+        pass
+
+    def release(self, project_name, ip):
+        pass
+
+
+class Collector:
+    def __init__(self, coordinator, name, token, probe_options=None):
+        self.coordinator = coordinator.rstrip("/")
+        self.name = name
+        self.token = token
+        self.probe_options = probe_options or {}
+
+    def _post(self, path, body):
+        """POSTs JSON to the coordinator; returns (status, decoded body or None)."""
+        request = urllib.request.Request(
+            f"{self.coordinator}{path}", data=json.dumps(dict(body, worker=self.name)).encode(),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.token}"})
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                data = response.read()
+                return response.status, json.loads(data) if data else None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def run_shard(self, shard):
+        """Scans one leased shard, flushing outcomes with every heartbeat until it is done."""
+        shard_id = shard["shard_id"]
+        interval = shard.get("heartbeat_interval") or 15
+        lock = threading.Lock()
+        outcomes, failures, results = [], [], []
+        cancelled = threading.Event()
+
+        def report(ip, state, detail):
+            with lock:
+                outcomes.append([ip, state, detail])
+
+        def record_failure(project_name, ip, reason):
+            with lock:
+                failures.append([ip, reason])
+
+        def record_outcome(project_name, ip, outcome, detail):
+            with lock:
+                results.append([ip, outcome, detail])
+
+        def flush(done=False):
+            with lock:
+                batch = (outcomes[:], failures[:], results[:])
+            status, _ = self._post("/cluster/report", {"shard_id": shard_id, "outcomes": batch[0],
+                                                       "failures": batch[1], "results": batch[2], "done": done})
+            if status == 409:
+                raise LeaseLost()
+            if status != 200:
+                raise OSError(f"report rejected with HTTP {status}")
+            with lock:
+                del outcomes[:len(batch[0])]
+                del failures[:len(batch[1])]
+                del results[:len(batch[2])]
+
+        password = unseal_password(shard["password"], self.token)
+        if password is None:
+            raise SystemExit("Could not decrypt the scan credentials; check CLUSTER_TOKEN and the cryptography package")
+        scan = threading.Thread(target=scan_targets, name=f"shard-{shard_id}", kwargs=dict(
+            project_name=shard["project_name"], targets=shard["targets"], username=shard["username"],
+            password=password, domain=shard["domain"], serverip=shard["serverip"], report=report,
+            record_failure=record_failure, record_outcome=record_outcome,
+            gate=RemoteGate(self, shard_id, cancelled), cancelled=cancelled, **self.probe_options))
+        scan.start()
+        logger.info(f"Scanning shard {shard_id}: {len(shard['targets'])} targets")
+        try:
+            while scan.is_alive():
+                scan.join(interval)
+                try:
+                    status, body = self._post("/cluster/heartbeat", {"shards": [shard_id]})
+                    if status == 200 and shard_id in (body or {}).get("lost", []):
+                        raise LeaseLost()
+                    flush()
+                except (OSError, ValueError) as e:
+                    # The coordinator is unreachable: keep scanning and retry with the next heartbeat
+                    logger.warning(f"Coordinator unreachable during shard {shard_id}: {e}")
+            while True:
+                try:
+                    flush(done=True)
+                    break
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not report shard {shard_id}, retrying: {e}")
+                    time.sleep(interval)
+            logger.info(f"Shard {shard_id} done")
+        except LeaseLost:
+            # Another collector owns the shard now; stop taking targets and drop our results
+            logger.warning(f"Lease of shard {shard_id} lost; abandoning it")
+            cancelled.set()
+            scan.join()
+
+    def run(self, once=False):
+        logger.info(f"Collector {self.name} polling {self.coordinator}")
+        while True:
+            try:
+                status, shard = self._post("/cluster/lease", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Lease request failed: {e}")
+                status, shard = None, None
+            if status in (401, 403):
+                raise SystemExit(f"Coordinator refused the collector (HTTP {status}); check CLUSTER_TOKEN")
+            if status == 200 and shard:
+                self.run_shard(shard)
+                continue
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collector process for distributed scans.")
+    parser.add_argument("--coordinator", required=True, help="Base URL of the coordinator, e.g. http://10.0.0.5")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}", help="Unique collector name")
+    parser.add_argument("--token", default=os.environ.get("CLUSTER_TOKEN"), help="Defaults to $CLUSTER_TOKEN")
+    parser.add_argument("--once", action="store_true", help="Exit when the coordinator has no work")
+    parser.add_argument("--probe-concurrency", type=int, default=DISCOVERY_MAX)
+    parser.add_argument("--probe-timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--probe-rate", type=float, default=DEFAULT_RATE)
+    options = parser.parse_args()
+    if not options.token:
+        parser.error("--token or CLUSTER_TOKEN is required")
+    # What works per host is learned again by each collector instead of being kept in a jobs DB
+    transports.capabilities.persistent = False
+    Collector(options.coordinator, options.name, options.token, {
+        "probe_concurrency": options.probe_concurrency, "probe_timeout": options.probe_timeout,
+        "probe_rate": options.probe_rate,
+    }).run(options.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# scheduler.py
+import asyncio
+import ipaddress
+import threading
+import time
+from utils.logging_config import setup_logging
+from utils.metrics import AGENT_RUNTIME_SECONDS, Gauge
+
+logger = setup_logging()
+
+SUBNET_PREFIX = 24             # hosts sharing this IPv4 prefix count against one subnet limit
+
+# Discovery: cheap non-blocking connects
+DISCOVERY_MIN = 32
+DISCOVERY_START = 256
+DISCOVERY_MAX = 1024
+DISCOVERY_PER_SUBNET = 128
+
+# Execution: remote agent launches over WMI, heavy on the collector and the target
+EXEC_MIN = 2
+EXEC_START = 10
+EXEC_MAX = 64
+EXEC_PER_SUBNET = 8
+
+# Agents launched but not yet uploaded; a slot is freed by the upload or after the timeout
+UPLOAD_MAX_OUTSTANDING = 100
+UPLOAD_TIMEOUT = 900
+
+LATENCY_TOLERANCE = 2.0        # samples slower than this multiple of the baseline count as congestion
+DECREASE_FACTOR = 0.5          # multiplicative decrease on timeouts and errors
+SLOW_DECREASE_FACTOR = 0.9     # gentler decrease when latency alone degrades
+
+
+def subnet_of(ip):
+    try:
+        return str(ipaddress.ip_network(f"{ip}/{SUBNET_PREFIX}", strict=False))
+    except ValueError:
+        return str(ip)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit shared by every scan running in this process.
+    Successful calls grow the limit by roughly one slot per limit-sized window; timeouts and
+    errors halve it, at most once per cool-down so a burst of failures counts as one signal.
+    Each subnet additionally has a fixed in-flight cap.
+    """
+
+    def __init__(self, name, minimum, start, maximum, per_subnet):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.per_subnet = per_subnet
+        self.limit = float(start)
+        self.in_flight = 0
+        self.by_subnet = {}
+        self.baseline = None
+        self.latency = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def _available(self, subnet):
+        return self.in_flight < int(self.limit) and self.by_subnet.get(subnet, 0) < self.per_subnet
+
+    def _take(self, subnet):
+        self.in_flight += 1
+        self.by_subnet[subnet] = self.by_subnet.get(subnet, 0) + 1
+
+    def try_acquire(self, ip):
+        subnet = subnet_of(ip)
+        with self.condition:
+            if not self._available(subnet):
+                return False
+            self._take(subnet)
+            return True
+
+    def acquire(self, ip):
+        """Blocks the calling thread until ip may start."""
+        subnet = subnet_of(ip)
+        with self.condition:
+            self.condition.wait_for(lambda: self._available(subnet))
+            self._take(subnet)
+
+    async def acquire_async(self, ip):
+        """Event-loop friendly acquire(); the limiter is shared with other threads, so it polls."""
+        delay = 0.001
+        while not self.try_acquire(ip):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def release(self, ip, latency=None, outcome="success"):
+        """
+        Frees the slot and feeds the result back: outcome 'success' may grow the limit,
+        'timeout' and 'error' shrink it, anything else ('auth', 'unreachable', None) is neutral.
+        """
+        subnet = subnet_of(ip)
+        with self.condition:
+            self.in_flight -= 1
+            self.by_subnet[subnet] -= 1
+            if not self.by_subnet[subnet]:
+                del self.by_subnet[subnet]
+            self._adjust(latency, outcome)
+            self.condition.notify_all()
+
+    def _adjust(self, latency, outcome):
+        now = time.monotonic()
+        if outcome in ("timeout", "error"):
+            self._decrease(now, DECREASE_FACTOR)
+            return
+        if outcome != "success":
+            return
+
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            # The baseline follows the best smoothed latency and drifts up slowly to forget old lows
+            if self.baseline is None or self.latency < self.baseline:
+                self.baseline = self.latency
+            else:
+                self.baseline *= 1.001
+            if self.latency > self.baseline * LATENCY_TOLERANCE:
+                self._decrease(now, SLOW_DECREASE_FACTOR)
+                return
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def _decrease(self, now, factor):
+        # One decrease per observed round trip at most
+        cool_down = max(self.latency or 0.0, 0.5)
+        if now - self.last_decrease < cool_down:
+            return
+        self.last_decrease = now
+        previous = self.limit
+        self.limit = max(self.minimum, self.limit * factor)
+        if int(previous) != int(self.limit):
+            logger.info(f"{self.name} concurrency lowered to {int(self.limit)}")
+
+    def stats(self):
+        with self.condition:
+            return {
+                "limit": int(self.limit), "in_flight": self.in_flight, "subnets_busy": len(self.by_subnet),
+                "latency": round(self.latency, 3) if self.latency is not None else None,
+                "baseline": round(self.baseline, 3) if self.baseline is not None else None,
+            }
+
+
+class UploadGate:
+    """Caps agents that were launched but have not uploaded yet, so /upload sees bounded bursts."""
+
+    def __init__(self, maximum, timeout):
+        self.maximum = maximum
+        self.timeout = timeout
+        self.outstanding = {}
+        self.launched_at = {}
+        self.condition = threading.Condition()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, deadline in self.outstanding.items() if deadline <= now]:
+            del self.outstanding[key]
+            self.launched_at.pop(key, None)
+
+    def acquire(self, project_name, ip):
+        key = (project_name, ip)
+        with self.condition:
+            while True:
+                self._expire()
+                if len(self.outstanding) < self.maximum or key in self.outstanding:
+                    break
+                # Wake up when the earliest slot would expire even if no upload arrives
+                self.condition.wait(max(min(self.outstanding.values()) - time.monotonic(), 0.1))
+            self.outstanding[key] = time.monotonic() + self.timeout
+
+    def try_acquire(self, project_name, ip):
+        """acquire() without waiting; returns whether the slot was taken."""
+        key = (project_name, ip)
+        with self.condition:
+            self._expire()
+            if len(self.outstanding) >= self.maximum and key not in self.outstanding:
+                return False
+            self.outstanding[key] = time.monotonic() + self.timeout
+            return True
+
+    def launched(self, project_name, ip):
+        """Notes that the agent started, so its runtime can be measured when the upload arrives."""
+        with self.condition:
+            if (project_name, ip) in self.outstanding:
+                self.launched_at[(project_name, ip)] = time.time()
+
+    def release(self, project_name, ip, uploaded_at=None):
+        """Frees the host's slot; uploaded_at (epoch seconds) records the agent runtime."""
+        with self.condition:
+            launched_at = self.launched_at.pop((project_name, ip), None)
+            if self.outstanding.pop((project_name, ip), None) is not None:
+                self.condition.notify_all()
+        if launched_at and uploaded_at:
+            AGENT_RUNTIME_SECONDS.observe(max(uploaded_at - launched_at, 0))
+
+    def stats(self):
+        with self.condition:
+            self._expire()
+            return {"limit": self.maximum, "outstanding": len(self.outstanding)}
+
+
+discovery_limiter = AdaptiveLimiter("Discovery", DISCOVERY_MIN, DISCOVERY_START, DISCOVERY_MAX, DISCOVERY_PER_SUBNET)
+exec_limiter = AdaptiveLimiter("Execution", EXEC_MIN, EXEC_START, EXEC_MAX, EXEC_PER_SUBNET)
+upload_gate = UploadGate(UPLOAD_MAX_OUTSTANDING, UPLOAD_TIMEOUT)
+
+
+def _limiter_gauge(field):
+    return lambda: {(limiter.name.lower(),): limiter.stats()[field] for limiter in (discovery_limiter, exec_limiter)}
+
+
+Gauge("scheduler_concurrency_limit", "Current adaptive concurrency limit.", ("stage",), _limiter_gauge("limit"))
+Gauge("scheduler_in_flight", "Hosts currently being worked on.", ("stage",), _limiter_gauge("in_flight"))
+Gauge("scheduler_outstanding_agents", "Agents launched and not yet uploaded.",
+      callback=lambda: {(): upload_gate.stats()["outstanding"]})
+
+
+def scheduler_stats():
+    return {"discovery": discovery_limiter.stats(), "execution": exec_limiter.stats(), "uploads": upload_gate.stats()}
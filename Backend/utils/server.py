@@ -1,51 +1,67 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, send_file, jsonify, Response, stream_with_context, g
 import os
 import json
+import time
+import hashlib
 import logging
-from datetime import datetime
-from utils.scan_runner import run_scan
-from utils.store_data import create_db_and_store_results
+from utils import job_manager, ingest_spool, fleet_catalog, vuln_match, coordinator, transports, target_outcomes
+from utils import cluster_auth
+from utils.get_inputs import get_input_data
+from utils.db_pool import reader
+from utils.asset_schema import find_hosts, list_devices, data_revision
+from utils.scan_diff import drift_since
+from utils.project_summary import read_summary
+from utils.scheduler import scheduler_stats
+from utils.pagination import encode_cursor, decode_cursor, page_size
+from utils.metrics import render_all, HTTP_REQUEST_SECONDS, UPLOAD_PARSE_SECONDS, UPLOADS_TOTAL
+from utils.logging_config import setup_logging
+from utils.compression import enable_compression, CachedFile
+from utils.pdf_report import get_asset_pdf, write_project_zip
+from utils.payload_store import load_payload, payload_loader, start_maintenance
 from flask_cors import CORS
-import sqlite3
-from flask import jsonify
-from collections import OrderedDict
-from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from io import BytesIO
-import json
-from fpdf import FPDF
 import tempfile
-import textwrap
-from flask import Flask, send_file, jsonify
-import sqlite3
-import csv
-import io
-import os
-from utils.store_data import extract_json_to_csv
+from utils.store_data import CSV_COLUMNS, iter_csv
 
 
 app = Flask(__name__)
 CORS(app)
+# Compressed bodies are capped again after decompression by ingest_spool
+app.config["MAX_CONTENT_LENGTH"] = ingest_spool.MAX_PAYLOAD_BYTES
 
 # Create logs and reports directories if not exist
 os.makedirs("logs", exist_ok=True)
 os.makedirs("reports", exist_ok=True)
+start_maintenance()
+ingest_spool.start_worker()
+fleet_catalog.start_sync()
+vuln_match.start_matching()
+job_manager.recover_jobs()
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DB_DIR = os.path.join(BASE_DIR, "db")
 
-# Setup logging to a file
-log_file = "logs/server_requests.log"
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s: %(message)s",
-)
+# Queue-based logging shared with the scan modules (JSON lines in logs/application.log)
+setup_logging()
 
 @app.before_request
-def log_request_info():
-    logging.info(f"Request from {request.remote_addr} {request.method} {request.path}")
-    logging.info(f"Headers: {dict(request.headers)}")
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # Route templates, not raw paths, keep the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+        logging.info(f"{request.remote_addr} {request.method} {request.path} {response.status_code} {elapsed * 1000:.1f}ms")
+    return response
+
+# JSON, CSV and text responses are gzip/brotli compressed for clients that accept it
+enable_compression(app)
+
+# Every scanned host fetches the agent, so it is served from memory with an ETag
+AGENT_SCRIPT = CachedFile(os.path.join(BASE_DIR, "scripts", "Agent.ps1"), download_name="Asset_discovery.ps1")
 
 @app.route('/')
 def index():
@@ -53,49 +69,62 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def collect():
+    """
+    Accepts an agent payload (optionally gzip/deflate/zstd compressed) into the ingest spool.
+    Parsing, the report file and the DB insert happen in the ingest worker, not in the request.
+    """
+    raw = request.get_data(cache=False)
     try:
-        data = request.get_json()
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        system_name = data['AssetProjectDetails']['MachineName']
-        client_ip = data['AssetProjectDetails']['ClientIp']
-        project_name = data['AssetProjectDetails']['ProjectName']
+        with UPLOAD_PARSE_SECONDS.time():
+            body = ingest_spool.decode_body(raw, request.headers.get("Content-Encoding"))
+            _, _, client_ip, system_name = ingest_spool.parse_payload(body)
+    except ingest_spool.PayloadError as e:
+        UPLOADS_TOTAL.inc(result="rejected")
+        logging.warning(f"Rejected upload from {request.remote_addr}: {str(e)}")
+        status_code = 413 if isinstance(e, ingest_spool.PayloadTooLarge) else 400
+        return {"status": "error", "message": str(e)}, status_code
+    except (ValueError, RecursionError) as e:
+        UPLOADS_TOTAL.inc(result="rejected")
+        logging.warning(f"Rejected upload from {request.remote_addr}: invalid JSON ({str(e)})")
+        return {"status": "error", "message": "Invalid JSON payload"}, 400
 
-        # File name and path
-        base_name = f"{client_ip}_{system_name}_{timestamp}.json"
-        json_path = os.path.join("reports", base_name)
+    try:
+        ingest_spool.enqueue(body)
+        UPLOADS_TOTAL.inc(result="accepted")
+        logging.info(f"Data received from {client_ip} ({system_name}), spooled for ingest")
+        return {"status": "accepted"}, 202
 
-        # Save JSON payload
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+    except Exception as e:
+        UPLOADS_TOTAL.inc(result="error")
+        logging.error(f"Error processing upload from {request.remote_addr}: {str(e)}")
+        return {"status": "error", "message": str(e)}, 500
 
-        logging.info(f"Data received from {client_ip}, saved as {base_name}")
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(render_all(), mimetype="text/plain; version=0.0.4")
 
-        status = "Success"
-        create_db_and_store_results(project_name, client_ip, system_name, status, data)
+@app.route('/metrics/ingest', methods=['GET'])
+def ingest_metrics():
+    return jsonify(ingest_spool.spool_stats()), 200
 
-        return {"status": "received"}, 200
+@app.route('/metrics/scheduler', methods=['GET'])
+def scheduler_metrics():
+    return jsonify(scheduler_stats()), 200
 
-    except Exception as e:
-        logging.error(f"Error processing upload from {request.remote_addr}: {str(e)}")
-        return {"status": "error", "message": str(e)}, 500
+@app.route('/metrics/transports', methods=['GET'])
+def transport_metrics():
+    """Hosts and subnets with a known working transport, per transport."""
+    return jsonify(transports.capabilities.stats()), 200
 
 @app.route('/download')
 def download_script():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(base_dir, '..', 'scripts', 'Agent.ps1')
-    script_path = os.path.abspath(script_path)
-
-    if os.path.exists(script_path):
-        logging.info(f"Script downloaded by {request.remote_addr}")
-        return send_file(
-            script_path,
-            mimetype="application/octet-stream",
-            as_attachment=True,
-            download_name="Asset_discovery.ps1"
-        )
-    else:
-        logging.warning(f"Download attempted by {request.remote_addr} but script not found at {script_path}.")
+    try:
+        response = AGENT_SCRIPT.response()
+    except FileNotFoundError:
+        logging.warning(f"Download attempted by {request.remote_addr} but script not found at {AGENT_SCRIPT.path}.")
         return "Script not found", 404
+    logging.info(f"Script downloaded by {request.remote_addr}")
+    return response
 
 @app.route('/start_scan', methods=['POST'])
 def start_scan():
@@ -110,13 +139,173 @@ def start_scan():
         if not all([project_name, username, password, ip_input, serverip]):
             return jsonify({"message": "Missing required fields."}), 400
 
-        result = run_scan(project_name, username, password, domain, ip_input, serverip)
-        return jsonify({"message": result.get("message", "Scan started.")}), 200
+        input_data = get_input_data(ip_input)
+        if "error" in input_data:
+            return jsonify({"message": input_data["error"]}), 400
+
+        try:
+            freshness = float(request.form.get("freshness_hours", job_manager.DEFAULT_FRESHNESS / 3600)) * 3600
+        except ValueError:
+            return jsonify({"message": "freshness_hours must be a number."}), 400
+
+        distributed = request.form.get("distributed", "").lower() in ("1", "true", "yes", "on")
+        if distributed and not cluster_auth.cluster_token():
+            return jsonify({"message": "Distributed scans need CLUSTER_TOKEN to be set on the server."}), 400
+
+        retry_failed = request.form.get("retry_failed", "").lower() in ("1", "true", "yes", "on")
+
+        job_id = job_manager.submit_scan(project_name, username, password, domain, ip_input, serverip, freshness,
+                                         distributed, retry_failed)
+        return jsonify({"message": "Scan started.", "job_id": job_id, "hosts": input_data["count"]}), 202
 
     except Exception as e:
         logging.error(f"Scan start error: {str(e)}")
         return jsonify({"message": "Failed to start scan."}), 500
+
+@app.route('/targets/estimate', methods=['GET', 'POST'])
+def estimate_targets():
+    ip_input = request.values.get("ip_input", "")
+    input_data = get_input_data(ip_input)
+    if "error" in input_data:
+        return jsonify({"error": input_data["error"]}), 400
+    return jsonify({"hosts": input_data["count"], "targets": input_data["ips"].to_string()}), 200
+
+@app.route('/scans', methods=['GET'])
+def list_scans():
+    try:
+        limit = min(int(request.args.get("limit", 50)), 500)
+        jobs = job_manager.list_jobs(request.args.get("project"), limit)
+        return jsonify({"jobs": jobs}), 200
+    except Exception as e:
+        logging.error(f"Error listing scan jobs: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/scans/<job_id>', methods=['GET'])
+def get_scan(job_id):
+    job = job_manager.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Scan job not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/scans/<job_id>/resume', methods=['POST'])
+def resume_scan(job_id):
+    """Restarts an interrupted job where it stopped; form fields username/password/domain override the stored ones."""
+    job = job_manager.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Scan job not found"}), 404
+    if job["status"] != "interrupted":
+        return jsonify({"error": f"Scan job is {job['status']}, not interrupted"}), 409
+    if not job_manager.resume_job(job_id, request.form.get("username"), request.form.get("password"),
+                                  request.form.get("domain")):
+        return jsonify({"error": "Credentials are required to resume this scan"}), 400
+    return jsonify({"message": "Scan resumed.", "job_id": job_id}), 202
+
+@app.route('/scans/<job_id>/targets', methods=['GET'])
+def get_scan_targets(job_id):
+    state = request.args.get("state")
+    if state and state not in job_manager.TARGET_STATES:
+        return jsonify({"error": f"Unknown state: {state}"}), 400
+    try:
+        limit = min(int(request.args.get("limit", 100)), 1000)
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    targets = job_manager.list_targets(job_id, state, limit, offset)
+    return jsonify({"job_id": job_id, "targets": targets}), 200
+
+@app.route('/scans/<job_id>/events', methods=['GET'])
+def stream_scan_progress(job_id):
+    """Server-sent events stream of the job snapshot until the job finishes."""
+    if not job_manager.get_job(job_id):
+        return jsonify({"error": "Scan job not found"}), 404
+
+    def generate():
+        while True:
+            job = job_manager.get_job(job_id)
+            yield f"data: {json.dumps(job)}\n\n"
+            if job["status"] in job_manager.FINAL_JOB_STATES:
+                break
+            time.sleep(1)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
+def cluster_auth_error():
+    """Error response unless the request carries the CLUSTER_TOKEN bearer token."""
+    if not cluster_auth.authorized(request.headers.get("Authorization")):
+        return jsonify({"error": "Unauthorized"}), 401 if cluster_auth.cluster_token() else 403
+    return None
+
+def cluster_request():
+    """JSON body of an authenticated collector request, or an error response."""
+    error = cluster_auth_error()
+    if error:
+        return None, error
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("worker"), str) or not body["worker"]:
+        return None, (jsonify({"error": "A JSON body with the worker name is required"}), 400)
+    return body, None
+
+@app.route('/cluster/lease', methods=['POST'])
+def cluster_lease():
+    """A collector asks for work: the next shard with credentials, or 204 when there is none."""
+    body, error = cluster_request()
+    if error:
+        return error
+    shard = coordinator.lease_shard(body["worker"], request.remote_addr)
+    if shard is None:
+        return "", 204
+    response = jsonify(shard)
+    response.headers["Cache-Control"] = "no-store"
+    return response, 200
+
+@app.route('/cluster/heartbeat', methods=['POST'])
+def cluster_heartbeat():
+    body, error = cluster_request()
+    if error:
+        return error
+    try:
+        lost = coordinator.heartbeat(body["worker"], body.get("shards") or [], request.remote_addr)
+    except (TypeError, ValueError):
+        return jsonify({"error": "shards must be a list of shard IDs"}), 400
+    return jsonify({"lost": lost}), 200
+
+@app.route('/cluster/report', methods=['POST'])
+def cluster_report():
+    """Per-target outcomes of a leased shard; 409 tells the collector it lost the lease."""
+    body, error = cluster_request()
+    if error:
+        return error
+    try:
+        accepted = coordinator.report(body["worker"], int(body["shard_id"]), body.get("outcomes") or [],
+                                      body.get("failures") or [], bool(body.get("done")), body.get("results") or [])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Malformed report"}), 400
+    if not accepted:
+        return jsonify({"error": "Lease lost"}), 409
+    return jsonify({"ok": True}), 200
+
+@app.route('/cluster/gate', methods=['POST'])
+def cluster_gate():
+    """A collector asks for an upload slot before launching an agent; 409 when it lost the lease."""
+    body, error = cluster_request()
+    if error:
+        return error
+    try:
+        granted = coordinator.acquire_gate(body["worker"], int(body["shard_id"]), str(body["ip"]))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "shard_id and ip are required"}), 400
+    if granted is None:
+        return jsonify({"error": "Lease lost"}), 409
+    return jsonify({"granted": granted}), 200
+
+@app.route('/cluster/status', methods=['GET'])
+def cluster_status():
+    error = cluster_auth_error()
+    if error:
+        return error
+    return jsonify(coordinator.cluster_status()), 200
+
 @app.route('/projects', methods=['GET'])
 def list_projects():
     try:
@@ -129,62 +318,230 @@ def list_projects():
     
 @app.route('/project/<project_name>', methods=['GET'])
 def get_project_devices(project_name):
+    """
+    Devices of a project, one page at a time: ?limit=&cursor= (next_cursor of the previous page),
+    ?status=Success|Failed, and ?latest=0 to list every scan row instead of each host's newest one.
+    """
     try:
         db_path = os.path.join(DB_DIR, f"{project_name}.db")
-        print(f"Looking for DB in: {db_path}")
-        
+
         if not os.path.exists(db_path):
             logging.error(f"Database not found at: {db_path}")
             return jsonify({"error": "Project database not found"}), 404
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Use correct table and column names
-        cursor.execute("SELECT system_name, client_ip FROM scan_results")
-        rows = cursor.fetchall()
-        conn.close()
-
-        devices = [{"name": row[0], "ip_address": row[1]} for row in rows]
-        return jsonify({"devices": devices}), 200
+        latest = request.args.get("latest", "1").lower() not in ("0", "false", "no")
+        status = request.args.get("status")
+        try:
+            limit = page_size(request.args.get("limit"))
+            cursor = request.args.get("cursor")
+            after = decode_cursor(cursor, 1)[0] if cursor else None
+            if after is not None:
+                after = str(after) if latest else int(after)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with reader(project_name) as conn:
+            etag = hashlib.sha1(f"{data_revision(conn)}:{request.query_string.decode()}".encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+            rows = list_devices(conn, latest, status, limit, after)
+
+        devices = [{"name": row["system_name"], "ip_address": row["client_ip"], "status": row["status"],
+                    "scan_id": row["scan_id"]} for row in rows]
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor([rows[-1]["host"] if latest else rows[-1]["scan_id"]])
+        response = jsonify({"devices": devices, "next_cursor": next_cursor})
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response, 200
 
     except Exception as e:
         logging.error(f"Error querying project DB '{project_name}': {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/project/<project_name>/summary', methods=['GET'])
+def get_project_summary(project_name):
+    """
+    Fleet overview of a project from the summary tables the ingest path keeps up to date:
+    hosts by status, failure reason, OS, license, AV signature/real-time state and firewall
+    profile, plus RAM and disk totals. Each host counts once, by its latest scan.
+    """
+    try:
+        with reader(project_name) as conn:
+            summary = read_summary(conn)
+    except FileNotFoundError:
+        return jsonify({"error": "Project database not found"}), 404
+    except Exception as e:
+        logging.error(f"Error reading summary of '{project_name}': {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    etag = hashlib.sha1(f"{project_name}:{summary['updated_at']}:{summary['hosts']}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    response = jsonify(summary)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response, 200
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 @app.route('/api/project/<project_name>/asset/<asset_name>', methods=['GET'])
 def get_asset_json(project_name, asset_name):
+    """
+    Latest stored payload of an asset. ?fields=AssetDetails,Security returns only those sections
+    (the others are never loaded); If-None-Match with the returned ETag answers 304.
+    """
     db_path = os.path.join(DB_DIR, f"{project_name}.db")
 
     if not os.path.exists(db_path):
         return jsonify({'error': f'Database for project "{project_name}" not found'}), 404
 
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()] or None
+
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        with reader(project_name) as conn:
+            row = conn.execute("SELECT id FROM scan_results WHERE system_name = ? ORDER BY id DESC LIMIT 1",
+                               (asset_name,)).fetchone()
 
-        cursor.execute("SELECT json_data FROM scan_results WHERE system_name = ?", (asset_name,))
-        row = cursor.fetchone()
-        conn.close()
+            if not row:
+                return jsonify({'error': f'Asset "{asset_name}" not found in project "{project_name}"'}), 404
 
-        if not row:
-            return jsonify({'error': f'Asset "{asset_name}" not found in project "{project_name}"'}), 404
+            # Compaction can rewrite a stored scan in place, so the project revision is part of the key
+            projection = hashlib.sha1(','.join(fields or []).encode()).hexdigest()[:12]
+            etag = f"{row[0]}-{data_revision(conn)}-{projection}"
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
 
-        # Use OrderedDict to preserve key order
-        asset_json = json.loads(row[0], object_pairs_hook=OrderedDict)
+            json_data = conn.execute("SELECT json_data FROM scan_results WHERE id = ?", (row[0],)).fetchone()[0]
+            # Dicts keep the agent's key order; refs to deduplicated sections are resolved here
+            asset_json = load_payload(conn, json_data, fields)
 
-        # Use Flask's Response with custom JSON encoder that respects OrderedDict order
-        from flask import Response
-        import json as pyjson
+        if fields and isinstance(asset_json, dict):
+            asset_json = {key: value for key, value in asset_json.items() if key in fields}
 
-        return Response(
-            pyjson.dumps(asset_json, indent=2),
-            mimetype='application/json'
-        )
+        response = Response(json.dumps(asset_json, separators=(",", ":")), mimetype='application/json')
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
+
+
+@app.route('/api/project/<project_name>/hosts', methods=['GET'])
+def query_project_hosts(project_name):
+    """Looks hosts up through the normalized asset tables, e.g. ?software=7-zip or ?av_status=Outdated."""
+    filters = {key: request.args.get(key) for key in
+               ("software", "version", "hotfix", "missing_hotfix", "av_status", "os_name", "user")}
+    try:
+        limit = min(int(request.args.get("limit", 500)), 5000)
+        with reader(project_name) as conn:
+            hosts = find_hosts(conn, limit=limit, **filters)
+        return jsonify({"hosts": hosts}), 200
+    except FileNotFoundError:
+        return jsonify({'error': f'Database for project "{project_name}" not found'}), 404
+    except Exception as e:
+        logging.error(f"Error querying hosts in project '{project_name}': {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/project/<project_name>/vulnerabilities', methods=['GET'])
+def project_vulnerabilities(project_name):
+    """
+    Known CVEs of the installed software on each host's latest scan, matched against the local
+    feed: ?host=, ?cve=, ?severity=, with ?limit= and ?cursor= (next_cursor of the previous page).
+    """
+    try:
+        limit = page_size(request.args.get("limit"), default=200, maximum=vuln_match.MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor, 4) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with reader(project_name) as conn:
+            hits = vuln_match.list_vulnerabilities(conn, request.args.get("host"), request.args.get("cve"),
+                                                   request.args.get("severity"), limit, after)
+    except FileNotFoundError:
+        return jsonify({'error': f'Database for project "{project_name}" not found'}), 404
+    next_cursor = None
+    if len(hits) == limit:
+        last = hits[-1]
+        next_cursor = encode_cursor([last["scan_id"], last["cve_id"], last["software"], last["version"]])
+    return jsonify({"vulnerabilities": hits, "next_cursor": next_cursor}), 200
+
+
+@app.route('/api/project/<project_name>/targets', methods=['GET'])
+def project_target_outcomes(project_name):
+    """
+    Last scan outcome of each target with its failure streak and backoff: ?outcome=
+    (success, unreachable, port_closed, auth_failed, exec_timeout, exec_error), ?limit=, ?cursor=.
+    """
+    outcome = request.args.get("outcome")
+    if outcome and outcome not in target_outcomes.OUTCOMES:
+        return jsonify({"error": f"outcome must be one of {', '.join(target_outcomes.OUTCOMES)}"}), 400
+    try:
+        limit = page_size(request.args.get("limit"), default=200, maximum=1000)
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor, 1)[0] if cursor else ""
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with reader(project_name) as conn:
+            targets = target_outcomes.get_outcomes(conn, outcome, limit, after)
+    except FileNotFoundError:
+        return jsonify({'error': f'Database for project "{project_name}" not found'}), 404
+    next_cursor = encode_cursor([targets[-1]["ip"]]) if len(targets) == limit else None
+    return jsonify({"targets": targets, "next_cursor": next_cursor}), 200
+
+
+@app.route('/api/project/<project_name>/drift', methods=['GET'])
+def project_drift(project_name):
+    """Changes detected between consecutive scans: ?days=7 (or ?since=<epoch>), ?host=, ?section=, ?change=added|removed|changed."""
+    try:
+        if request.args.get("since"):
+            since = float(request.args["since"])
+        else:
+            since = time.time() - float(request.args.get("days", 7)) * 86400
+        limit = page_size(request.args.get("limit"), default=200, maximum=1000)
+    except ValueError:
+        return jsonify({"error": "since, days and limit must be numbers"}), 400
+    try:
+        with reader(project_name) as conn:
+            drift = drift_since(conn, since, request.args.get("host"), request.args.get("section"),
+                                request.args.get("change"), limit)
+        return jsonify({"since": since, "drift": drift}), 200
+    except FileNotFoundError:
+        return jsonify({'error': f'Database for project "{project_name}" not found'}), 404
+    except Exception as e:
+        logging.error(f"Error reading drift of project '{project_name}': {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fleet/search', methods=['GET'])
+def search_fleet():
+    """Cross-project lookup, e.g. ?kind=software&q=7-zip or ?kind=mac&q=00:1A:2B; page with ?cursor=."""
+    kind = request.args.get("kind", "host")
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "q is required", "kinds": list(fleet_catalog.KINDS)}), 400
+    try:
+        page = fleet_catalog.search(
+            kind, query,
+            version=request.args.get("version"),
+            project=request.args.get("project"),
+            exact=request.args.get("exact", "").lower() in ("1", "true", "yes"),
+            limit=request.args.get("limit", 50),
+            cursor=request.args.get("cursor"),
+        )
+        return jsonify(page), 200
+    except ValueError as e:
+        return jsonify({"error": str(e), "kinds": list(fleet_catalog.KINDS)}), 400
+    except Exception as e:
+        logging.error(f"Fleet search failed: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/project/<project_name>/asset/<asset_name>/pdf/', methods=['GET'])
 def download_asset_pdf(project_name, asset_name):
@@ -194,129 +551,15 @@ def download_asset_pdf(project_name, asset_name):
 
     try:
         # Retrieve JSON from DB
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT json_data FROM scan_results WHERE system_name = ?", (asset_name,))
-        row = cursor.fetchone()
-        conn.close()
-
-        if not row:
-            return jsonify({'error': f'Asset "{asset_name}" not found in project "{project_name}"'}), 404
-
-        json_data = json.loads(row[0])
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-
-        y = height - 50
-        left_margin = 40
-        line_height = 15
-        max_width = width - 2 * left_margin
-
-        def check_page_space(y, lines_needed=1):
-            if y < 60 + line_height * lines_needed:
-                p.showPage()
-                p.setFont("Helvetica", 10)
-                return height - 50
-            return y
-
-        def draw_wrapped_text(key, value, y, indent=0):
-            x = left_margin + indent
-            p.setFont("Helvetica-Bold", 10)
-            p.drawString(x, y, f"{key}:")
-            y -= line_height
-
-            p.setFont("Helvetica", 10)
-            text = str(value)
-            words = text.split()
-            line = ""
-            for word in words:
-                if p.stringWidth(line + word + " ", "Helvetica", 10) <= max_width - indent:
-                    line += word + " "
-                else:
-                    p.drawString(x + 20, y, line.strip())
-                    y = check_page_space(y)
-                    y -= line_height
-                    line = word + " "
-            if line:
-                y = check_page_space(y)
-                p.drawString(x + 20, y, line.strip())
-                y -= line_height
-            return y
-
-        def draw_dict(data, y, indent=0):
-            for key, value in data.items():
-                y = check_page_space(y)
-                if isinstance(value, dict):
-                    p.setFont("Helvetica-Bold", 10)
-                    p.drawString(left_margin + indent, y, f"{key}:")
-                    y -= line_height
-                    y = draw_dict(value, y, indent + 20)
-                elif isinstance(value, list):
-                    p.setFont("Helvetica-Bold", 10)
-                    p.drawString(left_margin + indent, y, f"{key}:")
-                    y -= line_height
-                    for idx, item in enumerate(value):
-                        if isinstance(item, dict):
-                            y = draw_dict(item, y, indent + 20)
-                        else:
-                            y = draw_wrapped_text(f"- Item {idx + 1}", item, y, indent + 20)
-                else:
-                    y = draw_wrapped_text(key, value, y, indent)
-            return y
-
-        def draw_section(title, section_data, y):
-            y = check_page_space(y, 2)
-            p.setFont("Helvetica-Bold", 12)
-            p.drawString(left_margin, y, title)
-            y -= line_height
-
-            if isinstance(section_data, list):
-                for item in section_data:
-                    if isinstance(item, dict) and len(item) == 1:
-                        for key, val in item.items():
-                            y = check_page_space(y)
-                            p.setFont("Helvetica-Bold", 10)
-                            p.drawString(left_margin + 10, y, f"{key}:")
-                            y -= line_height
-                            if isinstance(val, dict):
-                                y = draw_dict(val, y, indent=20)
-                            elif isinstance(val, list):
-                                for idx, subval in enumerate(val):
-                                    if isinstance(subval, dict):
-                                        y = check_page_space(y)
-                                        p.setFont("Helvetica-Oblique", 10)
-                                        p.drawString(left_margin + 20, y, f"- Item {idx + 1}")
-                                        y -= line_height
-                                        y = draw_dict(subval, y, indent=30)
-                                    else:
-                                        y = draw_wrapped_text(f"- Item {idx + 1}", subval, y, indent=30)
-                            else:
-                                y = draw_wrapped_text(key, val, y, indent=20)
-                    elif isinstance(item, dict):
-                        y = draw_dict(item, y, indent=10)
-                    else:
-                        y = draw_wrapped_text("Item", item, y, indent=10)
-            elif isinstance(section_data, dict):
-                y = draw_dict(section_data, y, indent=10)
-            else:
-                y = draw_wrapped_text(title, section_data, y, indent=10)
-
-            y -= 10
-            return y
-
-        # Header
-        p.setFont("Helvetica-Bold", 16)
-        p.drawString(left_margin, y, f"Asset Report: {asset_name}")
-        y -= 30
-
-        for section in ["AssetDetails", "Hardware", "Software", "Users", "Security"]:
-            if section in json_data:
-                y = draw_section(section, json_data[section], y)
-
-        p.save()
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name=f"{asset_name}_details.pdf", mimetype='application/pdf')
+        with reader(project_name) as conn:
+            row = conn.execute("SELECT json_data FROM scan_results WHERE system_name = ? ORDER BY id DESC LIMIT 1",
+                               (asset_name,)).fetchone()
+
+            if not row:
+                return jsonify({'error': f'Asset "{asset_name}" not found in project "{project_name}"'}), 404
+
+            pdf_path = get_asset_pdf(project_name, asset_name, row[0], payload_loader(conn))
+        return send_file(pdf_path, as_attachment=True, download_name=f"{asset_name}_details.pdf", mimetype='application/pdf')
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -326,30 +569,52 @@ def download_asset_pdf(project_name, asset_name):
     
 
 
-@app.route("/projects/<project_name>/download", methods=["GET"])
-def download_csv(project_name):
-    try:
-        db_path = f"db/{project_name}.db"
-        if not os.path.exists(db_path):
-            return jsonify({"error": "Project not found"}), 404
+@app.route("/projects/<project_name>/pdf", methods=["GET"])
+def download_project_pdfs(project_name):
+    """ZIP of the latest report of every successfully scanned asset, rendered in parallel."""
+    if not os.path.exists(os.path.join(DB_DIR, f"{project_name}.db")):
+        return jsonify({"error": "Project not found"}), 404
 
-        # Create temp CSV file
-        temp_csv = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
-        temp_csv_path = temp_csv.name
-        temp_csv.close()
+    try:
+        # Unnamed temp file: removed by the OS as soon as the response closes it
+        archive = tempfile.TemporaryFile(suffix=".zip")
+        with reader(project_name) as conn:
+            latest_assets = conn.execute('''
+                SELECT system_name, json_data FROM scan_results
+                WHERE id IN (SELECT MAX(id) FROM scan_results WHERE lower(status) = 'success' GROUP BY system_name)
+                ORDER BY system_name
+            ''')
+            write_project_zip(project_name, latest_assets, archive, payload_loader(conn))
+        archive.seek(0)
+        return send_file(archive, as_attachment=True, download_name=f"{project_name}_reports.zip",
+                         mimetype="application/zip")
+    except Exception as e:
+        logging.error(f"Bulk PDF export failed for '{project_name}': {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
-        # Call your function to fill in the CSV
-        extract_json_to_csv(db_path, temp_csv_path)
 
-        # Send CSV to frontend
-        return send_file(temp_csv_path,
-                         as_attachment=True,
-                         download_name=f"{project_name}_report.csv",
-                         mimetype="text/csv")
+@app.route("/projects/<project_name>/download", methods=["GET"])
+def download_csv(project_name):
+    """Streams the project CSV; ?columns=ID,Client IP,... picks a subset of CSV_COLUMNS."""
+    if not os.path.exists(os.path.join(DB_DIR, f"{project_name}.db")):
+        return jsonify({"error": "Project not found"}), 404
+
+    columns = [c.strip() for c in request.args.get("columns", "").split(",") if c.strip()] or None
+    unknown = [c for c in columns or [] if c not in CSV_COLUMNS]
+    if unknown:
+        return jsonify({"error": f"Unknown CSV columns: {', '.join(unknown)}",
+                        "available": list(CSV_COLUMNS)}), 400
+
+    def generate():
+        with reader(project_name) as conn:
+            yield from iter_csv(conn, columns)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{project_name}_report.csv"'},
+    )
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 
 if __name__ == '__main__':
     # Run on port 80 as you mentioned
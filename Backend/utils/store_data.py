@@ -3,129 +3,187 @@
 import sqlite3
 import logging
 import os, json, logging, csv, json
-import threading
-
-db_lock = threading.Lock()
-
-
-def create_db_and_store_results(project_name, client_ip, system_name, status, data):
+import io
+import time
+from collections import OrderedDict
+from utils.db_pool import submit_write
+from utils.asset_schema import index_asset
+from utils.payload_store import pack_payload, record_scan_sections, load_payload
+from utils.scan_diff import record_drift
+from utils.project_summary import record_summary
+from utils.target_outcomes import record_outcome, collapse_failure
+from utils import fleet_catalog, vuln_match
+
+
+def create_db_and_store_results(project_name, client_ip, system_name, status, data, wait=False):
     """
-    Creates a new SQLite database for the scan and stores client IP and JSON data.
+    Stores client IP and JSON data in the project's SQLite database.
+    Successful payloads are deduplicated: unchanged Software/Users/Hardware/Security
+    sections are stored as refs to content already in the DB, and their delta against
+    the host's previous scan is recorded for drift queries. The project summary
+    aggregates are updated in the same transaction, for failures as well.
+    A failure identical to the IP's latest row updates that row's updated_at and attempt
+    count instead of adding a row.
+    The row is queued on the project's single writer and committed with other pending
+    writes; pass wait=True to block until it is durable. Returns the writer Future.
     """
-    # import os, json, sqlite3, logging
-    with db_lock:
-        try:
-            db_name = f"db/{project_name}.db"
-            os.makedirs('db', exist_ok=True)
-
-            # Connect to the database (it will be created if it doesn't exist)
-            conn = sqlite3.connect(db_name)
-            cursor = conn.cursor()
-
-            # Create table if it doesn't exist
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scan_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_ip TEXT NOT NULL,
-                system_name TEXT NOT NULL,
-                status TEXT NOT NULL,
-                json_data TEXT NOT NULL
-            )
-            ''')
-
-            # Insert the data (use correct column name: system_name)
-            cursor.execute('''
-            INSERT INTO scan_results (client_ip, system_name, status, json_data)
-            VALUES (?, ?, ?, ?)
-            ''', (client_ip, system_name, status, json.dumps(data)))
-
-            # Commit and close
-            conn.commit()
-        except sqlite3.OperationalError as e:
-            logging.error(f"[!] SQLite error on {client_ip}: {e}")
-        finally:
-            conn.close()
-    # conn.close()
-    # logging.info(f"Scan data stored in {db_name} for client IP: {client_ip}")
-
-
-
-def extract_json_to_csv(db_path, csv_output_path):
+    success = status.lower() == "success" and isinstance(data, dict)
+    json_data = None if success else json.dumps(data)
+
+    def insert(conn):
+        hashes = changed = None
+        row_data = json_data
+        now = time.time()
+        if not success:
+            scan_id = collapse_failure(conn, client_ip, status, json_data, now)
+            if scan_id is not None:
+                return scan_id
+        if success:
+            previous = conn.execute(
+                "SELECT scan_id FROM assets WHERE system_name = ? AND is_latest = 1", (system_name,)).fetchone()
+            row_data, hashes, changed = pack_payload(conn, data, previous[0] if previous else None)
+        cursor = conn.execute('''
+        INSERT INTO scan_results (client_ip, system_name, status, json_data, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (client_ip, system_name, status, row_data, now))
+        scan_id = cursor.lastrowid
+        if success:
+            record_scan_sections(conn, scan_id, hashes, changed)
+            record_drift(conn, scan_id, previous[0] if previous else None, system_name, data, changed)
+            index_asset(conn, scan_id, client_ip, system_name, data)
+            record_outcome(conn, client_ip, "success")
+        record_summary(conn, scan_id, client_ip, system_name, status, None if success else str(data))
+        return scan_id
+
+    def log_error(f):
+        if f.exception():
+            logging.error(f"[!] SQLite error on {client_ip}: {f.exception()}")
+        elif success:
+            fleet_catalog.mark_dirty(project_name)
+            vuln_match.mark_dirty(project_name)
+
+    future = submit_write(project_name, insert)
+    future.add_done_callback(log_error)
+    if wait:
+        future.result()
+    return future
+
+
+# CSV column -> key in the dict built by extract_csv_fields(), in export order
+CSV_COLUMNS = OrderedDict([
+    ("ID", "id"),
+    ("Client IP", "client_ip"),
+    ("System Name", "system_name"),
+    ("Status", "status"),
+    ("Hostname", "hostname"),
+    ("OS Name", "os_name"),
+    ("License Status", "license_status"),
+    ("Disk Space (GB)", "disk_space"),
+    ("RAM (GB)", "ram"),
+    ("AV Status", "av_status"),
+    ("Firewall Status", "firewall_status"),
+    ("Raw JSON/Error", "raw_json_or_error"),
+])
+ROW_COLUMNS = {"id", "client_ip", "system_name", "status"}
+
+
+def extract_csv_fields(row, parse_json=True, load=json.loads):
     """
-    Extracts fields from an SQLite database table and writes them to a CSV file.
+    Extracts the CSV fields of one scan_results row.
     Handles both 'pass' (with JSON) and 'fail' (with status message) rows.
+    load(json_data) turns the stored text into the payload dict.
+    """
+    id_, client_ip, system_name, status, json_data = row
+
+    # Default fields for CSV row
+    fields = dict.fromkeys(CSV_COLUMNS.values(), "")
+    fields.update(id=id_, client_ip=client_ip, system_name=system_name, status=status)
+
+    if status.lower() != "success":
+        # If failed, JSON data will be a string like 'portclosed', etc.
+        fields["raw_json_or_error"] = json_data
+        return fields
+    if not parse_json:
+        return fields
+
+    try:
+        data = load(json_data)
+
+        asset = data.get("AssetDetails", {})
+        fields["hostname"] = asset.get("SystemName", "")
+        fields["disk_space"] = asset.get("DiskSpaceGB", "")
+        fields["ram"] = asset.get("Ram Size", "")
+
+        # Extract from Hardware list
+        for hw in data.get("Hardware", []):
+            if "OperatingSystem" in hw:
+                fields["os_name"] = hw["OperatingSystem"].get("Operating System", "")
+            if "License" in hw:
+                fields["license_status"] = hw["License"].get("LicenseStatus", "")
+
+        # Extract from Security list
+        for sec in data.get("Security", []):
+            if "Antivirus" in sec:
+                fields["av_status"] = sec["Antivirus"].get("SignatureStatus", "")
+            if "Firewall" in sec:
+                profiles = sec["Firewall"]
+                if isinstance(profiles, list):
+                    fields["firewall_status"] = ", ".join([f"{p['Profile']}={p['Enabled']}" for p in profiles])
+                elif isinstance(profiles, dict):
+                    fields["firewall_status"] = profiles.get("Enabled", "")
+
+    except (json.JSONDecodeError, TypeError, AttributeError) as e:
+        fields["raw_json_or_error"] = f"JSON Decode Error: {str(e)}"
+
+    return fields
+
+
+def iter_csv(conn, columns=None):
+    """
+    Yields the project report as CSV text, one encoded line at a time.
+    Rows are read straight off the cursor, so memory stays flat whatever the project size.
+    columns is a list of CSV_COLUMNS headers; defaults to all of them.
+    """
+    columns = columns or list(CSV_COLUMNS)
+    unknown = [c for c in columns if c not in CSV_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown CSV columns: {', '.join(unknown)}")
+    keys = [CSV_COLUMNS[c] for c in columns]
+    # Skip json.loads entirely when only plain row columns were asked for
+    parse_json = any(key not in ROW_COLUMNS | {"raw_json_or_error"} for key in keys)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(columns)
+    yield flush()
+
+    # The report only needs Hardware and Security; Software and Users stay unloaded
+    load = lambda json_data: load_payload(conn, json_data, sections=("Hardware", "Security"))
+    cursor = conn.execute("SELECT id, client_ip, system_name, status, json_data FROM scan_results ORDER BY id")
+    for row in cursor:
+        fields = extract_csv_fields(row, parse_json, load)
+        writer.writerow([fields[key] for key in keys])
+        yield flush()
+
+
+def extract_json_to_csv(db_path, csv_output_path, columns=None):
+    """
+    Extracts fields from an SQLite database table and writes them to a CSV file.
     """
-
-    # Connect to the SQLite database
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Fetch all rows from the scan_results table
-    cursor.execute("SELECT id, client_ip, system_name, status, json_data FROM scan_results")
-    rows = cursor.fetchall()
-
-    # CSV Headers
-    headers = [
-        "ID", "Client IP", "System Name", "Status", "Hostname", "OS Name",
-        "License Status", "Disk Space (GB)", "RAM (GB)", "AV Status", "Firewall Status", "Raw JSON/Error"
-    ]
-    output_data = []
-
-    for row in rows:
-        id_, client_ip, system_name, status, json_data = row
-
-        # Default fields for CSV row
-        hostname = os_name = license_status = disk_space = ram = av_status = firewall_status = ""
-
-        if status.lower() == "success":
-            try:
-                data = json.loads(json_data)
-
-                asset = data.get("AssetDetails", {})
-                hostname = asset.get("SystemName", "")
-                disk_space = asset.get("DiskSpaceGB", "")
-                ram = asset.get("Ram Size", "")
-
-                # Extract from Hardware list
-                for hw in data.get("Hardware", []):
-                    if "OperatingSystem" in hw:
-                        os_name = hw["OperatingSystem"].get("Operating System", "")
-                    if "License" in hw:
-                        license_status = hw["License"].get("LicenseStatus", "")
-
-                # Extract from Security list
-                for sec in data.get("Security", []):
-                    if "Antivirus" in sec:
-                        av_status = sec["Antivirus"].get("SignatureStatus", "")
-                    if "Firewall" in sec:
-                        profiles = sec["Firewall"]
-                        if isinstance(profiles, list):
-                            firewall_status = ", ".join([f"{p['Profile']}={p['Enabled']}" for p in profiles])
-                        elif isinstance(profiles, dict):
-                            firewall_status = profiles.get("Enabled", "")
-
-                raw_json_or_error = ""  # clean JSON means no error here
-
-            except (json.JSONDecodeError, TypeError) as e:
-                raw_json_or_error = f"JSON Decode Error: {str(e)}"
-
-        else:
-            # If failed, JSON data will be a string like 'portclosed', etc.
-            raw_json_or_error = json_data
-
-        output_data.append([
-            id_, client_ip, system_name, status,
-            hostname, os_name, license_status,
-            disk_space, ram, av_status, firewall_status, raw_json_or_error
-        ])
-
-    # Write to CSV
-    with open(csv_output_path, "w", newline="", encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(headers)
-        writer.writerows(output_data)
-
-    #print(f"✅ Data exported to {csv_output_path}")
+    try:
+        with open(csv_output_path, "w", newline="", encoding='utf-8') as csvfile:
+            for chunk in iter_csv(conn, columns):
+                csvfile.write(chunk)
+    finally:
+        conn.close()
 
 # if __name__ == "__main__":
 #     db_path = "db/Test2.db"         
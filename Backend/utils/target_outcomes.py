@@ -0,0 +1,223 @@
+# target_outcomes.py
+import logging
+import os
+import sqlite3
+import sys
+import time
+from utils.db_pool import register_schema, run_script, submit_write, reader, db_path, DB_DIR
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+OUTCOMES = ("success", "unreachable", "port_closed", "auth_failed", "exec_timeout", "exec_error")
+
+# Seconds a target is skipped after one failure of this kind; every further consecutive
+# failure doubles it up to MAX_BACKOFF. Zero means never skipped, only scanned last
+# (new credentials may fix a login failure).
+BACKOFF_BASE = {
+    "unreachable": 3600,
+    "port_closed": 3600,
+    "exec_timeout": 900,
+    "exec_error": 900,
+    "auth_failed": 0,
+}
+MAX_BACKOFF = 7 * 24 * 3600
+
+OUTCOME_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS target_outcomes (
+    ip TEXT PRIMARY KEY,
+    outcome TEXT NOT NULL,
+    detail TEXT,
+    failures INTEGER NOT NULL DEFAULT 0,
+    first_failed REAL,
+    last_attempt REAL NOT NULL,
+    last_success REAL,
+    retry_after REAL
+) WITHOUT ROWID;
+'''
+
+
+def backoff(outcome, failures):
+    """Seconds to wait before retrying a target after `failures` consecutive failures ending in `outcome`."""
+    base = BACKOFF_BASE.get(outcome, 0)
+    if not base or failures < 1:
+        return 0
+    return min(base * 2 ** min(failures - 1, 32), MAX_BACKOFF)
+
+
+def record_outcome(conn, ip, outcome, detail=None, now=None):
+    """Updates the target's row inside the writer's transaction. Failures extend the streak."""
+    now = now or time.time()
+    previous = conn.execute("SELECT failures, first_failed, last_success FROM target_outcomes WHERE ip = ?",
+                            (ip,)).fetchone()
+    failures, first_failed, last_success = previous or (0, None, None)
+    if outcome == "success":
+        failures, first_failed, last_success, retry_after = 0, None, now, None
+    else:
+        failures += 1
+        first_failed = first_failed or now
+        wait = backoff(outcome, failures)
+        retry_after = now + wait if wait else None
+    conn.execute('''
+        INSERT OR REPLACE INTO target_outcomes
+            (ip, outcome, detail, failures, first_failed, last_attempt, last_success, retry_after)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (ip, outcome, detail, failures, first_failed, now, last_success, retry_after))
+
+
+def record_target_outcome(project_name, ip, outcome, detail=None):
+    """Queues record_outcome() on the project's writer. Returns the writer Future."""
+    if outcome not in OUTCOMES:
+        raise ValueError(f"Unknown target outcome: {outcome}")
+    now = time.time()
+    future = submit_write(project_name, lambda conn: record_outcome(conn, ip, outcome, detail, now))
+    future.add_done_callback(
+        lambda f: f.exception() and logging.error(f"[!] SQLite error on {ip}: {f.exception()}"))
+    return future
+
+
+class TargetPlan:
+    """Which targets of a scan to skip (still backing off) and which to scan last (failure streak)."""
+
+    def __init__(self, rows, now=None, retry_failed=False):
+        self.now = now or time.time()
+        self.retry_failed = retry_failed
+        self.rows = rows
+
+    def skip_reason(self, ip):
+        row = self.rows.get(ip)
+        if self.retry_failed or not row or not row[2] or row[2] <= self.now:
+            return None
+        outcome, failures, retry_after = row
+        return (f"{outcome.replace('_', ' ').capitalize()} on the last {failures} attempt(s); "
+                f"retried after {time.strftime('%Y-%m-%d %H:%M', time.localtime(retry_after))}")
+
+    def order(self, ips, on_skip=None):
+        """
+        Yields ips lazily, leaving out those still backing off (on_skip(ip, reason) is called
+        for them) and holding back targets with a failure streak until the others are out.
+        """
+        deferred = []
+        for ip in ips:
+            reason = self.skip_reason(ip)
+            if reason:
+                if on_skip:
+                    on_skip(ip, reason)
+                continue
+            if ip in self.rows:
+                deferred.append(ip)
+                continue
+            yield ip
+        if deferred:
+            logger.info(f"Scanning {len(deferred)} targets with recent failures last")
+        yield from deferred
+
+
+def load_plan(project_name, retry_failed=False):
+    """TargetPlan from the project's failing targets; empty for a project without a DB yet."""
+    try:
+        with reader(project_name) as conn:
+            rows = {ip: (outcome, failures, retry_after) for ip, outcome, failures, retry_after in conn.execute(
+                "SELECT ip, outcome, failures, retry_after FROM target_outcomes WHERE failures > 0")}
+    except FileNotFoundError:
+        rows = {}
+    return TargetPlan(rows, retry_failed=retry_failed)
+
+
+def get_outcomes(conn, outcome=None, limit=1000, after=""):
+    """One keyset page of target_outcomes rows as dicts, ordered by IP text."""
+    sql = "SELECT ip, outcome, detail, failures, first_failed, last_attempt, last_success, retry_after " \
+          "FROM target_outcomes WHERE ip > ?"
+    params = [after]
+    if outcome:
+        sql += " AND outcome = ?"
+        params.append(outcome)
+    sql += " ORDER BY ip LIMIT ?"
+    params.append(limit)
+    columns = ("ip", "outcome", "detail", "failures", "first_failed", "last_attempt", "last_success", "retry_after")
+    return [dict(zip(columns, row)) for row in conn.execute(sql, params)]
+
+
+def collapse_failure(conn, client_ip, status, json_data, now=None):
+    """
+    Folds a failure into the IP's latest scan_results row when that row is the same failure:
+    its timestamp moves to now and its attempt count grows. Returns the row's id, or None
+    when a new row is needed.
+    """
+    latest = conn.execute(
+        "SELECT id, status, json_data FROM scan_results WHERE client_ip = ? ORDER BY id DESC LIMIT 1",
+        (client_ip,)).fetchone()
+    if not latest or (latest[1], latest[2]) != (status, json_data):
+        return None
+    conn.execute("UPDATE scan_results SET attempts = coalesce(attempts, 1) + 1, updated_at = ? WHERE id = ?",
+                 (now or time.time(), latest[0]))
+    return latest[0]
+
+
+def compact_failures(conn):
+    """
+    Collapses runs of identical consecutive failures of an IP stored before they were
+    collapsed on insert: the newest row of each run is kept and gets the run's attempt
+    count, like collapse_failure() would have left it. Returns rows deleted.
+    """
+    runs = conn.execute('''
+        WITH ordered AS (
+            SELECT id, client_ip, coalesce(attempts, 1) AS attempts,
+                   CASE WHEN status = 'Failed' AND lag(status) OVER host = 'Failed'
+                             AND lag(json_data) OVER host = json_data THEN 0 ELSE 1 END AS starts
+            FROM scan_results WINDOW host AS (PARTITION BY client_ip ORDER BY id)
+        ), numbered AS (
+            SELECT id, client_ip, attempts, sum(starts) OVER (PARTITION BY client_ip ORDER BY id) AS run
+            FROM ordered
+        )
+        SELECT client_ip, min(id), max(id), sum(attempts) FROM numbered
+        GROUP BY client_ip, run HAVING count(*) > 1
+    ''').fetchall()
+    deleted = 0
+    for client_ip, first_id, last_id, attempts in runs:
+        conn.execute("UPDATE scan_results SET attempts = ? WHERE id = ?", (attempts, last_id))
+        deleted += conn.execute("DELETE FROM scan_results WHERE client_ip = ? AND id >= ? AND id < ?",
+                                (client_ip, first_id, last_id)).rowcount
+    return deleted
+
+
+def migrate(conn):
+    run_script(conn, OUTCOME_SCHEMA)
+    # Collapsed failure rows keep when they last happened and how often
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(scan_results)")}
+    for column, definition in (("updated_at", "REAL"), ("attempts", "INTEGER NOT NULL DEFAULT 1")):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE scan_results ADD COLUMN {column} {definition}")
+
+
+register_schema(migrate)
+
+
+def compact_all(project_names=None):
+    """
+    Runs compact_failures() on the given projects (every db/*.db file by default). It deletes
+    the duplicate rows for good, so it is an explicit maintenance step, not a migration.
+    """
+    if not project_names:
+        project_names = sorted(name[:-3] for name in os.listdir(DB_DIR) if name.endswith(".db"))
+    for project_name in project_names:
+        conn = sqlite3.connect(db_path(project_name), isolation_level=None)
+        try:
+            conn.execute("PRAGMA busy_timeout=5000")
+            migrate(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = compact_failures(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        logger.info(f"{project_name}: collapsed {deleted} repeated failure rows")
+        print(f"{project_name}: collapsed {deleted} repeated failure rows")
+
+
+if __name__ == "__main__":
+    # python -m utils.target_outcomes [project ...]  (collapses duplicate failure rows)
+    compact_all(sys.argv[1:])
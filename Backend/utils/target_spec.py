@@ -0,0 +1,176 @@
+# target_spec.py
+import bisect
+import ipaddress
+
+
+def int_to_ip(value):
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def parse_target(part, hosts_only=True):
+    """
+    Parses a single IP, CIDR or start-end range into an inclusive (start, end) integer interval.
+    With hosts_only, CIDRs drop their network and broadcast addresses like IPv4Network.hosts().
+    """
+    part = part.strip()
+    if '-' in part:
+        start_ip, end_ip = part.split('-', 1)
+        try:
+            start = int(ipaddress.IPv4Address(start_ip.strip()))
+            end = int(ipaddress.IPv4Address(end_ip.strip()))
+        except ValueError:
+            raise ValueError(f"Invalid IP range: {part}")
+        if end < start:
+            raise ValueError("Invalid IP range: end IP is before start IP.")
+        return start, end
+    if '/' in part:
+        try:
+            net = ipaddress.IPv4Network(part, strict=False)
+        except ValueError:
+            raise ValueError(f"Invalid CIDR: {part}")
+        start, end = int(net.network_address), int(net.broadcast_address)
+        if hosts_only and net.prefixlen < 31:
+            start, end = start + 1, end - 1
+        return start, end
+    try:
+        value = int(ipaddress.IPv4Address(part))
+    except ValueError:
+        raise ValueError(f"Invalid IP address: {part}")
+    return value, value
+
+
+def merge_intervals(intervals):
+    """Sorts and merges overlapping or adjacent inclusive intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(intervals, exclusions):
+    """Removes the (merged) exclusions from the (merged) intervals."""
+    result = []
+    ex_index = 0
+    for start, end in intervals:
+        while ex_index < len(exclusions) and exclusions[ex_index][1] < start:
+            ex_index += 1
+        cursor = start
+        i = ex_index
+        while i < len(exclusions) and exclusions[i][0] <= end:
+            ex_start, ex_end = exclusions[i]
+            if ex_start > cursor:
+                result.append((cursor, ex_start - 1))
+            cursor = max(cursor, ex_end + 1)
+            i += 1
+        if cursor <= end:
+            result.append((cursor, end))
+    return result
+
+
+class TargetSpec:
+    """
+    A set of IPv4 targets stored as merged integer intervals.
+
+    Iteration is lazy and ordered, len() is O(1) and membership is O(log n) in the
+    number of intervals, so a /8 costs a handful of integers instead of 16M strings.
+    """
+
+    def __init__(self, intervals=()):
+        self.intervals = merge_intervals(intervals)
+        # Running host counts let us index and shard without walking the intervals
+        self._offsets = []
+        total = 0
+        for start, end in self.intervals:
+            self._offsets.append(total)
+            total += end - start + 1
+        self._size = total
+
+    @classmethod
+    def parse(cls, ip_input):
+        """
+        Builds a spec from comma separated IPs, CIDRs and ranges.
+        Entries prefixed with '!' are excluded, e.g. "10.0.0.0/24, !10.0.0.10-10.0.0.20".
+        """
+        include, exclude = [], []
+        for part in ip_input.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if part.startswith('!'):
+                exclude.append(parse_target(part[1:], hosts_only=False))
+            else:
+                include.append(parse_target(part))
+        if not include:
+            raise ValueError("No IP addresses provided.")
+        return cls(subtract_intervals(merge_intervals(include), merge_intervals(exclude)))
+
+    @classmethod
+    def from_ips(cls, ips):
+        """Builds a spec from ordered IP strings, merging runs of consecutive addresses as they come."""
+        intervals = []
+        for ip in ips:
+            value = int(ipaddress.IPv4Address(ip))
+            if intervals and intervals[-1][1] + 1 == value:
+                intervals[-1][1] = value
+            else:
+                intervals.append([value, value])
+        return cls(intervals)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for start, end in self.intervals:
+            for value in range(start, end + 1):
+                yield int_to_ip(value)
+
+    def __contains__(self, ip):
+        value = int(ipaddress.IPv4Address(ip))
+        index = bisect.bisect_right(self.intervals, (value, float('inf'))) - 1
+        return index >= 0 and self.intervals[index][0] <= value <= self.intervals[index][1]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("TargetSpec index out of range")
+        pos = bisect.bisect_right(self._offsets, index) - 1
+        return int_to_ip(self.intervals[pos][0] + index - self._offsets[pos])
+
+    def slice(self, first, last):
+        """Returns a new spec covering host positions [first, last)."""
+        first, last = max(first, 0), min(last, self._size)
+        intervals = []
+        if first >= last:
+            return TargetSpec()
+        pos = bisect.bisect_right(self._offsets, first) - 1
+        while pos < len(self.intervals) and self._offsets[pos] < last:
+            start, end = self.intervals[pos]
+            offset = self._offsets[pos]
+            lo = start + max(first - offset, 0)
+            hi = start + min(last - offset, end - start + 1) - 1
+            intervals.append((lo, hi))
+            pos += 1
+        return TargetSpec(intervals)
+
+    def shards(self, count=None, size=None):
+        """Splits the spec into contiguous sub-specs, either `count` of them or `size` hosts each."""
+        if size is None:
+            count = max(int(count or 1), 1)
+            size = -(-self._size // count) or 1
+        for first in range(0, self._size, size):
+            yield self.slice(first, first + size)
+
+    def to_string(self):
+        """Compact text form that TargetSpec.parse() accepts."""
+        return ",".join(
+            int_to_ip(start) if start == end else f"{int_to_ip(start)}-{int_to_ip(end)}"
+            for start, end in self.intervals
+        )
+
+    def __repr__(self):
+        return f"TargetSpec({self.to_string()!r}, hosts={self._size})"
@@ -0,0 +1,267 @@
+# transports.py
+import hashlib
+import threading
+import time
+from utils.logging_config import setup_logging
+from utils.impacket_exec import ExecError, classify_error
+from utils.metrics import EXEC_SECONDS
+from utils.scheduler import subnet_of
+from utils.wmiconnect import build_agent_command, encode_powershell_command, launch_agent
+
+logger = setup_logging()
+
+try:
+    import winrm
+    from winrm.exceptions import InvalidCredentialsError, WinRMOperationTimeoutError
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+    WINRM_AVAILABLE = True
+except ImportError:
+    WINRM_AVAILABLE = False
+
+CAPABILITY_TTL = 24 * 3600     # seconds a host's working transport is trusted
+SUBNET_TTL = 6 * 3600          # seconds a subnet's last working transport is used as a hint
+REFRESH_SLACK = 60             # an unchanged entry is rewritten at most this often
+
+WINRM_OPERATION_TIMEOUT = 20   # seconds pywinrm waits on one WS-Man operation
+WINRM_READ_TIMEOUT = 30        # HTTP read timeout, must exceed the operation timeout
+SESSION_TTL = 300              # seconds an idle WinRM session (and its HTTP connection) is kept
+MAX_CACHED_SESSIONS = 256
+
+# Outcomes after which no other transport is tried: the same credentials would be rejected
+# again (and count towards a lockout), or the host is hung
+FINAL_OUTCOMES = ("auth", "timeout")
+
+
+class Transport:
+    """A way to start the agent on a host. `port` must be open for the transport to be tried."""
+    name = None
+    port = None
+
+    def available(self):
+        return True
+
+    def launch(self, project_name, ip, username, password, domain, server_ip):
+        """Starts the agent; returns 'success' or the failure kind 'auth', 'unreachable', 'timeout' or 'error'."""
+        raise NotImplementedError
+
+
+class WmiTransport(Transport):
+    name = "wmi"
+    port = 135
+
+    def launch(self, project_name, ip, username, password, domain, server_ip):
+        # The selection engine records the failure row once, whatever transports were tried
+        return launch_agent(project_name, ip, username, password, domain, server_ip,
+                            record_failure=lambda project, host: None)
+
+
+class WinRMTransport(Transport):
+    """
+    Runs the agent command through WinRM with NTLM. The command is started with
+    Win32_Process.Create on the host, so it outlives the WinRM shell and the call returns
+    as soon as the agent is running, like the WMI transport.
+    """
+
+    def __init__(self, name, port, scheme):
+        self.name = name
+        self.port = port
+        self.scheme = scheme
+
+    def available(self):
+        return WINRM_AVAILABLE
+
+    def launch(self, project_name, ip, username, password, domain, server_ip):
+        started = time.perf_counter()
+        try:
+            self._run(ip, username, password, domain, build_agent_command(project_name, ip, server_ip))
+            EXEC_SECONDS.observe(time.perf_counter() - started, backend=self.name, outcome="success")
+            logger.info(f"[+] Agent launched on {ip} ({self.name})")
+            return "success"
+        except ExecError as e:
+            EXEC_SECONDS.observe(time.perf_counter() - started, backend=self.name, outcome=e.kind)
+            logger.error(f"[!] Error from {ip}: {e}")
+            return e.kind
+
+    def _run(self, ip, username, password, domain, command):
+        url = f"{self.scheme}://{ip}:{self.port}/wsman"
+        user = f"{domain}\\{username}" if domain else username
+        key = (url, user.lower(), hashlib.sha256(password.encode()).hexdigest())
+        launcher = f"exit (Invoke-CimMethod -ClassName Win32_Process -MethodName Create " \
+                   f"-Arguments @{{CommandLine='{command}'}}).ReturnValue"
+        arguments = ["-NoProfile", "-NonInteractive", "-EncodedCommand", encode_powershell_command(launcher)]
+        session = _take_session(key)
+        if session is not None:
+            try:
+                response = session.run_cmd("powershell.exe", arguments)
+            except Exception as e:
+                # The pooled connection went stale (host rebooted, idle timeout); log in again
+                logger.info(f"Cached WinRM session for {ip} is no longer usable: {e}")
+                session = None
+
+        if session is None:
+            try:
+                session = winrm.Session(url, auth=(user, password), transport="ntlm",
+                                        server_cert_validation="ignore",
+                                        operation_timeout_sec=WINRM_OPERATION_TIMEOUT,
+                                        read_timeout_sec=WINRM_READ_TIMEOUT)
+                response = session.run_cmd("powershell.exe", arguments)
+            except InvalidCredentialsError as e:
+                raise ExecError(f"WinRM login to {ip} failed: {e}", "auth")
+            except (RequestsTimeout, WinRMOperationTimeoutError) as e:
+                raise ExecError(f"WinRM call to {ip} timed out: {e}", "timeout")
+            except RequestsConnectionError as e:
+                raise ExecError(f"WinRM connection to {ip} failed: {e}", "unreachable")
+            except Exception as e:
+                raise ExecError(f"WinRM execution on {ip} failed: {e}", classify_error(e))
+
+        _return_session(key, session)
+        if response.status_code != 0:
+            error = response.std_err.decode(errors="replace").strip()
+            raise ExecError(f"Win32_Process.Create over WinRM on {ip} returned {response.status_code}: {error}",
+                            classify_error(error))
+
+
+# Idle WinRM sessions by (endpoint, user, password digest). A session keeps its HTTP
+# connection and NTLM context, so a re-scan of the host does not handshake again.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _take_session(key):
+    with _sessions_lock:
+        entry = _sessions.pop(key, None)
+    if entry and time.monotonic() - entry[1] <= SESSION_TTL:
+        return entry[0]
+    return None
+
+
+def _return_session(key, session):
+    with _sessions_lock:
+        if len(_sessions) >= MAX_CACHED_SESSIONS:
+            oldest = min(_sessions, key=lambda k: _sessions[k][1])
+            del _sessions[oldest]
+        _sessions[key] = (session, time.monotonic())
+
+
+def close_sessions():
+    with _sessions_lock:
+        _sessions.clear()
+
+
+# Tried in this order when nothing is known about the host or its subnet
+TRANSPORTS = [
+    WmiTransport(),
+    WinRMTransport("winrm-https", 5986, "https"),
+    WinRMTransport("winrm-http", 5985, "http"),
+]
+
+
+def register_transport(transport, position=None):
+    """Adds a Transport (replacing one of the same name) at `position` in the default order."""
+    TRANSPORTS[:] = [t for t in TRANSPORTS if t.name != transport.name]
+    TRANSPORTS.insert(len(TRANSPORTS) if position is None else position, transport)
+
+
+def transport_ports():
+    """Ports discovery has to probe so that every registered transport can be selected."""
+    return tuple(sorted({t.port for t in TRANSPORTS}))
+
+
+class CapabilityCache:
+    """
+    Working transport per host and per subnet, with expiry. Kept in memory and, when
+    persistent, written through to the transport_capabilities table of the jobs DB so it
+    survives restarts. Collectors keep it in memory only.
+    """
+
+    def __init__(self, persistent=True):
+        self.lock = threading.Lock()
+        self.entries = None
+        self.persistent = persistent
+
+    def _execute(self, sql, params=(), fetch=None):
+        if not self.persistent:
+            return []
+        # Imported here so that collectors, which never open the jobs DB, do not load it
+        from utils.job_manager import execute
+        return execute(sql, params, fetch)
+
+    def _load(self):
+        if self.entries is None:
+            rows = self._execute("SELECT scope, key, transport, expires FROM transport_capabilities WHERE expires > ?",
+                                 (time.time(),), fetch="all")
+            self.entries = {(scope, key): (transport, expires) for scope, key, transport, expires in rows}
+        return self.entries
+
+    def get(self, scope, key):
+        with self.lock:
+            entry = self._load().get((scope, key))
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def put(self, scope, key, transport, ttl):
+        expires = time.time() + ttl
+        with self.lock:
+            entries = self._load()
+            current = entries.get((scope, key))
+            if current and current[0] == transport and current[1] > expires - REFRESH_SLACK:
+                return
+            entries[(scope, key)] = (transport, expires)
+        self._execute('''
+            INSERT INTO transport_capabilities (scope, key, transport, expires) VALUES (?, ?, ?, ?)
+            ON CONFLICT (scope, key) DO UPDATE SET transport = excluded.transport, expires = excluded.expires
+        ''', (scope, key, transport, expires))
+
+    def forget(self, scope, key):
+        with self.lock:
+            if self._load().pop((scope, key), None) is None:
+                return
+        self._execute("DELETE FROM transport_capabilities WHERE scope = ? AND key = ?", (scope, key))
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            live = [(scope, transport) for (scope, _), (transport, expires) in self._load().items() if expires > now]
+        counts = {}
+        for scope, transport in live:
+            counts.setdefault(scope, {}).setdefault(transport, 0)
+            counts[scope][transport] += 1
+        return counts
+
+
+capabilities = CapabilityCache()
+
+
+def select_transports(ip, open_ports):
+    """
+    Usable transports for ip in the order they should be tried: the host's known working
+    transport, then its subnet's, then the default order. Only transports whose port
+    answered during discovery are returned.
+    """
+    usable = [t for t in TRANSPORTS if t.port in open_ports and t.available()]
+    preferred = [capabilities.get("host", ip), capabilities.get("subnet", subnet_of(ip))]
+    rank = {name: i for i, name in enumerate(preferred) if name}
+    return sorted(usable, key=lambda t: rank.get(t.name, len(preferred)))
+
+
+def launch(project_name, ip, username, password, domain, server_ip, transports):
+    """
+    Tries transports (from select_transports()) until one starts the agent.
+    Returns (transport name, outcome); outcome is 'success' or the last failure kind.
+    """
+    known = capabilities.get("host", ip)
+    outcome = "error"
+    for transport in transports:
+        outcome = transport.launch(project_name, ip, username, password, domain, server_ip)
+        if outcome == "success":
+            capabilities.put("host", ip, transport.name, CAPABILITY_TTL)
+            capabilities.put("subnet", subnet_of(ip), transport.name, SUBNET_TTL)
+            return transport.name, outcome
+        if transport.name == known:
+            # What worked before does not any more; learn the host again
+            capabilities.forget("host", ip)
+        if outcome in FINAL_OUTCOMES:
+            return transport.name, outcome
+        logger.info(f"{transport.name} failed on {ip} ({outcome}); trying the next transport")
+    return (transports[-1].name if transports else None), outcome
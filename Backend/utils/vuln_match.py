@@ -0,0 +1,505 @@
+# vuln_match.py
+import atexit
+import bisect
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import msgpack
+from utils.db_pool import register_schema, run_script, reader, submit_write, DB_DIR
+from utils.logging_config import setup_logging
+
+logger = setup_logging()
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FEED_DIR = os.environ.get("VULN_FEED_DIR", os.path.join(BASE_DIR, "feeds"))
+# Compiled index of the current feed files, reused across restarts until the files change
+INDEX_CACHE = os.path.join(BASE_DIR, "state", "vuln_index.msgpack")
+
+SYNC_INTERVAL = 1.0         # seconds between matching runs for projects that received uploads
+FEED_CHECK_INTERVAL = 60.0  # seconds between checks of the feed directory for new files
+MATCH_BATCH = 500           # latest assets matched per write
+CHUNK = 500                 # values per IN (...) list
+MAX_PAGE_SIZE = 1000
+MATCH_REVISION = 2          # bumped when matching rules change; every product is then re-matched
+
+VULN_SCHEMA = '''
+-- Hits are kept per installed package (normalized name and version), hosts are reached
+-- through asset_software, so a package shared by the whole fleet is matched and stored once
+CREATE TABLE IF NOT EXISTS software_vulnerabilities (
+    name_norm TEXT NOT NULL,
+    version TEXT NOT NULL,
+    cve_id TEXT NOT NULL,
+    match_key TEXT NOT NULL,
+    cpe TEXT NOT NULL,
+    severity TEXT,
+    score REAL,
+    PRIMARY KEY (name_norm, version, cve_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_software_vulns_cve ON software_vulnerabilities (cve_id);
+CREATE INDEX IF NOT EXISTS idx_software_vulns_key ON software_vulnerabilities (match_key);
+
+-- Digest of the feed entries each product key was last matched against
+CREATE TABLE IF NOT EXISTS vuln_match_keys (
+    match_key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS vuln_match_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    feed TEXT,
+    last_scan_id INTEGER NOT NULL
+);
+'''
+
+register_schema(lambda conn: run_script(conn, VULN_SCHEMA))
+
+
+# --- Versions -------------------------------------------------------------------------------
+
+VERSION_PARTS = 12
+_VERSION_TOKEN = re.compile(r"\d+|[a-z]+")
+# Tokens that mark a version before its release; other letters are post-release suffixes
+PRE_RELEASE = {"dev": 0, "alpha": 1, "beta": 2, "pre": 3, "preview": 3, "rc": 4}
+_ZERO = (2, 0, "")
+LOWEST = ((-1, 0, ""),)
+HIGHEST = ((4, 0, ""),)
+
+
+def version_key(text):
+    """
+    Comparable key of a version string: numeric parts compare as numbers, pre-release
+    tokens rank below the release (1.0rc1 < 1.0), other letters above it (1.0.1 < 1.0.1a),
+    letters before the first number are ignored (v1.2 == 1.2) and missing parts count as
+    zero (1 == 1.0).
+    """
+    parts = []
+    for token in _VERSION_TOKEN.findall(str(text).lower()):
+        if token.isdigit():
+            parts.append((2, int(token), ""))
+        elif not parts:
+            continue
+        elif token in PRE_RELEASE:
+            parts.append((0, PRE_RELEASE[token], token))
+        else:
+            parts.append((3, 0, token))
+    if len(parts) < VERSION_PARTS:
+        parts += [_ZERO] * (VERSION_PARTS - len(parts))
+    return tuple(parts)
+
+
+# --- Product names --------------------------------------------------------------------------
+
+_BRACKETS = re.compile(r"\([^)]*\)|\[[^\]]*\]|[®™]|\(r\)|\(tm\)")
+_VERSION_WORD = re.compile(r"^v?\d+([.\-_]\d+)*[a-z]?$")
+_NOISE_WORDS = frozenset(("x64", "x86", "amd64", "arm64", "64-bit", "32-bit", "-", "en-us", "version"))
+
+
+def software_key(name):
+    """
+    Normalized product name of an installed package: lowercase, without bracketed notes,
+    architecture words and embedded version numbers ("Mozilla Firefox 115.0 (x64 en-US)"
+    -> "mozilla firefox").
+    """
+    text = _BRACKETS.sub(" ", str(name or "").lower())
+    words = [word for word in re.split(r"[\s,]+", text)
+             if word and word not in _NOISE_WORDS and not _VERSION_WORD.match(word)]
+    return " ".join(words)
+
+
+def cpe_keys(vendor, product):
+    """Index keys of a CPE vendor/product: "vendor product" and the bare product name."""
+    vendor = vendor.replace("_", " ")
+    product = product.replace("_", " ")
+    keys = {product}
+    if not product.startswith(vendor):
+        keys.add(f"{vendor} {product}")
+    return keys
+
+
+def _split_cpe(uri):
+    # cpe:2.3:part:vendor:product:version:update:... with backslash-escaped punctuation
+    fields = re.split(r"(?<!\\):", uri)
+    return [field.replace("\\", "") for field in fields]
+
+
+# --- Feed -----------------------------------------------------------------------------------
+
+def feed_files(feed_dir=None):
+    feed_dir = feed_dir or FEED_DIR
+    return sorted(glob.glob(os.path.join(feed_dir, "*.json")) + glob.glob(os.path.join(feed_dir, "*.json.gz")))
+
+
+def feed_signature(files):
+    """Identifies a set of feed files by name, size and mtime; None when there is no feed."""
+    if not files:
+        return None
+    digest = hashlib.sha1(f"rev{MATCH_REVISION};".encode())
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def _iter_cpe_matches(nodes):
+    for node in nodes or ():
+        yield from node.get("cpe_match") or node.get("cpeMatch") or ()
+        yield from _iter_cpe_matches(node.get("children"))
+
+
+def _iter_feed(data):
+    """(cve_id, severity, score, cpe match dicts) for NVD 1.1 feeds and API 2.0 dumps."""
+    for item in data.get("CVE_Items") or ():
+        impact = item.get("impact") or {}
+        cvss = (impact.get("baseMetricV3") or {}).get("cvssV3") or {}
+        severity = cvss.get("baseSeverity") or (impact.get("baseMetricV2") or {}).get("severity")
+        score = cvss.get("baseScore", (impact.get("baseMetricV2") or {}).get("cvssV2", {}).get("baseScore"))
+        yield (item["cve"]["CVE_data_meta"]["ID"], severity, score,
+               _iter_cpe_matches((item.get("configurations") or {}).get("nodes")))
+    for item in data.get("vulnerabilities") or ():
+        cve = item["cve"]
+        severity = score = None
+        for metric in ("cvssMetricV31", "cvssMetricV30", "cvssMetricV2"):
+            entries = (cve.get("metrics") or {}).get(metric)
+            if entries:
+                cvss = entries[0].get("cvssData") or {}
+                severity = cvss.get("baseSeverity") or entries[0].get("baseSeverity")
+                score = cvss.get("baseScore")
+                break
+        nodes = [node for config in cve.get("configurations") or () for node in config.get("nodes") or ()]
+        yield cve["id"], severity, score, _iter_cpe_matches(nodes)
+
+
+def _load_entries(files):
+    """Reads feed files into {key: [[cpe, cve, severity, score, start, start_incl, end, end_incl], ...]}."""
+    products = {}
+    for path in files:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        for cve_id, severity, score, matches in _iter_feed(data):
+            for match in matches:
+                if not match.get("vulnerable", True):
+                    continue
+                fields = _split_cpe(match.get("cpe23Uri") or match.get("criteria") or "")
+                if len(fields) < 6 or fields[2] != "a":
+                    continue
+                vendor, product, version = fields[3], fields[4], fields[5]
+                start, start_incl = match.get("versionStartIncluding"), True
+                if start is None and match.get("versionStartExcluding") is not None:
+                    start, start_incl = match["versionStartExcluding"], False
+                end, end_incl = match.get("versionEndIncluding"), True
+                if end is None and match.get("versionEndExcluding") is not None:
+                    end, end_incl = match["versionEndExcluding"], False
+                if start is None and end is None and version not in ("*", "-", ""):
+                    start = end = version
+                    start_incl = end_incl = True
+                entry = [f"{vendor}:{product}", cve_id, severity, score, start, start_incl, end, end_incl]
+                for key in cpe_keys(vendor, product):
+                    products.setdefault(key, []).append(entry)
+    return products
+
+
+class ProductRanges:
+    """Version intervals of one product key, sorted by upper bound for bisect lookups."""
+
+    def __init__(self, entries, keys):
+        bounded = []
+        for cpe, cve_id, severity, score, start, start_incl, end, end_incl in entries:
+            start_key = keys(start) if start is not None else LOWEST
+            end_key = keys(end) if end is not None else HIGHEST
+            bounded.append((end_key, end_incl, start_key, start_incl, cpe, cve_id, severity, score))
+        bounded.sort(key=lambda entry: entry[0])
+        self.ends = [entry[0] for entry in bounded]
+        self.entries = bounded
+
+    def match(self, version):
+        """(cpe, cve_id, severity, score) of every interval that contains the version key."""
+        hits = []
+        # Only intervals ending at or above the version can contain it
+        for end_key, end_incl, start_key, start_incl, cpe, cve_id, severity, score in \
+                self.entries[bisect.bisect_left(self.ends, version):]:
+            if (end_key == version and not end_incl) or start_key > version or \
+                    (start_key == version and not start_incl):
+                continue
+            hits.append((cpe, cve_id, severity, score))
+        return hits
+
+
+class FeedIndex:
+    """The compiled feed: product key -> ProductRanges, plus a digest of each key's entries."""
+
+    def __init__(self, signature, products):
+        self.signature = signature
+        self.digests = {key: hashlib.sha1(f"rev{MATCH_REVISION};".encode() +
+                                          msgpack.packb(sorted(entries, key=str))).hexdigest()
+                        for key, entries in products.items()}
+        cache = {}
+
+        def keys(text):
+            key = cache.get(text)
+            if key is None:
+                key = cache[text] = version_key(text)
+            return key
+
+        self.products = {key: ProductRanges(entries, keys) for key, entries in products.items()}
+
+    def match(self, key, version):
+        ranges = self.products.get(key)
+        if ranges is None or version in (None, ""):
+            return []
+        return ranges.match(version_key(version))
+
+
+def load_index(feed_dir=None):
+    """Compiles the feed files, reusing the on-disk index while the files are unchanged."""
+    files = feed_files(feed_dir)
+    signature = feed_signature(files)
+    if signature is None:
+        return FeedIndex(None, {})
+    try:
+        with open(INDEX_CACHE, "rb") as f:
+            cached = msgpack.unpackb(f.read(), strict_map_key=False)
+        if cached.get("signature") == signature:
+            return FeedIndex(signature, cached["products"])
+    except (OSError, ValueError, msgpack.UnpackException):
+        pass
+
+    started = time.perf_counter()
+    products = _load_entries(files)
+    os.makedirs(os.path.dirname(INDEX_CACHE), exist_ok=True)
+    temp_path = f"{INDEX_CACHE}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(msgpack.packb({"signature": signature, "products": products}))
+    os.replace(temp_path, INDEX_CACHE)
+    logger.info(f"Compiled the vulnerability feed ({len(files)} files, {len(products)} products) "
+                f"in {time.perf_counter() - started:.1f}s")
+    return FeedIndex(signature, products)
+
+
+# --- Matching -------------------------------------------------------------------------------
+
+def match_packages(index, packages):
+    """
+    Hits for distinct installed packages [(name_norm, version)]: one index lookup per package,
+    however many hosts have it installed. Rows are ready for software_vulnerabilities.
+    """
+    hits = []
+    for name_norm, version in packages:
+        key = software_key(name_norm)
+        for cpe, cve_id, severity, score in index.match(key, version):
+            hits.append((name_norm, version, cve_id, key, cpe, severity, score))
+    return hits
+
+
+def _store_hits(hits, keys=(), digests=None, feed=None, last_scan_id=None, stale_keys=()):
+    """
+    Writer work item: drops the hits of `stale_keys`, adds `hits` and records the digests of
+    `keys`. The progress marker is only moved when last_scan_id is given, so an interrupted
+    re-match is simply redone.
+    """
+    def store(conn):
+        for start in range(0, len(stale_keys), CHUNK):
+            chunk = stale_keys[start:start + CHUNK]
+            conn.execute(f"DELETE FROM software_vulnerabilities WHERE match_key IN ({','.join('?' * len(chunk))})",
+                         chunk)
+        conn.executemany('''
+            INSERT OR IGNORE INTO software_vulnerabilities
+                (name_norm, version, cve_id, match_key, cpe, severity, score)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', hits)
+        conn.executemany("INSERT OR REPLACE INTO vuln_match_keys (match_key, digest) VALUES (?, ?)",
+                         [(key, digests.get(key, "")) for key in keys])
+        if last_scan_id is not None:
+            conn.execute('''
+                INSERT INTO vuln_match_state (id, feed, last_scan_id) VALUES (1, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET feed = excluded.feed,
+                    last_scan_id = MAX(last_scan_id, excluded.last_scan_id)
+            ''', (feed, last_scan_id))
+        return len(hits)
+    return store
+
+
+def _rematch(project, index):
+    """
+    Re-matches after a feed change, limited to the product keys whose feed entries differ
+    from the ones the project was last matched against. Assets scanned since the last run
+    are matched in full as well, so the progress marker can move past them.
+    """
+    with reader(project) as conn:
+        row = conn.execute("SELECT last_scan_id FROM vuln_match_state WHERE id = 1").fetchone()
+        matched_upto = row[0] if row else 0
+        last_scan_id = conn.execute("SELECT coalesce(MAX(scan_id), 0) FROM assets").fetchone()[0]
+        matched = dict(conn.execute("SELECT match_key, digest FROM vuln_match_keys"))
+        names = {}
+        for (name_norm,) in conn.execute("SELECT DISTINCT name_norm FROM asset_software"):
+            names.setdefault(software_key(name_norm), []).append(name_norm)
+        stale = [key for key in names if index.digests.get(key, "") != matched.get(key, "")]
+        stale_names = [name for key in stale for name in names[key]]
+        packages = set()
+        for start in range(0, len(stale_names), CHUNK):
+            chunk = stale_names[start:start + CHUNK]
+            packages.update(conn.execute(f'''
+                SELECT DISTINCT name_norm, coalesce(version, '') FROM asset_software
+                WHERE name_norm IN ({','.join('?' * len(chunk))})
+            ''', chunk))
+        # Not matched yet at all: their unchanged products would be skipped otherwise
+        pending = conn.execute('''
+            SELECT DISTINCT name_norm, coalesce(version, '') FROM asset_software
+            WHERE scan_id IN (SELECT scan_id FROM assets WHERE is_latest = 1 AND scan_id > ? AND scan_id <= ?)
+        ''', (matched_upto, last_scan_id)).fetchall()
+        packages.update(pending)
+
+    packages = sorted(packages)
+    hits = match_packages(index, packages)
+    keys = sorted(set(stale) | {software_key(name_norm) for name_norm, _ in pending})
+    # Digests of keys the project no longer has are kept; they only cause a needless re-match
+    submit_write(project, _store_hits(hits, keys, index.digests, index.signature, last_scan_id, stale)).result()
+    if stale:
+        logger.info(f"Vulnerability re-match of project {project}: {len(stale)} products changed, "
+                    f"{len(packages)} packages, {len(hits)} hits")
+    return len(hits)
+
+
+def match_project(project, index):
+    """Matches the packages of assets scanned since the project's last run. Returns new hits."""
+    with reader(project) as conn:
+        row = conn.execute("SELECT feed, last_scan_id FROM vuln_match_state WHERE id = 1").fetchone()
+    stored = 0
+    if row is None or row[0] != index.signature:
+        stored += _rematch(project, index)
+        with reader(project) as conn:
+            row = conn.execute("SELECT feed, last_scan_id FROM vuln_match_state WHERE id = 1").fetchone()
+    last_scan_id = row[1]
+
+    while True:
+        with reader(project) as conn:
+            scan_ids = [scan_id for (scan_id,) in conn.execute('''
+                SELECT scan_id FROM assets WHERE is_latest = 1 AND scan_id > ? ORDER BY scan_id LIMIT ?
+            ''', (last_scan_id, MATCH_BATCH))]
+            if not scan_ids:
+                return stored
+            packages = conn.execute(f'''
+                SELECT DISTINCT name_norm, coalesce(version, '') FROM asset_software
+                WHERE scan_id IN ({','.join('?' * len(scan_ids))})
+            ''', scan_ids).fetchall()
+        hits = match_packages(index, packages)
+        keys = sorted({software_key(name_norm) for name_norm, _ in packages})
+        last_scan_id = scan_ids[-1]
+        stored += submit_write(project, _store_hits(hits, keys, index.digests, index.signature,
+                                                    last_scan_id)).result()
+
+
+def list_vulnerabilities(conn, system_name=None, cve_id=None, severity=None, limit=200, after=None):
+    """
+    Known CVEs of the packages on each host's latest scan, in (scan_id, cve_id, software,
+    version) order, one page at a time; `after` is the sort key of the previous page's last row.
+    """
+    clauses = ["a.is_latest = 1"]
+    params = []
+    if system_name:
+        clauses.append("a.system_name = ?")
+        params.append(system_name)
+    if cve_id:
+        clauses.append("v.cve_id = ?")
+        params.append(cve_id.upper())
+    if severity:
+        clauses.append("upper(v.severity) = ?")
+        params.append(severity.upper())
+    if after:
+        scan_id, cve_after, software_after, version_after = after
+        clauses.append("a.scan_id >= ? AND (a.scan_id, v.cve_id, s.name, coalesce(s.version, '')) > (?, ?, ?, ?)")
+        params += [int(scan_id), int(scan_id), str(cve_after), str(software_after), str(version_after)]
+    # Without a CVE to look up, walking assets in scan_id order (CROSS JOIN fixes the join
+    # order) lets SQLite stop after one page instead of sorting every hit of the project
+    join = "JOIN" if cve_id else "CROSS JOIN"
+    rows = conn.execute(f'''
+        SELECT a.scan_id, v.cve_id, s.name, coalesce(s.version, ''), a.system_name, a.client_ip, v.cpe,
+               v.severity, v.score
+        FROM assets a
+        {join} asset_software s ON s.scan_id = a.scan_id
+        {join} software_vulnerabilities v ON v.name_norm = s.name_norm AND v.version = coalesce(s.version, '')
+        WHERE {" AND ".join(clauses)}
+        ORDER BY a.scan_id, v.cve_id, s.name, coalesce(s.version, '')
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+    return [{"scan_id": row[0], "cve_id": row[1], "software": row[2], "version": row[3], "system_name": row[4],
+             "client_ip": row[5], "cpe": row[6], "severity": row[7], "score": row[8]} for row in rows]
+
+
+# --- Background matching --------------------------------------------------------------------
+
+_index = None
+_dirty = set()
+_dirty_lock = threading.Lock()
+_match_thread = None
+_stopping = threading.Event()
+
+
+def mark_dirty(project):
+    """Schedules matching of a project that just received data."""
+    with _dirty_lock:
+        _dirty.add(project)
+
+
+def match_all(index):
+    projects = sorted(name[:-3] for name in os.listdir(DB_DIR) if name.endswith(".db"))
+    for project in projects:
+        try:
+            match_project(project, index)
+        except sqlite3.Error as e:
+            logger.error(f"Vulnerability matching of project {project} failed: {e}")
+    return projects
+
+
+def _match_loop():
+    global _index
+    checked_at = 0.0
+    while not _stopping.is_set():
+        if time.monotonic() - checked_at >= FEED_CHECK_INTERVAL:
+            checked_at = time.monotonic()
+            try:
+                signature = feed_signature(feed_files())
+                if _index is None or signature != _index.signature:
+                    _index = load_index()
+                    # A new feed: every project re-matches the products that changed
+                    match_all(_index)
+            except Exception as e:
+                logger.error(f"Loading the vulnerability feed failed: {e}")
+        if _index is not None:
+            with _dirty_lock:
+                projects = list(_dirty)
+                _dirty.clear()
+            for project in projects:
+                try:
+                    match_project(project, _index)
+                except Exception as e:
+                    # Picked up again on the next upload or restart; last_scan_id did not move
+                    logger.error(f"Vulnerability matching of project {project} failed: {e}")
+        _stopping.wait(SYNC_INTERVAL)
+
+
+def start_matching():
+    """Starts the background thread that loads the feed and matches uploaded assets against it."""
+    global _match_thread
+    with _dirty_lock:
+        if _match_thread is not None:
+            return
+        _match_thread = threading.Thread(target=_match_loop, name="vuln-match", daemon=True)
+    _match_thread.start()
+
+
+atexit.register(_stopping.set)
+
+
+if __name__ == "__main__":
+    # python -m utils.vuln_match  (compiles the feed in feeds/ and matches every project)
+    started = time.perf_counter()
+    index = load_index()
+    print(f"Feed: {len(index.products)} product keys ({time.perf_counter() - started:.1f}s)")
+    for name in match_all(index):
+        print(f"{name}: matched")
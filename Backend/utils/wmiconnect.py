@@ -4,50 +4,105 @@ import logging
 import os
 import sys
 import base64
-from utils.logging_config import setup_logging
-from utils.store_data import create_db_and_store_results
+import time
+from utils.logging_config import setup_logging, log_command_output
+from utils import impacket_exec
+from utils.metrics import EXEC_SECONDS
 
 # Set up the logger from the centralized config
 logger = setup_logging()
 
+# "impacket" runs in-process on a shared worker pool, "subprocess" spawns wmiexec.py per host
+EXEC_BACKEND = "impacket"
+SUBPROCESS_TIMEOUT = 180
+
 def encode_powershell_command(command):
     return base64.b64encode(command.encode("utf-16le")).decode()
 
-def connect_and_execute(project_name, ip, username, password, domain, server_ip):
+def build_agent_command(project_name, ip, server_ip):
+    r"""Builds the encoded PowerShell one-liner that downloads the agent to C:\Windows\Temp and runs it."""
+    raw_ps = rf"""
+        $url = 'http://{server_ip}/download';
+        $dest = 'C:\\Windows\\Temp\\script.ps1';
+        Invoke-WebRequest -Uri $url -OutFile $dest;
+        powershell -ExecutionPolicy Bypass -File $dest -ServerUrl 'http://{server_ip}/upload' -ProjectName {project_name} -scan_ip {ip}
+        """
+    return f"powershell -EncodedCommand {encode_powershell_command(raw_ps)}"
+
+def record_login_failure(project_name, ip):
+    from utils.store_data import create_db_and_store_results
+    status = "Failed"
+    data = "Error during login"
+    system_name = ""
+    create_db_and_store_results(project_name, ip, system_name, status, data)
+
+def execute_with_subprocess(ip, username, password, domain, command):
+    """Runs the command through a separate wmiexec.py interpreter. Returns (ok, output)."""
+    user = f"{domain}/{username}" if domain else username
+    wmiexec_path = os.path.abspath("venv/bin/wmiexec.py")
+
+    cmd = [
+        sys.executable,
+        wmiexec_path,
+        f"{user}:{password}@{ip}",
+        command
+    ]
+
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                timeout=SUBPROCESS_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return False, f"wmiexec.py timed out after {SUBPROCESS_TIMEOUT}s"
+
+    if result.returncode == 0:
+        return True, result.stdout
+    return False, result.stderr
+
+def connect_and_execute(project_name, ip, username, password, domain, server_ip, backend=None):
     r"""Downloads the PowerShell script to C:\Windows\Temp and executes it remotely."""
+    return launch_agent(project_name, ip, username, password, domain, server_ip, backend) == "success"
+
+def launch_agent(project_name, ip, username, password, domain, server_ip, backend=None, record_failure=None):
+    """
+    Same as connect_and_execute() but returns the outcome:
+    'success', or the failure kind 'auth', 'unreachable', 'timeout' or 'error'.
+    Login failures are stored with record_failure(project_name, ip), by default
+    record_login_failure().
+    """
+    backend = backend or EXEC_BACKEND
+    record_failure = record_failure or record_login_failure
     try:
-        raw_ps = rf"""
-            $url = 'http://{server_ip}/download';
-            $dest = 'C:\\Windows\\Temp\\script.ps1';
-            Invoke-WebRequest -Uri $url -OutFile $dest;
-            powershell -ExecutionPolicy Bypass -File $dest -ServerUrl 'http://{server_ip}/upload' -ProjectName {project_name} -scan_ip {ip}
-            """
-        encoded = encode_powershell_command(raw_ps)
-
-        user = f"{domain}/{username}" if domain else username
-        wmiexec_path = os.path.abspath("venv/bin/wmiexec.py")
-
-        cmd = [
-            sys.executable,
-            wmiexec_path,
-            f"{user}:{password}@{ip}",
-            f"powershell -EncodedCommand {encoded}"
-        ]
-
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        if result.returncode == 0:
-            logger.info(f"[+] Output from {ip}:\n{result.stdout}")
-            return True
+        command = build_agent_command(project_name, ip, server_ip)
+
+        if backend == "impacket" and impacket_exec.IMPACKET_AVAILABLE:
+            started = time.perf_counter()
+            try:
+                impacket_exec.execute(ip, username, password, domain, command)
+                EXEC_SECONDS.observe(time.perf_counter() - started, backend="impacket", outcome="success")
+                logger.info(f"[+] Agent launched on {ip} (in-process WMI)")
+                return "success"
+            except impacket_exec.ExecError as e:
+                EXEC_SECONDS.observe(time.perf_counter() - started, backend="impacket", outcome=e.kind)
+                if e.kind in ("auth", "unreachable", "timeout"):
+                    # Retrying the same credentials or a hung host through wmiexec.py would not help
+                    record_failure(project_name, ip)
+                    logger.error(f"[!] Error from {ip}: {e}")
+                    return e.kind
+                logger.warning(f"[!] In-process WMI failed on {ip}, falling back to wmiexec.py: {e}")
+
+        started = time.perf_counter()
+        ok, output = execute_with_subprocess(ip, username, password, domain, command)
+        if ok:
+            EXEC_SECONDS.observe(time.perf_counter() - started, backend="subprocess", outcome="success")
+            log_command_output(logger, ip, output)
+            return "success"
         else:
-            status = "Failed"
-            data = "Error during login"
-            system_name = ""
-            create_db_and_store_results(project_name, ip, system_name, status, data)
-            logger.error(f"[!] Error from {ip}:\n{result.stderr}")
-            return False
+            record_failure(project_name, ip)
+            log_command_output(logger, ip, output, ok=False)
+            kind = "timeout" if output.startswith("wmiexec.py timed out") else impacket_exec.classify_error(output)
+            EXEC_SECONDS.observe(time.perf_counter() - started, backend="subprocess", outcome=kind)
+            return kind
 
     except Exception as e:
         logger.exception(f"[!] Exception on {ip}: {e}")
-        return False
-
+        return "error"
@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useEffect, useState } from "react";
 import axios from "axios";
 import Header from "@/components/ui/header"; // Adjust path as needed
 import Sidebar from "@/components/ui/sidebar";// Adjust path as needed
@@ -12,6 +12,33 @@ const Scan: React.FC = () => {
   const [serverIp, setServerIp] = useState("");
   const [message, setMessage] = useState("");
   const [messageType, setMessageType] = useState<"success" | "error" | "">("");
+  const [jobId, setJobId] = useState<string | null>(null);
+
+  // Scans run as background jobs; follow the job's progress until it stops
+  useEffect(() => {
+    if (!jobId) return;
+    const timer = setInterval(async () => {
+      try {
+        const { data: job } = await axios.get(`http://127.0.0.1:80/scans/${jobId}`);
+        if (job.status === "completed") {
+          setMessage(`Scan completed: ${job.counts.launched + job.counts.uploaded} of ${job.total} hosts launched.`);
+          setMessageType("success");
+        } else if (job.status === "failed" || job.status === "interrupted") {
+          setMessage(job.message || `Scan ${job.status}.`);
+          setMessageType("error");
+        } else {
+          setMessage(`Scan ${job.status}: ${job.processed} of ${job.total} hosts processed.`);
+          return;
+        }
+        setJobId(null);
+      } catch (error) {
+        setMessage("Lost track of the scan progress.");
+        setMessageType("error");
+        setJobId(null);
+      }
+    }, 2000);
+    return () => clearInterval(timer);
+  }, [jobId]);
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -43,9 +70,10 @@ const Scan: React.FC = () => {
         },
       });
 
-      if (response.status === 200) {
+      if (response.status === 202) {
         setMessage(response.data.message || "Scan started successfully.");
         setMessageType("success");
+        setJobId(response.data.job_id);
       } else {
         setMessage("Failed to start scan.");
         setMessageType("error");
@@ -25,16 +25,35 @@ export default function MainPage() {
   const [error, setError] = useState<string | null>(null);
 
   useEffect(() => {
-    axios
-      .get(`http://127.0.0.1:80/project/${projectName}`)
-      .then((response) => {
-        setAssets(response.data.devices);
+    let cancelled = false;
+    // The device list comes one page at a time; follow next_cursor to the last page
+    const fetchAll = async () => {
+      const devices: Asset[] = [];
+      let cursor: string | null = null;
+      do {
+        const response: { data: { devices: Asset[]; next_cursor: string | null } } = await axios.get(
+          `http://127.0.0.1:80/project/${projectName}`,
+          { params: cursor ? { cursor } : {} }
+        );
+        devices.push(...response.data.devices);
+        cursor = response.data.next_cursor;
+      } while (cursor && !cancelled);
+      return devices;
+    };
+    fetchAll()
+      .then((devices) => {
+        if (cancelled) return;
+        setAssets(devices);
         setLoading(false);
       })
       .catch(() => {
+        if (cancelled) return;
         setError("Error fetching assets. Please try again.");
         setLoading(false);
       });
+    return () => {
+      cancelled = true;
+    };
   }, [projectName]);
 
   if (loading) return <div>Loading...</div>;